@@ -1,15 +1,94 @@
-from fastapi import FastAPI, HTTPException
+import time
+_BOOT_T0 = time.perf_counter()
+
+def _since(t0):
+    return round((time.perf_counter() - t0) * 1000, 1)
+
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-import yfinance as yf
-import pandas as pd
+from fastapi.responses import Response, StreamingResponse
+_EAGER_IMPORTS = {"fastapi": _since(_BOOT_T0)}
+_t = time.perf_counter()
 import numpy as np
-import requests
+_EAGER_IMPORTS["numpy"] = _since(_t)
+import asyncio
+import contextvars
 import datetime
+import hashlib
+import hmac
+import importlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from typing import Dict, Optional
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # sem orjson a resposta cai para o json da stdlib
+    orjson = None
+
+# Dependências pesadas carregadas só quando uma rota as usa: o cold start da
+# função serverless (ex: /api/vc) deixa de pagar yfinance + pandas + requests.
+_LAZY_IMPORTS = {}   # módulo -> ms do import (no primeiro acesso)
+
+class _LazyModule:
+    """Proxy que importa o módulo no primeiro acesso a um atributo (ex: pd.DataFrame)."""
+    def __init__(self, name):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self):
+        module = object.__getattribute__(self, "_module")
+        if module is None:
+            name = object.__getattribute__(self, "_name")
+            t0 = time.perf_counter()
+            module = importlib.import_module(name)
+            _LAZY_IMPORTS.setdefault(name, _since(t0))
+            object.__setattr__(self, "_module", module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return f"<lazy module '{object.__getattribute__(self, '_name')}'>"
+
+yf = _LazyModule("yfinance")
+pd = _LazyModule("pandas")
+requests = _LazyModule("requests")
+httpx = _LazyModule("httpx")
 
 # NOTA: Removemos 'scipy' para poupar espaço no Vercel. 
 # Implementámos a otimização manualmente abaixo.
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # WB_PREFETCH=1: aquece a cache de todos os indicadores em background no arranque
+    if os.environ.get("WB_PREFETCH") == "1":
+        threading.Thread(target=prefetch_wb_indicators, daemon=True).start()
+    # PANEL_STORE_BUILD=1: (re)constrói o painel local em background se faltar ou estiver velho
+    if os.environ.get("PANEL_STORE_BUILD") == "1" and PANEL_STORE_DIR:
+        age = panel_store_age()
+        if age is None or age > PANEL_STORE_MAX_AGE:
+            threading.Thread(target=_build_panel_store_safe, daemon=True).start()
+    yield
+    for client, _ in list(_async_clients.values()):
+        await client.aclose()
+    _async_clients.clear()
+    _reset_cpu_pool()
+    _reset_dcf_mc_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,6 +105,12 @@ app.add_middleware(
 # Lista de Países (Tese) - ISO Alpha-2 Codes
 TARGET_COUNTRY = "RU" 
 DONOR_POOL = ["SA", "ID", "AO", "AZ", "AU", "BR", "AR", "TR", "CO", "AM", "EC", "CL", "MY", "IN"]
+TREATMENT_YEAR = 2022   # sanções: primeiro ano "tratado"
+
+# ISO2 -> ISO3 dos países da tese (o Banco Mundial responde sempre em ISO3);
+# outros países são resolvidos pelo painel local ou pela lista do Banco Mundial
+COUNTRY_ISO3 = {"RU": "RUS", "SA": "SAU", "ID": "IDN", "AO": "AGO", "AZ": "AZE", "AU": "AUS", "BR": "BRA",
+                "AR": "ARG", "TR": "TUR", "CO": "COL", "AM": "ARM", "EC": "ECU", "CL": "CHL", "MY": "MYS", "IN": "IND"}
 
 # Indicadores do Banco Mundial
 INDICATORS = {
@@ -62,477 +147,3218 @@ def _get_metric(df, key, fallback=[], idx=0):
             except: pass
     return 0.0
 
-def fetch_wb_data(indicator_code):
-    """Busca dados ao Banco Mundial com tratamento de erros robusto."""
-    countries = ";".join([TARGET_COUNTRY] + DONOR_POOL)
-    # ATUALIZAÇÃO: Agora pede dados até 2024
-    url = f"http://api.worldbank.org/v2/country/{countries}/indicator/{indicator_code}?format=json&per_page=5000&date=2010:2024"
-    
+def _json_default(obj):
+    """Fallback sem orjson: arrays/escalares numpy -> listas/floats (NaN -> null)."""
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == "f":
+            return np.where(np.isnan(obj), None, obj).tolist()
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"{type(obj).__name__} não é serializável")
+
+class FastJSONResponse(Response):
+    """
+    JSONResponse serializada com orjson: arrays numpy vão direto para o buffer
+    (sem .tolist() nem jsonable_encoder) e NaN sai como null.
+    """
+    media_type = "application/json"
+
+    def render(self, content):
+        with span("serialize"):
+            if orjson is not None:
+                return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+            return json.dumps(content, default=_json_default, ensure_ascii=False,
+                              separators=(",", ":")).encode("utf-8")
+
+# Rotas que alteram estado persistente exigem o cabeçalho X-Admin-Token igual
+# a ADMIN_TOKEN (o CORS aceita qualquer origem); sem ADMIN_TOKEN ficam desligadas.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def require_admin(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Rota de administração desativada (ADMIN_TOKEN não definido).")
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="X-Admin-Token inválido.")
+
+# ==========================================
+# === 2.1 CACHE DO BANCO MUNDIAL ===
+# ==========================================
+
+# Os indicadores do Banco Mundial mudam poucas vezes por ano: servimos da cache
+# e só voltamos à rede quando o TTL expira. WB_API_URL permite apontar para um
+# servidor local (stub) e testar sem rede.
+WB_API_URL = os.environ.get("WB_API_URL", "http://api.worldbank.org/v2").rstrip("/")
+WB_CACHE_TTL = float(os.environ.get("WB_CACHE_TTL", 7 * 24 * 3600))      # 7 dias "fresco"
+WB_CACHE_STALE = float(os.environ.get("WB_CACHE_STALE", 30 * 24 * 3600)) # +30 dias servido "stale"
+WB_CACHE_SIZE = int(os.environ.get("WB_CACHE_SIZE", 128))
+WB_CACHE_DIR = os.environ.get("WB_CACHE_DIR")  # ex: /tmp/wb_cache (opcional, disco)
+WB_YEARS = (2010, 2024)
+WB_MAX_WORKERS = int(os.environ.get("WB_MAX_WORKERS", 8))   # pedidos simultâneos ao Banco Mundial
+
+class TTLCache:
+    """
+    Cache LRU em memória com TTL e janela stale-while-revalidate.
+    get() devolve (valor, estado) com estado em {"fresh", "stale", "expired", None}.
+    Com name, cada get() conta para api_cache_requests_total (hit/miss por estado).
+    """
+    registry = []   # caches com nome (para as métricas)
+
+    def __init__(self, maxsize=128, ttl=3600.0, stale=0.0, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale = stale
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if name: TTLCache.registry.append(self)
+
+    def get(self, key, now=None, record=True):
+        value, state = self._get(key, now)
+        if record and self.name:
+            METRICS.inc("api_cache_requests_total", cache=self.name, result=state or "miss")
+        return value, state
+
+    def _get(self, key, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            item = self._data.get(key)
+            if item is None: return None, None
+            self._data.move_to_end(key)
+        value, stored_at = item
+        age = now - stored_at
+        if age <= self.ttl: return value, "fresh"
+        if age <= self.ttl + self.stale: return value, "stale"
+        return value, "expired"
+
+    def set(self, key, value, stored_at=None):
+        stored_at = time.time() if stored_at is None else stored_at
+        with self._lock:
+            self._data[key] = (value, stored_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock: self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class SingleFlight:
+    """
+    Junta chamadas concorrentes com a mesma chave: só a primeira vai à rede,
+    as restantes esperam e recebem o mesmo resultado (ou a mesma exceção).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"event": threading.Event(), "result": None, "error": None}
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None: raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock: self._calls.pop(key, None)
+            call["event"].set()
+
+_wb_cache = TTLCache(maxsize=WB_CACHE_SIZE, ttl=WB_CACHE_TTL, stale=WB_CACHE_STALE, name="wb")
+_wb_refreshing = set()
+_wb_refresh_lock = threading.Lock()
+
+def _wb_key(indicator_code, countries, years):
+    return (indicator_code, tuple(sorted(countries)), tuple(years))
+
+def _wb_disk_path(key):
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+    return os.path.join(WB_CACHE_DIR, f"wb_{key[0]}_{digest}.npz")
+
+def _wb_disk_load(key):
+    """Lê um painel guardado em disco (npz colunar). Devolve (df, stored_at) ou None."""
+    if not WB_CACHE_DIR: return None
+    path = _wb_disk_path(key)
+    if not os.path.exists(path): return None
     try:
-        r = requests.get(url, timeout=10)
-        data = r.json()
-        
-        if not data or len(data) < 2: return None
-        
-        records = []
-        for entry in data[1]:
-            if entry['value'] is not None:
-                records.append({
-                    "country": entry['countryiso3code'],
-                    "year": int(entry['date']),
-                    "value": float(entry['value'])
-                })
-        
-        df = pd.DataFrame(records)
-        if df.empty: return None
-        
-        # Pivotar e limpar colunas vazias (países sem dados para este indicador saem fora)
-        pivot_df = df.pivot(index="year", columns="country", values="value").dropna(axis=1)
-        return pivot_df.sort_index()
+        with np.load(path, allow_pickle=False) as z:
+            df = pd.DataFrame(z["values"], index=z["years"], columns=z["countries"])
+            df.index.name = "year"; df.columns.name = "country"
+            return df, float(z["stored_at"])
     except Exception as e:
-        print(f"WB API Error: {e}")
+        print(f"WB Cache Read Error: {e}")
         return None
 
-def optimize_weights_manual(X0, X1, iterations=3000, lr=1e-4):
+def _wb_disk_save(key, df, stored_at):
+    if not WB_CACHE_DIR: return
+    try:
+        os.makedirs(WB_CACHE_DIR, exist_ok=True)
+        path = _wb_disk_path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, years=df.index.values.astype(np.int64),
+                     countries=np.array(df.columns, dtype=str),
+                     values=df.values.astype(np.float64),
+                     stored_at=np.float64(stored_at))
+        os.replace(tmp, path) # escrita atómica
+    except Exception as e:
+        print(f"WB Cache Write Error: {e}")
+
+def _parse_wb_payload(data):
+    """Converte o JSON do Banco Mundial num painel ano x país."""
+    if not data or len(data) < 2 or not data[1]: return None
+
+    rows = [(e['countryiso3code'], int(e['date']), float(e['value']))
+            for e in data[1] if e['value'] is not None]
+    if not rows: return None
+    df = pd.DataFrame(rows, columns=["country", "year", "value"])
+
+    # Pivotar e limpar colunas vazias (países sem dados para este indicador saem fora)
+    pivot_df = df.pivot(index="year", columns="country", values="value").dropna(axis=1)
+    return pivot_df.sort_index()
+
+def _wb_url(indicator_code, countries, years, page=1):
+    # Uma linha por país e ano: per_page chega para tudo numa só página
+    # (com agregados ou países a mais do que o pedido seguimos data[0]["pages"])
+    per_page = max(1000, len(countries) * (years[1] - years[0] + 1))
+    return (f"{WB_API_URL}/country/{';'.join(countries)}/indicator/{indicator_code}"
+            f"?format=json&per_page={per_page}&date={years[0]}:{years[1]}&page={page}")
+
+def _wb_pages(data, entries):
+    """Junta as linhas de uma página; devolve o nº total de páginas (1 se não houver metadados)."""
+    if not data or len(data) < 2 or not data[1]: return 1
+    entries.extend(data[1])
+    return int(data[0].get("pages") or 1)
+
+def _get_wb_client():
+    # Ligações limitadas a WB_MAX_WORKERS: um lote de 15 indicadores reutiliza
+    # ligações keep-alive em vez de abrir 15 de uma vez (e levar com throttling)
+    return _get_async_client(
+        "wb", timeout=10,
+        limits=httpx.Limits(max_connections=WB_MAX_WORKERS, max_keepalive_connections=WB_MAX_WORKERS))
+
+def _fetch_wb_remote(indicator_code, countries, years):
+    entries, page, pages = [], 1, 1
+    try:
+        with span("fetch"):
+            while page <= pages:
+                data = requests.get(_wb_url(indicator_code, countries, years, page), timeout=10).json()
+                pages = _wb_pages(data, entries)
+                page += 1
+    except Exception:
+        record_upstream("worldbank", False)
+        raise
+    record_upstream("worldbank", True)
+    with span("parse"):
+        return _parse_wb_payload([{}, entries])
+
+async def _fetch_wb_remote_async(indicator_code, countries, years):
+    entries, page, pages = [], 1, 1
+    try:
+        with span("fetch"):
+            client = _get_wb_client()
+            while page <= pages:
+                r = await client.get(_wb_url(indicator_code, countries, years, page))
+                pages = _wb_pages(r.json(), entries)
+                page += 1
+    except Exception:
+        record_upstream("worldbank", False)
+        raise
+    record_upstream("worldbank", True)
+    with span("parse"):
+        return _parse_wb_payload([{}, entries])
+
+def _wb_lookup(key):
+    """Memória e, se não estiver lá, disco. Devolve (df, estado) como TTLCache.get."""
+    df, state = _wb_cache.get(key)
+    if df is None:
+        stored = _wb_disk_load(key)
+        if stored is not None:
+            METRICS.inc("api_cache_requests_total", cache="wb_disk", result="hit")
+            _wb_cache.set(key, *stored)
+            df, state = _wb_cache.get(key, record=False)
+    return df, state
+
+def _wb_store(key, df):
+    now = time.time()
+    _wb_cache.set(key, df, now)
+    _wb_disk_save(key, df, now)
+
+def _wb_claim_refresh(key):
+    """True se ninguém estiver já a revalidar esta chave (e marca-a)."""
+    with _wb_refresh_lock:
+        start = key not in _wb_refreshing
+        _wb_refreshing.add(key)
+    return start
+
+def _wb_refresh(key, countries):
+    """Revalida uma entrada em background (stale-while-revalidate)."""
+    try:
+        df = _fetch_wb_remote(key[0], countries, key[2])
+        if df is not None: _wb_store(key, df)
+    except Exception as e:
+        print(f"WB Refresh Error: {e}")
+    finally:
+        with _wb_refresh_lock: _wb_refreshing.discard(key)
+
+def _thesis_countries():
+    """Tratado + dadores da tese em ISO3 (as mesmas chaves de cache que o /api/scm usa)."""
+    return [COUNTRY_ISO3[c] for c in [TARGET_COUNTRY] + DONOR_POOL]
+
+def fetch_wb_data(indicator_code, countries=None, years=WB_YEARS):
+    """
+    Busca dados ao Banco Mundial, com cache LRU + TTL (e disco opcional).
+    Chave: (indicador, conjunto de países, intervalo de anos).
+    - fresco: devolve sem rede;
+    - stale: devolve já e revalida em background;
+    - expirado/ausente: vai à rede; se falhar, serve a última cópia conhecida.
+    """
+    countries = list(countries) if countries is not None else _thesis_countries()
+    key = _wb_key(indicator_code, countries, years)
+
+    df, state = _wb_lookup(key)
+    if state == "fresh":
+        return df.copy()
+    if state == "stale":
+        if _wb_claim_refresh(key):
+            threading.Thread(target=_wb_refresh, args=(key, countries), daemon=True).start()
+        return df.copy()
+
+    try:
+        fresh = _fetch_wb_remote(indicator_code, countries, years)
+        if fresh is None: return df.copy() if df is not None else None
+        _wb_store(key, fresh)
+        return fresh.copy()
+    except Exception as e:
+        print(f"WB API Error: {e}")
+        return df.copy() if df is not None else None
+
+_wb_inflight = {}    # chave -> tarefa partilhada (pedidos assíncronos concorrentes)
+_wb_background = set()
+
+async def _wb_fetch_and_store(key, countries):
+    fresh = await _fetch_wb_remote_async(key[0], countries, key[2])
+    if fresh is not None: _wb_store(key, fresh)
+    return fresh
+
+async def _wb_refresh_async(key, countries):
+    try:
+        await _wb_fetch_and_store(key, countries)
+    except Exception as e:
+        print(f"WB Refresh Error: {e}")
+    finally:
+        with _wb_refresh_lock: _wb_refreshing.discard(key)
+
+async def fetch_wb_data_async(indicator_code, countries=None, years=WB_YEARS):
+    """
+    Igual a fetch_wb_data (mesma cache e mesmas regras), mas com httpx assíncrono:
+    não ocupa uma thread durante o pedido e pedidos concorrentes à mesma chave
+    partilham um só pedido HTTP.
+    """
+    countries = list(countries) if countries is not None else _thesis_countries()
+    key = _wb_key(indicator_code, countries, years)
+
+    df, state = _wb_lookup(key)
+    if state == "fresh":
+        return df.copy()
+    if state == "stale":
+        if _wb_claim_refresh(key):
+            task = asyncio.ensure_future(_wb_refresh_async(key, countries))
+            _wb_background.add(task)
+            task.add_done_callback(_wb_background.discard)
+        return df.copy()
+
+    task = _wb_inflight.get(key)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = _wb_inflight[key] = asyncio.ensure_future(_wb_fetch_and_store(key, countries))
+        task.add_done_callback(lambda t: _wb_inflight.pop(key, None) if _wb_inflight.get(key) is t else None)
+    try:
+        # shield: um pedido cancelado não cancela o fetch dos outros que esperam
+        fresh = await asyncio.shield(task)
+        if fresh is None: return df.copy() if df is not None else None
+        return fresh.copy()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"WB API Error: {e}")
+        return df.copy() if df is not None else None
+
+def project_simplex(V):
+    """
+    Projeção Euclidiana exata no simplex {w >= 0, soma(w) = 1} (Duchi et al., 2008).
+    Opera sobre o último eixo, por isso aceita vetores ou lotes de vetores.
+    """
+    V = np.asarray(V, dtype=float)
+    if V.ndim == 1:
+        # Caminho rápido para um único vetor (chamado em cada iteração do solver)
+        U = np.sort(V)[::-1]
+        css = np.cumsum(U) - 1.0
+        rho = np.count_nonzero(U * np.arange(1, V.size + 1) > css)
+        return np.maximum(V - css[rho - 1] / rho, 0.0)
+    U = -np.sort(-V, axis=-1)  # ordem decrescente
+    css = np.cumsum(U, axis=-1) - 1.0
+    k = np.arange(1, V.shape[-1] + 1)
+    rho = np.sum(U - css / k > 0, axis=-1, keepdims=True)
+    theta = np.take_along_axis(css, rho - 1, axis=-1) / rho
+    return np.maximum(V - theta, 0.0)
+
+def _active_set_simplex(G, b, tol=1e-9, max_steps=None, start=None):
+    """
+    Solver exato por conjunto ativo (Lawson-Hanson adaptado ao simplex) para
+    min 0.5 w'Gw - b'w  s.a. soma(w) = 1, w >= 0.
+    Começa no melhor vértice (ou no suporte de start, se for um ponto viável) e
+    junta um dador de cada vez (o que mais viola as condições KKT); se algum peso
+    ficar negativo recua até à fronteira e retira-o. Como o suporte cresce aos
+    poucos (no máximo T+1 dadores), os subsistemas ficam pequenos e bem postos
+    mesmo com mais dadores do que anos (G singular).
+    Devolve (pesos, nº de pivôs); os pesos são None se as condições KKT não
+    forem verificadas dentro de max_steps pivôs.
+    """
+    J = b.size
+    max_steps = 4 * J if max_steps is None else max_steps
+    scale = max(1.0, float(np.max(np.abs(b))), float(np.max(np.abs(G))))
+
+    def solve_on(S):
+        idx = np.flatnonzero(S)
+        k = idx.size
+        K = np.zeros((k + 1, k + 1))
+        K[:k, :k] = G[np.ix_(idx, idx)]
+        K[:k, k] = 1.0; K[k, :k] = 1.0
+        rhs = np.append(b[idx], 1.0)
+        sol = np.linalg.lstsq(K, rhs, rcond=None)[0]
+        if np.max(np.abs(K @ sol - rhs)) > 1e-8 * scale: return None, None
+        z = np.zeros(J); z[idx] = sol[:k]
+        return z, sol[k]
+
+    j0 = int(np.argmin(0.5 * np.diag(G) - b))
+    S = np.zeros(J, dtype=bool); S[j0] = True
+    w = np.zeros(J); w[j0] = 1.0
+    nu = -(G[j0, j0] - b[j0])
+    if start is not None:
+        # Arranque a quente (ex: suporte de um FISTA que não convergiu)
+        z, nu_z = solve_on(start > 1e-10)
+        if z is not None and np.all(z[start > 1e-10] > 0):
+            S, w, nu = start > 1e-10, z, nu_z
+
+    for step in range(max_steps):
+        g = G @ w - b
+        viol = np.where(S, np.inf, g + nu)
+        j = int(np.argmin(viol))
+        if not np.isfinite(viol[j]) or viol[j] >= -tol * scale:
+            return w, step
+        S[j] = True
+        while True:
+            z, nu_z = solve_on(S)
+            if z is None: return None, step
+            if np.all(z[S] > 0):
+                w, nu = z, nu_z
+                break
+            # Recuar ao longo de w -> z até o primeiro peso chegar a zero
+            neg = S & (z <= 0)
+            alpha = float(np.min(w[neg] / (w[neg] - z[neg])))
+            w = w + alpha * (z - w)
+            S &= w > 1e-14
+            w = np.where(S, w, 0.0); w /= w.sum()
+            if not S.any(): return None, step
+    return None, max_steps
+
+def optimize_weights_manual(X0, X1, iterations=3000, tol=1e-8, gap_tol=1e-9, return_info=False):
     """
-    Algoritmo de Gradient Descent Projetado (Substitui scipy.optimize).
-    Objetivo: Encontrar pesos W tal que X0 * W ≈ X1.
-    Restrições: Soma(W) = 1, W >= 0.
+    Otimizador dos pesos do controlo sintético (substitui scipy.optimize).
+    Objetivo: min 0.5 * ||X0 * W - X1||^2  s.a.  Soma(W) = 1, W >= 0.
+    Tenta primeiro o conjunto ativo exato (o suporte fica com no máximo T+1
+    dadores, por isso o custo quase não cresce com o nº de dadores); só se não
+    certificar usa FISTA (gradiente projetado acelerado):
+    - Passo 1/L, com L = maior valor próprio de X0'X0 (constante de Lipschitz);
+    - Reinício adaptativo do momento (critério do gradiente);
+    - Paragem só com o gap de dualidade de Frank-Wolfe (majorante de f(W) - f*)
+      abaixo de gap_tol * 0.5 * ||X1||^2, verificado a cada 10 iterações ou
+      quando max|W_k - W_{k-1}| < tol (passos curtos não provam convergência).
+    Se o FISTA esgotar as iterações, o conjunto ativo recomeça a partir do
+    suporte a que ele chegou e a solução exata substitui o iterado.
+    Com return_info=True devolve
+    (W, {"iterations", "objective", "converged", "method"}); no conjunto ativo
+    "iterations" conta os pivôs.
     """
     n_donors = X0.shape[1]
     
     # Inicializar pesos uniformes
     W = np.ones(n_donors) / n_donors
+    info = {"iterations": 0, "objective": 0.0, "converged": True, "method": "uniform"}
     
     # Normalizar dados (MinMax) para estabilidade numérica
     max_val = np.max(np.abs(X0))
-    if max_val == 0: return W
+    if max_val == 0: return (W, info) if return_info else W
     X0_norm = X0 / max_val
     X1_norm = X1 / max_val
 
-    for _ in range(iterations):
-        # 1. Previsão (Forward pass)
-        pred = np.dot(X0_norm, W)
-        
-        # 2. Erro
-        error = pred - X1_norm
-        
-        # 3. Gradiente
-        grad = np.dot(X0_norm.T, error)
-        
-        # 4. Atualização (Gradient Descent)
-        W = W - lr * grad
-        
-        # 5. Projeção (Constraints)
-        W = np.maximum(W, 0) # Não-negativo
-        sum_w = np.sum(W)
-        if sum_w > 0:
-            W = W / sum_w # Soma = 1
-        else:
-            W = np.ones(n_donors) / n_donors
-            
+    # Forma quadrática: gradiente = G W - b, sem voltar a multiplicar por X0 em cada passo
+    G = X0_norm.T @ X0_norm
+    b = X0_norm.T @ X1_norm
+    c = 0.5 * float(X1_norm @ X1_norm)
+    L = float(np.linalg.eigvalsh(G)[-1])
+    if L <= 0: return (W, info) if return_info else W
+    step = 1.0 / L
+
+    W_exact, it = _active_set_simplex(G, b)
+    method = "active-set" if W_exact is not None else "fista"
+
+    Y = W.copy(); t = 1.0
+    converged = W_exact is not None
+    for it in ([] if converged else range(1, iterations + 1)):
+        W_new = project_simplex(Y - step * (G @ Y - b))
+        diff = W_new - W
+        if np.dot(Y - W_new, diff) > 0:
+            # Reinício adaptativo (O'Donoghue & Candès): o momento aponta "para cima"
+            t = 1.0
+        t_new = 0.5 * (1.0 + np.sqrt(1.0 + 4.0 * t * t))
+        Y = W_new + ((t - 1.0) / t_new) * diff
+        W, t = W_new, t_new
+        if it % 10 == 0 or np.max(np.abs(diff)) < tol:
+            grad_w = G @ W - b
+            if grad_w @ W - grad_w.min() <= gap_tol * c:
+                converged = True
+                break
+
+    if not converged:
+        # FISTA no limite de iterações: solução exata a partir do suporte que ele encontrou
+        W_exact, pivots = _active_set_simplex(G, b, max_steps=10 * n_donors, start=W)
+        if W_exact is not None:
+            converged, method, it = True, "fista+active-set", it + pivots
+    if W_exact is not None: W = W_exact
+
+    if return_info:
+        # Objetivo reportado na escala original dos dados
+        objective = 0.5 * float(W @ G @ W) - float(b @ W) + c
+        info = {"iterations": it, "objective": float(objective * max_val ** 2),
+                "converged": converged, "method": method}
+        return W, info
     return W
 
+def optimize_weights_batch(X0, X1, iterations=3000, tol=1e-8, gap_tol=1e-9):
+    """
+    Versão em lote de optimize_weights_manual: B problemas independentes.
+    X0: (B, T, J), X1: (B, T). Cada problema passa pelo conjunto ativo exato; só
+    os que não certificarem seguem para um FISTA vetorizado (G = X0'X0 num
+    matmul 3-D, normalização, passo 1/L e critérios de paragem próprios; os que
+    convergem ficam congelados) e, se esgotarem as iterações, voltam ao
+    conjunto ativo a partir do suporte do FISTA.
+    Devolve (W (B, J), {"iterations": (B,), "objective": (B,)}); "iterations"
+    são pivôs nos problemas resolvidos pelo conjunto ativo.
+    """
+    X0 = np.asarray(X0, dtype=float)
+    X1 = np.asarray(X1, dtype=float)
+    B, _, J = X0.shape
+
+    scale = np.max(np.abs(X0), axis=(1, 2))
+    scale[scale == 0] = 1.0
+    A = X0 / scale[:, None, None]
+    y = X1 / scale[:, None]
+
+    W = np.full((B, J), 1.0 / J)
+    iters = np.zeros(B, dtype=int)
+    pending = []
+    for i in np.flatnonzero(np.any(A != 0, axis=(1, 2))):
+        W_exact, iters[i] = _active_set_simplex(A[i].T @ A[i], A[i].T @ y[i])
+        if W_exact is None: pending.append(i)
+        else: W[i] = W_exact
+
+    if pending:
+        idx = np.array(pending)
+        W[idx], iters[idx] = _fista_batch(A[idx], y[idx], iterations, tol, gap_tol)
+
+    resid = np.matmul(A, W[..., None])[..., 0] - y
+    objective = 0.5 * np.sum(resid * resid, axis=1) * scale ** 2
+    return W, {"iterations": iters, "objective": objective}
+
+def _fista_batch(A, y, iterations, tol, gap_tol):
+    """FISTA vetorizado (dados já normalizados) para os problemas que o conjunto ativo não certificou."""
+    B, _, J = A.shape
+    G = np.matmul(A.transpose(0, 2, 1), A)
+    b = np.matmul(A.transpose(0, 2, 1), y[..., None])[..., 0]
+    c = 0.5 * np.sum(y * y, axis=1)
+    L = np.linalg.eigvalsh(G)[:, -1]
+    step = np.where(L > 0, 1.0 / np.where(L > 0, L, 1.0), 0.0)[:, None]
+
+    W = np.full((B, J), 1.0 / J)
+    active = L > 0
+    Y = W.copy()
+    t = np.ones(B)
+    iters = np.zeros(B, dtype=int)
+    for it in range(1, iterations + 1):
+        if not active.any(): break
+        grad = np.matmul(G, Y[..., None])[..., 0] - b
+        W_new = project_simplex(Y - step * grad)
+        diff = W_new - W
+        restart = np.sum((Y - W_new) * diff, axis=1) > 0
+        t_cur = np.where(restart, 1.0, t)
+        t_new = 0.5 * (1.0 + np.sqrt(1.0 + 4.0 * t_cur * t_cur))
+        Y_new = W_new + ((t_cur - 1.0) / t_new)[:, None] * diff
+
+        upd = active[:, None]
+        W = np.where(upd, W_new, W)
+        Y = np.where(upd, Y_new, Y)
+        t = np.where(active, t_new, t)
+        iters[active] = it
+        check = active & ((it % 10 == 0) | (np.max(np.abs(diff), axis=1) < tol))
+        if check.any():
+            grad_w = np.matmul(G, W[..., None])[..., 0] - b
+            fw_gap = np.sum(grad_w * W, axis=1) - grad_w.min(axis=1)
+            active &= ~(check & (fw_gap <= gap_tol * c))
+
+    for i in np.flatnonzero(active):
+        # FISTA no limite de iterações: solução exata a partir do suporte que ele encontrou
+        W_exact, pivots = _active_set_simplex(G[i], b[i], max_steps=10 * J, start=W[i])
+        if W_exact is not None:
+            W[i] = W_exact
+            iters[i] += pivots
+    return W, iters
+
 # ==========================================
-# === 3. ROTAS DA API ===
+# === 2.2 EXECUÇÃO: EVENT LOOP, POOLS E LIMITES ===
 # ==========================================
+# As rotas de rede são async e não ocupam threads enquanto esperam. O trabalho
+# pesado de CPU (solvers do SCM, OLS em lote) sai do event loop para um process
+# pool (CPU_POOL_WORKERS > 0) ou, por omissão, para um pool de threads. Cada rota
+# tem um limite de pedidos em curso e uma fila curta; com a fila cheia (ou após
+# QUEUE_TIMEOUT segundos à espera) o pedido é recusado com 503 + Retry-After,
+# em vez de se acumular e arrastar a latência de todos os outros.
+CPU_POOL_WORKERS = int(os.environ.get("CPU_POOL_WORKERS", 0))
+CPU_MAX_INFLIGHT = int(os.environ.get("CPU_MAX_INFLIGHT", CPU_POOL_WORKERS or os.cpu_count() or 2))
+CPU_MAX_QUEUE = int(os.environ.get("CPU_MAX_QUEUE", 64))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", 10))
+IO_MAX_WORKERS = int(os.environ.get("IO_MAX_WORKERS", 32))   # bibliotecas bloqueantes (yfinance)
+ROUTE_LIMITS_DEFAULT = {"scm": 8, "scm_batch": 2, "dcf": 32, "dcf_grid": 8, "dcf_batch": 4, "elastic": 8}
 
-# --- ROTA 1: SANCTION DELTA (SCM) ---
-@app.get("/api/scm")
-def calculate_scm(indicator: str = "GDP_CONST"):
-    try:
-        wb_code = INDICATORS.get(indicator, "NY.GDP.MKTP.KD")
-        
-        # 1. Obter Dados
-        df = fetch_wb_data(wb_code)
-        if df is None or "RUS" not in df.columns:
-            raise HTTPException(status_code=404, detail="Dados indisponíveis para este indicador.")
-            
-        available_donors = [c for c in df.columns if c != "RUS"]
-        if len(available_donors) < 2:
-             raise HTTPException(status_code=400, detail="Dadores insuficientes disponíveis.")
+def _parse_route_limits(spec):
+    """'scm=4,dcf=16' -> {"scm": 4, "dcf": 16, ...} (sobre os valores por omissão)."""
+    limits = dict(ROUTE_LIMITS_DEFAULT)
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        try:
+            if name.strip(): limits[name.strip()] = max(1, int(value))
+        except ValueError:
+            print(f"ROUTE_LIMITS inválido: '{item}'")
+    return limits
 
-        # 2. Preparar Matrizes (Treino: 2010-2021)
-        pre_years = [y for y in df.index if y < 2022]
-        if len(pre_years) < 5:
-             raise HTTPException(status_code=400, detail="Histórico insuficiente para calibração.")
+class ConcurrencyLimiter:
+    """
+    Semáforo assíncrono com fila limitada: até `limit` pedidos em curso e no
+    máximo `max_queue` à espera (até `timeout` segundos); acima disso 503.
+    O semáforo é recriado se o event loop mudar (ex: testes).
+    """
+    def __init__(self, name, limit, max_queue=CPU_MAX_QUEUE, timeout=QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._sem = None
 
-        X0 = df.loc[pre_years, available_donors].values 
-        X1 = df.loc[pre_years, "RUS"].values            
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._sem[1] is not loop:
+            self._sem = (asyncio.Semaphore(self.limit), loop)
+        return self._sem[0]
 
-        # 3. Otimização Manual
-        weights = optimize_weights_manual(X0, X1)
+    def _busy(self):
+        self.rejected += 1
+        METRICS.inc("api_limiter_rejected_total", limiter=self.name)
+        return HTTPException(status_code=503, detail=f"Servidor ocupado ({self.name}). Tente novamente.",
+                             headers={"Retry-After": "1"})
 
-        # 4. Projetar Resultados (2010-2024)
-        Y_donors = df[available_donors].values
-        synth_values = np.dot(Y_donors, weights)
-        
-        # 5. Formatar Resposta e Estatísticas
-        chart_data = []
-        metrics = {"gap_2022": 0, "gap_2023": 0}
-        
-        # Listas para calcular RMSPE
-        pre_errors = []
-        post_errors = []
-
-        for i, year in enumerate(df.index):
-            real = df.iloc[i]["RUS"]
-            synth = synth_values[i]
-            gap = real - synth
-            
-            chart_data.append({
-                "year": year,
-                "Real": real,
-                "Synthetic": synth,
-                "Gap": gap
-            })
-            
-            if year == 2022: metrics["gap_2022"] = gap
-            if year == 2023: metrics["gap_2023"] = gap
-            
-            # Acumular erros para RMSPE
-            if year < 2022:
-                pre_errors.append(gap**2)
-            else:
-                post_errors.append(gap**2)
-
-        # Cálculo Estatístico (RMSPE - Root Mean Squared Prediction Error)
-        # Usamos a raiz quadrada para voltar à unidade original (ex: Dólares ou %)
-        pre_rmspe = np.sqrt(np.mean(pre_errors)) if pre_errors else 0
-        post_rmspe = np.sqrt(np.mean(post_errors)) if post_errors else 0
-        rmspe_ratio = post_rmspe / pre_rmspe if pre_rmspe > 0 else 0
-
-        stats = {
-            "pre_rmspe": pre_rmspe,
-            "post_rmspe": post_rmspe,
-            "ratio": rmspe_ratio
-        }
+    def check(self):
+        """503 já se a fila estiver cheia (ex: antes de abrir uma resposta em streaming)."""
+        if self.active + self.waiting >= self.limit + self.max_queue:
+            raise self._busy()
 
-        contributors = sorted(
-            [{"country": c, "weight": round(w*100, 1)} for c, w in zip(available_donors, weights) if w > 0.01],
-            key=lambda x: x["weight"], 
-            reverse=True
-        )
+    @asynccontextmanager
+    async def slot(self):
+        sem = self._semaphore()
+        self.check()
+        self.waiting += 1
+        try:
+            with span("queue"):
+                await asyncio.wait_for(sem.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._busy()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            sem.release()
 
-        return {
-            "data": chart_data,
-            "metrics": metrics,
-            "stats": stats, # Novas estatísticas
-            "contributors": contributors,
-            "indicator": indicator
-        }
+ROUTE_LIMITS = _parse_route_limits(os.environ.get("ROUTE_LIMITS"))
+_route_limiters = {name: ConcurrencyLimiter(name, limit) for name, limit in ROUTE_LIMITS.items()}
+_cpu_limiter = ConcurrencyLimiter("cpu", CPU_MAX_INFLIGHT)
+_cpu_threads = ThreadPoolExecutor(max_workers=CPU_MAX_INFLIGHT, thread_name_prefix="cpu")
+_io_threads = ThreadPoolExecutor(max_workers=IO_MAX_WORKERS, thread_name_prefix="io")
+_cpu_pool = None
+_cpu_pool_lock = threading.Lock()
+_async_clients = {}
 
-    except Exception as e:
-        print(f"SCM Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+def _get_cpu_pool():
+    global _cpu_pool
+    with _cpu_pool_lock:
+        if _cpu_pool is None:
+            _cpu_pool = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS)
+        return _cpu_pool
 
-# --- ROTA 2: PESQUISA DE TICKERS ---
-@app.get("/api/search")
-def search(q: str):
-    try:
-        r = requests.get(f"https://query1.finance.yahoo.com/v1/finance/search?q={q}", headers={'User-Agent': 'Mozilla/5.0'}, timeout=4)
-        data = r.json()
-        return [{"symbol": i.get('symbol'), "name": i.get('shortname'), "exchange": i.get('exchange')} for i in data.get('quotes', []) if i.get('quoteType') == 'EQUITY']
-    except: return []
+def _reset_cpu_pool():
+    """Descarta um pool partido (worker morto): o próximo pedido cria outro."""
+    global _cpu_pool
+    with _cpu_pool_lock:
+        pool, _cpu_pool = _cpu_pool, None
+    if pool is not None: pool.shutdown(wait=False, cancel_futures=True)
 
-# --- ROTA 3: DCF ENGINE ---
-# --- ROTA 3: DCF ENGINE ---
-@app.get("/api/dcf")
-def dcf(ticker: str, g1: float=0.075, g2: float=0.025, wacc: float=0.09, 
-        manual_ebit: float=None, manual_capex: float=None, manual_da: float=None, 
-        manual_nwc: float=None, manual_tax: float=None,
-        manual_cash: float=None, manual_debt: float=None, manual_shares: float=None):
+def route_limit(name):
+    return _route_limiters[name].slot()
+
+def route_limit_check(name):
+    _route_limiters[name].check()
+
+def _cpu_call(fn, *args):
+    """
+    No worker: devolve (erro, resultado, spans). HTTPException (argumentos por
+    nome) não sobrevive ao pickle e volta como valor; os spans medidos no worker
+    seguem para o pedido no processo principal.
+    """
+    spans = []
+    token = _request_spans.set(spans)
     try:
-        ticker = ticker.upper().strip()
-        stock = yf.Ticker(ticker)
-        
-        try: hist = stock.history(period="5d")
-        except: raise HTTPException(status_code=500, detail="Yahoo Finance Connection Error")
-        
-        if hist.empty: raise HTTPException(status_code=404, detail="Ticker not found")
-        price = float(hist["Close"].iloc[-1])
-        
+        return None, fn(*args), spans
+    except HTTPException as e:
+        return (e.status_code, e.detail), None, spans
+    finally:
+        _request_spans.reset(token)
+
+async def run_cpu(fn, *args, process=True):
+    """
+    Corre fn(*args) fora do event loop, sob o limite global de CPU. Com
+    process=True e CPU_POOL_WORKERS > 0 vai para o process pool (fn e args têm
+    de ser picklable); process=False fica em threads (ex: usa caches do processo).
+    """
+    async with _cpu_limiter.slot():
+        loop = asyncio.get_running_loop()
+        use_pool = process and CPU_POOL_WORKERS > 0
         try:
-            info = stock.info or {}
-            income = stock.income_stmt
-            cashflow = stock.cashflow
-            balance = stock.balance_sheet
-        except: income = pd.DataFrame(); cashflow = pd.DataFrame(); balance = pd.DataFrame(); info = {}
+            error, result, spans = await loop.run_in_executor(
+                _get_cpu_pool() if use_pool else _cpu_threads, partial(_cpu_call, fn, *args))
+        except BrokenProcessPool:
+            _reset_cpu_pool()
+            raise
+        request_spans = _request_spans.get()
+        if request_spans is not None: request_spans.extend(spans)
+        if error is not None:
+            raise HTTPException(status_code=error[0], detail=error[1])
+        return result
 
-        ebit = manual_ebit if manual_ebit is not None else _get_metric(income, 'Ebit', ['Operating Income', 'EBIT'])
-        if ebit == 0 and manual_ebit is None:
-            rev = _get_metric(income, 'Total Revenue'); exp = _get_metric(income, 'Operating Expense')
-            if rev > 0: ebit = rev - exp
+async def run_io(fn, *args):
+    """I/O de bibliotecas sem cliente assíncrono (yfinance) num pool de threads próprio."""
+    ctx = contextvars.copy_context()   # os spans medidos na thread contam para o pedido
+    return await asyncio.get_running_loop().run_in_executor(_io_threads, partial(ctx.run, fn, *args))
 
-        # --- TAXA EFETIVA AUTOMÁTICA ---
-        # Se o utilizador não inseriu nada, calculamos a taxa real paga pela empresa
-        if manual_tax is not None:
-            tax_rate = manual_tax
-        else:
-            tax_prov = _get_metric(income, 'Tax Provision')
-            pretax_inc = _get_metric(income, 'Pretax Income')
-            if pretax_inc > 0:
-                effective_rate = tax_prov / pretax_inc
-                # Validar se a taxa é realista (entre 0% e 50%), senão usa 21%
-                tax_rate = effective_rate if 0 <= effective_rate <= 0.50 else 0.21
-            else:
-                tax_rate = 0.21
+def _get_async_client(name, **kwargs):
+    """Clientes httpx partilhados por nome (keep-alive), recriados se o event loop mudar."""
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(name)
+    if entry is None or entry[1] is not loop:
+        entry = _async_clients[name] = (httpx.AsyncClient(**kwargs), loop)
+    return entry[0]
 
-        nopat = ebit * (1 - tax_rate)
-        da = manual_da if manual_da is not None else _get_metric(cashflow, 'Depreciation And Amortization')
-        capex = abs(manual_capex if manual_capex is not None else _get_metric(cashflow, 'Capital Expenditure'))
-        nwc = manual_nwc if manual_nwc is not None else 0.0
-        fcf_base = nopat + da - capex - nwc
-        
-        pv_sum = 0.0; breakdown = []
-        fcf = fcf_base
-        for i in range(1, 6):
-            fcf = fcf * (1 + g1)
-            pv = fcf / ((1 + wacc) ** i)
-            pv_sum += pv
-            breakdown.append({"year": f"Y{i}", "fcf": fcf, "pv": pv})
-            
-        term_val = (fcf * (1 + g2)) / (wacc - g2)
-        pv_term = term_val / ((1 + wacc) ** 5)
-        enterprise_val = pv_sum + pv_term
-        
-        cash = manual_cash if manual_cash is not None else _get_metric(balance, 'Cash And Cash Equivalents')
-        debt = manual_debt if manual_debt is not None else _get_metric(balance, 'Total Debt')
-        shares = manual_shares if manual_shares is not None else info.get('sharesOutstanding', 1)
-        if not shares: shares = 1
-        
-        equity = enterprise_val + cash - debt
-        intrinsic = equity / shares
-        
-        return {
-            "ticker": ticker, "price": price, "currency": info.get('currency', 'USD'),
-            "intrinsic_value": intrinsic, "margin": (intrinsic - price) / price,
-            "inputs": { "ebit": ebit, "tax_rate": tax_rate, "d_and_a": da, "capex": capex, "change_nwc": nwc, "total_cash": cash, "total_debt": debt, "shares": shares },
-            "valuation_flow": { "pv_projections": pv_sum, "pv_terminal": pv_term, "enterprise_value": enterprise_val, "total_cash": cash, "total_debt": debt, "equity_value": equity, "shares": shares },
-            "metrics": { "nopat": nopat, "fcf_base": fcf_base }, "breakdown": breakdown
-        }
-    except Exception as e:
-        print(f"DCF Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+# ==========================================
+# === 2.3 MÉTRICAS E TEMPOS POR ETAPA ===
+# ==========================================
+# Contadores e histogramas em memória (por processo), expostos em /api/metrics
+# no formato de texto do Prometheus. Cada pedido recolhe spans por etapa
+# (fetch, parse, solve, assemble, serialize...) que alimentam o histograma
+# api_stage_seconds e, com SERVER_TIMING=1, o cabeçalho Server-Timing.
+SERVER_TIMING = os.environ.get("SERVER_TIMING") == "1"
 
-# --- ROTA 4: VC SIMULATOR ---
-@app.get("/api/vc")
-def vc_calc(tam: float, quota: float, margem: float, multiplo: float, desconto: float, diluicao: float, target_year: int, acoes_atuais: float, caixa_atual: float, burn_anual: float):
+METRIC_HELP = {
+    "api_requests_total": ("counter", "Pedidos HTTP por rota e código de resposta."),
+    "api_request_seconds": ("histogram", "Duração total dos pedidos HTTP."),
+    "api_stage_seconds": ("histogram", "Duração de cada etapa dentro de um pedido."),
+    "api_cache_requests_total": ("counter", "Consultas às caches por resultado (fresh/stale/expired/miss)."),
+    "api_upstream_requests_total": ("counter", "Pedidos a serviços externos por resultado (ok/error)."),
+    "api_solver_runs_total": ("counter", "Execuções de solvers por método e convergência."),
+    "api_solver_iterations": ("histogram", "Iterações por execução de solver."),
+    "api_limiter_rejected_total": ("counter", "Pedidos recusados (503) por limite de concorrência."),
+    "api_limiter_in_flight": ("gauge", "Pedidos em curso por limite de concorrência."),
+    "api_limiter_waiting": ("gauge", "Pedidos à espera por limite de concorrência."),
+    "api_cache_entries": ("gauge", "Entradas em cada cache."),
+    "api_startup_seconds": ("gauge", "Tempo de import do módulo e das dependências (cold start)."),
+    "api_panel_store_age_seconds": ("gauge", "Idade do painel local país x indicador x ano."),
+}
+METRIC_BUCKETS = {
+    "api_solver_iterations": (0, 1, 10, 50, 100, 250, 500, 1000, 3000),
+}
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_value(value):
+    value = float(value)
+    if math.isinf(value): return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+class MetricsRegistry:
+    """Contadores e histogramas com labels; render() gera o texto do Prometheus."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}      # (nome, labels) -> valor
+        self.histograms = {}    # (nome, labels) -> [contagens por bucket, soma, n]
+        self.gauges = []        # funções que devolvem [(nome, labels, valor)]
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1.0, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = METRIC_BUCKETS.get(name, SECONDS_BUCKETS)
+        key = self._key(name, labels)
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, upper in enumerate(buckets):
+                if value <= upper: h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    @staticmethod
+    def _fmt(name, labels, value, extra=()):
+        items = list(labels) + list(extra)
+        body = ",".join(f'{k}="{_escape_label(v)}"' for k, v in items)
+        return f"{name}{{{body}}} {_fmt_value(value)}" if items else f"{name} {_fmt_value(value)}"
+
+    def render(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in self.histograms.items()}
+        gauges = {}
+        for collect in self.gauges:
+            for name, labels, value in collect():
+                gauges[self._key(name, labels)] = value
+
+        by_name = {}
+        for (name, labels), value in list(counters.items()) + list(gauges.items()):
+            by_name.setdefault(name, []).append(self._fmt(name, labels, value))
+        for (name, labels), (counts, total, n) in histograms.items():
+            lines = by_name.setdefault(name, [])
+            for upper, count in zip(METRIC_BUCKETS.get(name, SECONDS_BUCKETS), counts):
+                lines.append(self._fmt(f"{name}_bucket", labels, count, [("le", f"{upper:g}")]))
+            lines.append(self._fmt(f"{name}_bucket", labels, n, [("le", "+Inf")]))
+            lines.append(self._fmt(f"{name}_sum", labels, total))
+            lines.append(self._fmt(f"{name}_count", labels, n))
+
+        out = []
+        for name in sorted(by_name):
+            kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + by_name[name]
+        return "\n".join(out) + "\n"
+
+METRICS = MetricsRegistry()
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+@contextmanager
+def span(stage):
+    """Mede uma etapa do pedido atual (sem pedido ativo não regista nada)."""
+    t0 = time.perf_counter()
     try:
-        ano_atual = datetime.datetime.now().year
-        anos = max(1, target_year - ano_atual)
-        
-        receita = tam * (quota/100); nopat = receita * (margem/100)
-        exit_val = nopat * multiplo
-        pv = exit_val / ((1 + (desconto/100)) ** anos)
-        acoes_fut = acoes_atuais * ((1 + (diluicao/100)) ** anos)
-        target_price = pv / acoes_fut
-        price_no_dil = pv / acoes_atuais
-        
-        runway = 99.0 if burn_anual <= 0 else caixa_atual / burn_anual
-        status = "safe" if runway > 2 else ("warning" if runway > 1 else "danger")
+        yield
+    finally:
+        spans = _request_spans.get()
+        if spans is not None: spans.append((stage, time.perf_counter() - t0))
 
-        return {
-            "metrics": { "receita_alvo": receita, "nopat_alvo": nopat, "exit_value": exit_val, "pv_equity": pv, "target_price": target_price, "price_no_dilution": price_no_dil },
-            "survival": { "runway": runway, "status": status }
-        }
-    except Exception as e: raise HTTPException(status_code=500, detail=str(e))
+def record_span(stage, t0):
+    """Como span(), para blocos longos: regista a etapa de t0 até agora."""
+    spans = _request_spans.get()
+    if spans is not None: spans.append((stage, time.perf_counter() - t0))
 
-# ==========================================
-# === 5. ELASTIC ENGINE (FULL EQUATION UPDATE) ===
-# ==========================================
+def record_upstream(upstream, ok):
+    METRICS.inc("api_upstream_requests_total", upstream=upstream, outcome="ok" if ok else "error")
 
-def run_multivariate_ols(y, X):
+def record_solver(info, solver):
+    """info: dict com iterations/method/converged (como devolvido por optimize_weights_manual)."""
+    METRICS.inc("api_solver_runs_total", solver=solver, method=info.get("method", solver),
+                converged=str(bool(info.get("converged", True))).lower())
+    METRICS.observe("api_solver_iterations", float(info.get("iterations", 0)), solver=solver)
+
+def _server_timing(spans, total):
+    merged = {}
+    for stage, seconds in spans:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in merged.items()]
+    return ", ".join(parts + [f"total;dur={total * 1000:.1f}"])
+
+class TimingMiddleware:
     """
-    Executa OLS Multivariado (y = Xb + e) usando Numpy puro.
-    Retorna: Betas (Coeficientes), R2, P-Values, Std Errors.
+    ASGI puro (não interfere com StreamingResponse): abre a lista de spans do
+    pedido, conta pedidos/duração por rota e, opcionalmente, junta o Server-Timing.
     """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        spans = []
+        token = _request_spans.set(spans)
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    header = _server_timing(spans, time.perf_counter() - t0).encode("latin-1")
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _request_spans.reset(token)
+            # Rota como template (sem cardinalidade ilimitada para caminhos desconhecidos)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            METRICS.inc("api_requests_total", route=route, status=status)
+            METRICS.observe("api_request_seconds", time.perf_counter() - t0, route=route)
+            for stage, seconds in spans:
+                METRICS.observe("api_stage_seconds", seconds, route=route, stage=stage)
+
+app.add_middleware(TimingMiddleware)
+
+# ==========================================
+# === 2.4 PAINEL PAÍS x INDICADOR x ANO ===
+# ==========================================
+
+# Todas as economias x todos os INDICATORS num único array float64
+# (indicador, país, ano) gravado em .npy e aberto com np.load(mmap_mode="r"):
+# qualquer combinação de tratado, dadores e anos pedida ao SCM passa a ser um
+# corte em memória, sem idas ao Banco Mundial. O índice (panel.json) aponta
+# para o ficheiro de valores em uso; a reconstrução grava um .npy novo e só
+# depois troca o índice, por isso um leitor nunca vê um painel a meio.
+PANEL_STORE_DIR = os.environ.get("PANEL_STORE_DIR")        # ex: /tmp/wb_panel
+PANEL_STORE_MAX_AGE = float(os.environ.get("PANEL_STORE_MAX_AGE", WB_CACHE_TTL))
+PANEL_WB_PER_PAGE = 20000
+
+def _parse_year_range(spec, default):
+    """'1960:2024' -> (1960, 2024); vazio -> default."""
+    if not spec: return default
+    start, end = (int(v) for v in spec.split(":"))
+    return start, end
+
+PANEL_YEARS = _parse_year_range(os.environ.get("PANEL_YEARS"), (1960, WB_YEARS[1]))
+
+def _parse_wb_countries(data):
+    """Lista de países do Banco Mundial -> [{"iso2", "iso3", "name", "aggregate"}]."""
+    if not data or len(data) < 2 or not data[1]: return []
+    return [{"iso2": e.get("iso2Code") or "", "iso3": e["id"], "name": e.get("name") or e["id"],
+             "aggregate": (e.get("region") or {}).get("value", "").strip() == "Aggregates"}
+            for e in data[1] if e.get("id")]
+
+def _country_index(entries):
+    """ISO2 e ISO3 (maiúsculas) -> entrada do país."""
+    index = {}
+    for e in entries:
+        index[e["iso3"].upper()] = e
+        if e["iso2"]: index[e["iso2"].upper()] = e
+    return index
+
+_BUILTIN_COUNTRIES = _country_index(
+    [{"iso2": iso2, "iso3": iso3, "name": iso3, "aggregate": False} for iso2, iso3 in COUNTRY_ISO3.items()])
+_wb_countries_cache = TTLCache(maxsize=1, ttl=WB_CACHE_TTL, stale=WB_CACHE_STALE, name="wb_countries")
+
+def _wb_countries_url():
+    return f"{WB_API_URL}/country?format=json&per_page=1000"
+
+def fetch_wb_countries():
+    """Lista de economias do Banco Mundial (usada na construção do painel)."""
     try:
-        # Adicionar constante (Intercepto) à primeira coluna
-        X = np.column_stack([np.ones(len(X)), X])
-        n, k = X.shape
-        
-        # 1. Calcular Betas: b = (X'X)^-1 X'y
-        XtX = np.dot(X.T, X)
-        XtX_inv = np.linalg.inv(XtX + np.eye(k) * 1e-8)
-        Xty = np.dot(X.T, y)
-        beta = np.dot(XtX_inv, Xty)
-        
-        # 2. Estatísticas
-        y_pred = np.dot(X, beta)
-        residuals = y - y_pred
-        rss = np.sum(residuals**2)
-        tss = np.sum((y - np.mean(y))**2)
-        r_squared = 1 - (rss / tss) if tss > 0 else 0
-        
-        # 3. Robustez
-        sigma2 = rss / (n - k) if n > k else 0
-        cov_matrix = sigma2 * XtX_inv
-        std_err = np.sqrt(np.diag(cov_matrix))
-        
-        # 4. P-Values
-        t_stats = np.divide(beta, std_err, out=np.zeros_like(beta), where=std_err!=0)
-        p_values = []
-        for t in t_stats:
-            abs_t = abs(t)
-            if abs_t > 3.29: p = 0.001
-            elif abs_t > 1.96: p = 0.05
-            elif abs_t > 1.64: p = 0.10
-            else: p = 0.20
-            p_values.append(p)
-
-        return beta, r_squared, p_values, std_err
-    except Exception as e:
-        return np.zeros(X.shape[1] + 1), 0, [1.0] * (X.shape[1] + 1), []
+        with span("fetch"):
+            data = requests.get(_wb_countries_url(), timeout=30).json()
+    except Exception:
+        record_upstream("worldbank", False)
+        raise
+    record_upstream("worldbank", True)
+    return _parse_wb_countries(data)
 
-@app.get("/api/elastic")
-def elastic_engine(category_filter: str = "All"):
+async def fetch_wb_countries_async():
+    """Lista de economias em cache (muda raramente: uma cópia stale serve); None se indisponível."""
+    entries, state = _wb_countries_cache.get("all")
+    if state in ("fresh", "stale"): return entries
     try:
-        # A. GERADOR DE DADOS (Mantido)
-        n_days = 730
-        dates = pd.date_range(start="2022-01-01", periods=n_days)
-        days = np.arange(n_days)
-        
-        # Variáveis Exógenas
-        temp = 15 + 10 * np.sin(2 * np.pi * days / 365) + np.random.normal(0, 2, n_days)
-        gas_price = np.linspace(1.5, 1.9, n_days) + np.random.normal(0, 0.05, n_days)
-        inflation = np.linspace(0.02, 0.05, n_days) + np.random.normal(0, 0.005, n_days)
-        weekday = dates.dayofweek.values
-        is_weekend = (weekday >= 5).astype(int)
-
-        categories = ["Lacticínios", "Mercearia", "Bebidas", "Limpeza", "Frescos"]
-        products_db = []
-        
-        for i in range(1, 51):
-            cat = str(np.random.choice(categories))
-            base_p = round(float(np.random.uniform(0.5, 20.0)), 2)
-            true_elasticity = float(np.random.uniform(-2.5, -0.2))
-            true_promo_lift = float(np.random.uniform(0.2, 0.8))
-            true_temp_sens = float(np.random.uniform(-0.02, 0.02))
-            if cat == "Bebidas": true_temp_sens += 0.05
-            
-            products_db.append({
-                "id": i,
-                "name": f"SKU-{1000+i} {cat[:3].upper()}",
-                "category": cat,
-                "base_price": base_p,
-                "params": [true_elasticity, true_promo_lift, true_temp_sens]
-            })
-
-        results = []
-        
-        for prod in products_db:
-            if category_filter != "All" and prod["category"] != category_filter:
-                continue
-                
-            # Simulação de Vendas
-            price_shocks = np.random.normal(0, 0.15, n_days)
-            prices = prod["base_price"] * (1 + price_shocks)
-            prices = np.maximum(prices, 0.1)
-            promos = (price_shocks < -0.10).astype(int)
-            
-            log_q = (4.0 + prod["params"][0] * np.log(prices) + 0.5 * promos + 
-                     0.01 * temp + prod["params"][1] * gas_price + 
-                     prod["params"][2] * inflation * 10 + 0.3 * is_weekend)
-            
-            expected_q = np.exp(log_q)
-            expected_q = np.clip(expected_q, 0, 10000)
-            quantities = np.random.poisson(expected_q)
-            
-            df_prod = pd.DataFrame({
-                "Q": quantities, "P": prices, "Promo": promos,
-                "Temp": temp, "Gas": gas_price, "Inf": inflation, "Weekend": is_weekend
-            })
-            df_prod = df_prod[df_prod["Q"] > 0]
-            
-            if len(df_prod) > 50:
-                # ESTIMAÇÃO OLS
-                y = np.log(df_prod["Q"]).values
-                # Ordem das variáveis X:
-                # 0: Constante (adicionada auto)
-                # 1: ln(Price)
-                # 2: Promo
-                # 3: Temp
-                # 4: Gas
-                # 5: Inf
-                # 6: Weekend
-                X = np.column_stack([
-                    np.log(df_prod["P"]).values,
-                    df_prod["Promo"].values,
-                    df_prod["Temp"].values,
-                    df_prod["Gas"].values,
-                    df_prod["Inf"].values,
-                    df_prod["Weekend"].values
-                ])
-                
-                betas, r2, p_vals, std_err = run_multivariate_ols(y, X)
-                
-                var_names = ["Intercept", "ln(Price)", "Promo", "Temp", "GasPrice", "Inflation", "Weekend"]
-                
-                regression_table = []
-                for k in range(len(var_names)):
-                    regression_table.append({
-                        "variable": var_names[k],
-                        "coef": round(betas[k], 4),
-                        "std_err": round(std_err[k], 4) if len(std_err) > k else 0,
-                        "p_value": p_vals[k]
-                    })
-
-                elasticity = betas[1]
-                p_val_price = p_vals[1]
-                
-                if elasticity > -1: 
-                    tag = "Inelastic (Rigid)"
-                    action = "Increase Price" if p_val_price < 0.1 else "Test Price Hike"
-                else: 
-                    tag = "Elastic (Sensitive)"
-                    action = "Lower Price" if elasticity < -1.5 and p_val_price < 0.1 else "Maintain"
-
-                # --- CORREÇÃO: EQUAÇÃO COMPLETA ---
-                # Formatação com sinais automáticos (+/-)
-                eq_str = (f"ln(Q) = {betas[0]:.2f} "
-                          f"{betas[1]:+.2f}*ln(P) "
-                          f"{betas[2]:+.2f}*Promo "
-                          f"{betas[3]:+.3f}*Temp "
-                          f"{betas[4]:+.2f}*Gas "
-                          f"{betas[5]:+.2f}*Inf "
-                          f"{betas[6]:+.2f}*Wknd")
-
-                sample = df_prod.sample(min(50, len(df_prod)))
-                plot_points = sample.apply(lambda x: {"p": x["P"], "q": x["Q"]}, axis=1).tolist()
-                
-                p_range = np.linspace(df_prod["P"].min(), df_prod["P"].max(), 20)
-                curve_data = []
-                means = df_prod.mean()
-                for p in p_range:
-                    ln_q = (betas[0] + betas[1]*np.log(p) + 
-                            betas[2]*means["Promo"] + betas[3]*means["Temp"] + 
-                            betas[4]*means["Gas"] + betas[5]*means["Inf"] + 
-                            betas[6]*means["Weekend"])
-                    curve_data.append({"p": round(p, 2), "q": round(np.exp(ln_q), 1)})
-
-                results.append({
-                    "product": prod["name"],
-                    "category": prod["category"],
-                    "elasticity": round(elasticity, 3),
-                    "r2": round(r2, 2),
-                    "tag": tag,
-                    "action": action,
-                    "equation": eq_str,
-                    "regression_table": regression_table,
-                    "plot_points": plot_points,
-                    "curve_data": curve_data,
-                    "avg_price": round(df_prod["P"].mean(), 2),
-                    "current_volume": int(df_prod["Q"].sum()), # Para o simulador
-                    "coefficients": {
-                        "Gas Sens.": round(betas[4], 2),
-                        "Inflation Sens.": round(betas[5], 2),
-                        "Promo Lift": f"{round((np.exp(betas[2])-1)*100, 1)}%"
-                    }
-                })
+        with span("fetch"):
+            r = await _get_wb_client().get(_wb_countries_url())
+            fresh = _parse_wb_countries(r.json())
+        record_upstream("worldbank", True)
+    except Exception as e:
+        record_upstream("worldbank", False)
+        print(f"WB Countries Error: {e}")
+        return entries
+    if not fresh: return entries
+    _wb_countries_cache.set("all", fresh)
+    return fresh
+
+class PanelStore:
+    """Painel (indicador, país, ano) em memória mapeada, com índices por código."""
+    def __init__(self, meta, values):
+        self.meta = meta
+        self.values = values                                   # (I, C, Y), mmap só de leitura
+        self.indicators = {code: i for i, code in enumerate(meta["indicators"])}
+        self.countries = meta["countries"]
+        self.country_pos = {c["iso3"]: j for j, c in enumerate(self.countries)}
+        self.country_index = _country_index(self.countries)
+        self.years = tuple(meta["years"])
+        self.built_at = float(meta["built_at"])
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "panel.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        values = np.load(os.path.join(directory, meta["values"]), mmap_mode="r", allow_pickle=False)
+        shape = (len(meta["indicators"]), len(meta["countries"]), meta["years"][1] - meta["years"][0] + 1)
+        if values.shape != shape:
+            raise ValueError(f"Painel com forma {values.shape}, esperado {shape}")
+        return cls(meta, values)
+
+    def covers(self, indicator_code, years):
+        return indicator_code in self.indicators and self.years[0] <= years[0] and years[1] <= self.years[1]
+
+    def frame(self, indicator_code, countries, years):
+        """
+        Corte ano x país (colunas ISO3) com as mesmas regras de _parse_wb_payload:
+        anos sem nenhum valor não existem e países com anos em falta saem fora.
+        """
+        cols = sorted({c for c in countries if c in self.country_pos})
+        if not cols: return None
+        y0 = years[0] - self.years[0]
+        block = self.values[self.indicators[indicator_code]][
+            [self.country_pos[c] for c in cols], y0:y0 + years[1] - years[0] + 1]   # cópia (fancy indexing)
+        observed = ~np.isnan(block).all(axis=0)
+        block = block[:, observed]
+        complete = ~np.isnan(block).any(axis=1)
+        if not complete.any(): return None
+        return pd.DataFrame(block[complete].T,
+                            index=pd.Index(np.arange(years[0], years[1] + 1)[observed], name="year"),
+                            columns=pd.Index([cols[j] for j in np.flatnonzero(complete)], name="country"))
+
+    def info(self):
+        coverage = {name: round(float(np.mean(~np.isnan(self.values[self.indicators[code]]))), 4)
+                    for name, code in INDICATORS.items() if code in self.indicators}
+        return {
+            "built": True, "built_at": self.built_at, "age_seconds": round(time.time() - self.built_at, 1),
+            "source": self.meta.get("source"), "years": list(self.years),
+            "countries": len(self.countries),
+            "economies": sum(not c["aggregate"] for c in self.countries),
+            "coverage": coverage,
+        }
+
+_panel_store = None
+_panel_store_mtime = None
+_panel_store_lock = threading.Lock()
+_panel_build_lock = threading.Lock()
+
+def get_panel_store():
+    """Painel em uso (None sem PANEL_STORE_DIR ou ainda por construir); relê se o índice mudar."""
+    global _panel_store, _panel_store_mtime
+    if not PANEL_STORE_DIR: return None
+    try:
+        mtime = os.stat(os.path.join(PANEL_STORE_DIR, "panel.json")).st_mtime_ns
+    except OSError:
+        return None
+    with _panel_store_lock:
+        if mtime != _panel_store_mtime:
+            try:
+                _panel_store = PanelStore.load(PANEL_STORE_DIR)
+            except Exception as e:
+                print(f"Panel Store Read Error: {e}")
+                _panel_store = None
+            _panel_store_mtime = mtime
+        return _panel_store
+
+def panel_store_age():
+    store = get_panel_store()
+    return None if store is None else time.time() - store.built_at
+
+def _fetch_wb_indicator_all(indicator_code, years):
+    """Um indicador para todas as economias (todas as páginas). Devolve as entradas."""
+    entries, page, pages = [], 1, 1
+    while page <= pages:
+        url = (f"{WB_API_URL}/country/all/indicator/{indicator_code}"
+               f"?format=json&per_page={PANEL_WB_PER_PAGE}&date={years[0]}:{years[1]}&page={page}")
+        try:
+            with span("fetch"):
+                data = requests.get(url, timeout=60).json()
+        except Exception:
+            record_upstream("worldbank", False)
+            raise
+        record_upstream("worldbank", True)
+        if not data or len(data) < 2 or not data[1]: break
+        entries.extend(data[1])
+        pages = int(data[0].get("pages") or 1)
+        page += 1
+    return entries
+
+def _write_panel_store(directory, meta, values):
+    os.makedirs(directory, exist_ok=True)
+    name = f"panel-{int(time.time() * 1000)}.npy"
+    tmp = os.path.join(directory, f"{name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, values)
+    os.replace(tmp, os.path.join(directory, name))
+    tmp = os.path.join(directory, f"panel.json.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({**meta, "values": name}, f)
+    os.replace(tmp, os.path.join(directory, "panel.json"))  # troca atómica do índice
+    # Valores antigos: quem ainda os tiver mapeados continua a lê-los até fechar
+    for old in os.listdir(directory):
+        if old.startswith("panel-") and old.endswith(".npy") and old != name:
+            try: os.remove(os.path.join(directory, old))
+            except OSError: pass
+
+def build_panel_store(directory=None, years=None):
+    """
+    Descarrega todos os INDICATORS para todas as economias do Banco Mundial e
+    grava o painel (indicador, país, ano). Devolve o PanelStore já em uso.
+    """
+    directory = directory or PANEL_STORE_DIR
+    years = years or PANEL_YEARS
+    if not directory: raise ValueError("PANEL_STORE_DIR não definido.")
+    if not _panel_build_lock.acquire(blocking=False):
+        raise RuntimeError("Construção do painel já em curso.")
+    try:
+        countries = fetch_wb_countries()
+        if not countries: raise RuntimeError("Lista de países do Banco Mundial indisponível.")
+        codes = list(dict.fromkeys(INDICATORS.values()))
+        with ThreadPoolExecutor(max_workers=min(WB_MAX_WORKERS, len(codes))) as pool:
+            payloads = list(pool.map(lambda code: _fetch_wb_indicator_all(code, years), codes))
+
+        pos = {c["iso3"]: j for j, c in enumerate(countries)}
+        values = np.full((len(codes), len(countries), years[1] - years[0] + 1), np.nan)
+        for i, entries in enumerate(payloads):
+            for e in entries:
+                j = pos.get(e.get("countryiso3code"))
+                if j is None or e.get("value") is None: continue
+                year = int(e["date"])
+                if years[0] <= year <= years[1]: values[i, j, year - years[0]] = float(e["value"])
+
+        meta = {"indicators": codes, "countries": countries, "years": list(years),
+                "built_at": time.time(), "source": WB_API_URL}
+        _write_panel_store(directory, meta, values)
+        return get_panel_store() if directory == PANEL_STORE_DIR else PanelStore.load(directory)
+    finally:
+        _panel_build_lock.release()
+
+def _build_panel_store_safe():
+    try:
+        store = build_panel_store()
+        print(f"Panel Store: {len(store.countries)} países x {len(store.indicators)} indicadores")
+    except Exception as e:
+        print(f"Panel Store Build Error: {e}")
+
+async def fetch_scm_panel(indicator_code, countries, years):
+    """Painel ano x país para o SCM: corte do painel local se o cobrir; senão Banco Mundial (cache)."""
+    store = get_panel_store()
+    if store is not None:
+        if store.covers(indicator_code, years):
+            METRICS.inc("api_cache_requests_total", cache="panel_store", result="hit")
+            with span("slice"):
+                return store.frame(indicator_code, countries, years)
+        METRICS.inc("api_cache_requests_total", cache="panel_store", result="miss")
+    return await fetch_wb_data_async(indicator_code, countries, years)
+
+async def country_directory(codes=(), full=False):
+    """
+    Índice ISO2/ISO3 -> país: painel local; senão os países da tese e, se faltar
+    algum código pedido (ou full=True), a lista do Banco Mundial em cache.
+    """
+    store = get_panel_store()
+    if store is not None: return store.country_index
+    if not full and all(c in _BUILTIN_COUNTRIES for c in codes): return _BUILTIN_COUNTRIES
+    entries = await fetch_wb_countries_async()
+    if not entries:
+        if full: raise HTTPException(status_code=503, detail="Lista de países indisponível.")
+        return _BUILTIN_COUNTRIES
+    return {**_BUILTIN_COUNTRIES, **_country_index(entries)}
+
+# ==========================================
+# === 3. ROTAS DA API ===
+# ==========================================
+
+# --- ROTA 1: SANCTION DELTA (SCM) ---
+def scm_placebo_test(df, treated, donors, pre_mask, treated_ratio):
+    """
+    Inferência por placebos "in-space": cada dador passa a ser o tratado e é
+    sintetizado pelos restantes dadores. Os J problemas (J-1 dadores cada) são
+    resolvidos num único solve vetorizado 3-D.
+    p-value = proporção de unidades (incluindo a tratada) com rácio RMSPE
+    pós/pré maior ou igual ao da tratada.
+    """
+    Y = df[donors].values                                 # (T, J)
+    J = len(donors)
+    others = np.array([[k for k in range(J) if k != j] for j in range(J)])  # (J, J-1)
+    Y_synth_pool = Y[:, others].transpose(1, 0, 2)        # (J, T, J-1)
+    Y_target = Y.T                                        # (J, T)
+
+    W, info = optimize_weights_batch(Y_synth_pool[:, pre_mask, :], Y_target[:, pre_mask])
+    gaps = Y_target - np.matmul(Y_synth_pool, W[..., None])[..., 0]  # (J, T)
+
+    pre_rmspe = np.sqrt(np.mean(gaps[:, pre_mask] ** 2, axis=1))
+    post_rmspe = np.sqrt(np.mean(gaps[:, ~pre_mask] ** 2, axis=1)) if (~pre_mask).any() else np.zeros(J)
+    ratios = np.divide(post_rmspe, pre_rmspe, out=np.zeros(J), where=pre_rmspe > 0)
+
+    p_value = (1 + int(np.sum(ratios >= treated_ratio))) / (J + 1)
+
+    return {
+        "treated": treated,
+        "years": [int(y) for y in df.index],
+        "gaps": {c: gaps[j].tolist() for j, c in enumerate(donors)},
+        "ratios": {c: float(ratios[j]) for j, c in enumerate(donors)},
+        "treated_ratio": float(treated_ratio),
+        "p_value": p_value,
+        "rank": 1 + int(np.sum(ratios > treated_ratio)),
+        "n_placebos": J,
+        "solver_iterations": int(info["iterations"].max()) if J else 0
+    }
+
+def scm_from_panel(df, indicator, placebo=False, target="RUS", treatment_year=TREATMENT_YEAR):
+    """
+    Parte de CPU do SCM (pesos -> resposta) sobre o painel já obtido. Função de
+    módulo e argumentos picklable: pode correr no process pool (run_cpu).
+    target é a coluna (ISO3) do país tratado; os restantes países são dadores.
+    """
+    # 1. Validar Dados
+    if df is None or target not in df.columns:
+        raise HTTPException(status_code=404, detail="Dados indisponíveis para este indicador.")
+        
+    available_donors = [c for c in df.columns if c != target]
+    if len(available_donors) < 2:
+         raise HTTPException(status_code=400, detail="Dadores insuficientes disponíveis.")
+
+    # 2. Preparar Matrizes (Treino: anos antes do tratamento)
+    pre_years = [y for y in df.index if y < treatment_year]
+    if len(pre_years) < 5:
+         raise HTTPException(status_code=400, detail="Histórico insuficiente para calibração.")
+
+    X0 = df.loc[pre_years, available_donors].values 
+    X1 = df.loc[pre_years, target].values            
+
+    # 3. Otimização Manual (FISTA)
+    with span("solve"):
+        weights, solver_info = optimize_weights_manual(X0, X1, return_info=True)
+
+    # 4. Projetar Resultados (toda a janela)
+    t_assemble = time.perf_counter()
+    Y_donors = df[available_donors].values
+    synth_values = np.dot(Y_donors, weights)
+    
+    # 5. Formatar Resposta e Estatísticas
+    chart_data = []
+    metrics = {f"gap_{treatment_year}": 0, f"gap_{treatment_year + 1}": 0}
+    
+    # Listas para calcular RMSPE
+    pre_errors = []
+    post_errors = []
+
+    for i, year in enumerate(df.index):
+        real = df.iloc[i][target]
+        synth = synth_values[i]
+        gap = real - synth
+        
+        chart_data.append({
+            "year": year,
+            "Real": real,
+            "Synthetic": synth,
+            "Gap": gap
+        })
+        
+        if year in (treatment_year, treatment_year + 1): metrics[f"gap_{year}"] = gap
+        
+        # Acumular erros para RMSPE
+        if year < treatment_year:
+            pre_errors.append(gap**2)
+        else:
+            post_errors.append(gap**2)
+
+    # Cálculo Estatístico (RMSPE - Root Mean Squared Prediction Error)
+    # Usamos a raiz quadrada para voltar à unidade original (ex: Dólares ou %)
+    pre_rmspe = np.sqrt(np.mean(pre_errors)) if pre_errors else 0
+    post_rmspe = np.sqrt(np.mean(post_errors)) if post_errors else 0
+    rmspe_ratio = post_rmspe / pre_rmspe if pre_rmspe > 0 else 0
+
+    stats = {
+        "pre_rmspe": pre_rmspe,
+        "post_rmspe": post_rmspe,
+        "ratio": rmspe_ratio
+    }
+
+    contributors = sorted(
+        [{"country": c, "weight": round(w*100, 1)} for c, w in zip(available_donors, weights) if w > 0.01],
+        key=lambda x: x["weight"], 
+        reverse=True
+    )
+
+    result = {
+        "data": chart_data,
+        "metrics": metrics,
+        "stats": stats, # Novas estatísticas
+        "contributors": contributors,
+        "solver": solver_info,
+        "indicator": indicator,
+        "target": target,
+        "treatment_year": treatment_year,
+        "donors": available_donors
+    }
+
+    record_span("assemble", t_assemble)
+
+    # 6. Inferência (opcional): distribuição de placebos e p-value de permutação
+    if placebo:
+        pre_mask = np.array([y < treatment_year for y in df.index])
+        with span("placebo"):
+            result["placebo"] = scm_placebo_test(df, target, available_donors, pre_mask, rmspe_ratio)
+
+    return result
+
+SCM_MAX_DONORS = int(os.environ.get("SCM_MAX_DONORS", 300))
+SCM_MIN_YEAR = 1960   # primeiro ano das séries do Banco Mundial
+
+def _split_codes(spec):
+    return [c.strip().upper() for c in spec.split(",") if c.strip()] if spec else []
+
+async def scm_design(target=None, donors=None, treatment_year=None, start_year=None, end_year=None):
+    """
+    Normaliza o desenho pedido ao SCM: tratado e dadores em ISO3 (aceita ISO2 ou
+    ISO3; donors="all" = todas as economias sem agregados), ano do tratamento e
+    janela de anos. Sem parâmetros é a tese: RU vs DONOR_POOL, 2010-2024, 2022.
+    """
+    target = (target or TARGET_COUNTRY).strip().upper()
+    codes = _split_codes(donors) or list(DONOR_POOL)
+    every = codes == ["ALL"]
+    years = (WB_YEARS[0] if start_year is None else start_year, WB_YEARS[1] if end_year is None else end_year)
+    treatment_year = TREATMENT_YEAR if treatment_year is None else treatment_year
+    if not SCM_MIN_YEAR <= years[0] < treatment_year <= years[1] <= datetime.date.today().year:
+        raise HTTPException(status_code=400, detail=(
+            f"Anos inválidos: é preciso {SCM_MIN_YEAR} <= start_year < treatment_year <= end_year."))
+
+    directory = await country_directory([target] + ([] if every else codes), full=every)
+    unknown = [c for c in [target] + ([] if every else codes) if c not in directory]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Países desconhecidos: {', '.join(unknown)}")
+
+    target = directory[target]["iso3"]
+    if every:
+        pool = sorted({e["iso3"] for e in directory.values() if not e["aggregate"]})
+    else:
+        pool = [directory[c]["iso3"] for c in codes]
+    pool = [c for c in dict.fromkeys(pool) if c != target]
+    if len(pool) < 2:
+        raise HTTPException(status_code=400, detail="Indique pelo menos 2 dadores diferentes do tratado.")
+    if len(pool) > SCM_MAX_DONORS:
+        raise HTTPException(status_code=400, detail=f"Demasiados dadores (máx. {SCM_MAX_DONORS}).")
+    return {"target": target, "donors": pool, "treatment_year": treatment_year, "years": years}
+
+async def _scm_for_indicator(indicator, placebo=False, design=None):
+    """Pipeline completo do SCM para um indicador: dados (painel local ou async) -> solver (fora do event loop)."""
+    design = design or await scm_design()
+    df = await fetch_scm_panel(INDICATORS.get(indicator, "NY.GDP.MKTP.KD"),
+                               [design["target"]] + design["donors"], design["years"])
+    result = await run_cpu(scm_from_panel, df, indicator, placebo, design["target"], design["treatment_year"])
+    # Dadores pedidos sem série completa na janela (ficam fora do controlo sintético)
+    result["donors_dropped"] = [c for c in design["donors"] if c not in set(result["donors"])]
+    record_solver(result["solver"], "scm")
+    if placebo:
+        record_solver({"iterations": result["placebo"]["solver_iterations"], "method": "batch"}, "scm_placebo")
+    return result
+
+@app.get("/api/scm", response_class=FastJSONResponse)
+async def calculate_scm(indicator: str = "GDP_CONST", placebo: bool = False, target: str = None,
+                        donors: str = None, treatment_year: int = None, start_year: int = None,
+                        end_year: int = None):
+    """
+    Controlo sintético para qualquer país tratado (target, ISO2/ISO3), dadores
+    (lista separada por vírgulas ou "all") e ano do tratamento. Sem parâmetros
+    mantém a tese (Rússia, sanções de 2022).
+    """
+    try:
+        async with route_limit("scm"):
+            design = await scm_design(target, donors, treatment_year, start_year, end_year)
+            return FastJSONResponse(await _scm_for_indicator(indicator, placebo, design))
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"SCM Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- ROTA 1B: SCM EM LOTE ---
+def prefetch_wb_indicators(indicators=None):
+    """Aquece a cache com vários indicadores em paralelo (I/O em threads)."""
+    codes = [INDICATORS[i] for i in (indicators or INDICATORS) if i in INDICATORS]
+    with ThreadPoolExecutor(max_workers=min(WB_MAX_WORKERS, max(1, len(codes)))) as pool:
+        frames = list(pool.map(fetch_wb_data, codes))
+    return sum(f is not None for f in frames)
+
+def _scm_error(indicator, e):
+    if isinstance(e, HTTPException):
+        return {"indicator": indicator, "error": e.detail, "status": e.status_code}
+    print(f"SCM Batch Error ({indicator}): {e}")
+    return {"indicator": indicator, "error": str(e), "status": 500}
+
+def scm_batch_from_panels(frames, names, target, treatment_year):
+    """Solvers do lote numa só tarefa de CPU (um lugar no pool em vez de um por indicador)."""
+    out = []
+    for df, name in zip(frames, names):
+        try:
+            out.append(scm_from_panel(df, name, False, target, treatment_year))
+        except Exception as e:
+            out.append(_scm_error(name, e))
+    return out
+
+@app.get("/api/scm/batch", response_class=FastJSONResponse)
+async def calculate_scm_batch(indicators: str = None, target: str = None, donors: str = None,
+                              treatment_year: int = None, start_year: int = None, end_year: int = None):
+    """
+    Vários indicadores num só pedido (lista separada por vírgulas; vazio = todos),
+    todos com o mesmo desenho (target, donors, anos; ver /api/scm).
+    Primeiro os painéis de todos os indicadores (pedidos ao Banco Mundial em
+    paralelo, async), depois todos os solvers numa só tarefa do pool de CPU;
+    erros vêm por indicador.
+    """
+    names = [i.strip() for i in indicators.split(",") if i.strip()] if indicators else list(INDICATORS)
+    unknown = [i for i in names if i not in INDICATORS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Indicadores desconhecidos: {', '.join(unknown)}")
+
+    async with route_limit("scm_batch"):
+        design = await scm_design(target, donors, treatment_year, start_year, end_year)
+        countries = [design["target"]] + design["donors"]
+        frames = await asyncio.gather(*(fetch_scm_panel(INDICATORS[name], countries, design["years"])
+                                        for name in names), return_exceptions=True)
+        results = dict(zip(names, frames))
+        solvable = [name for name in names if not isinstance(results[name], BaseException)]
+        for name in names:
+            if name not in solvable: results[name] = _scm_error(name, results[name])
+        try:
+            solved = await run_cpu(scm_batch_from_panels, [results[n] for n in solvable], solvable,
+                                   design["target"], design["treatment_year"])
+        except Exception as e:
+            solved = [_scm_error(name, e) for name in solvable]
+        for name, result in zip(solvable, solved):
+            if "error" not in result:
+                result["donors_dropped"] = [c for c in design["donors"] if c not in set(result["donors"])]
+                record_solver(result["solver"], "scm")
+            results[name] = result
+    return FastJSONResponse({"results": results})
+
+# --- ROTA 1C: PAINEL LOCAL DO SCM ---
+@app.get("/api/scm/panel")
+def scm_panel_info():
+    """Estado do painel local (PANEL_STORE_DIR): idade, países, anos e cobertura por indicador."""
+    store = get_panel_store()
+    if store is None:
+        return {"enabled": bool(PANEL_STORE_DIR), "built": False, "building": _panel_build_lock.locked()}
+    return {"enabled": True, "building": _panel_build_lock.locked(), **store.info()}
+
+@app.post("/api/scm/panel/refresh")
+async def scm_panel_refresh(x_admin_token: Optional[str] = Header(None)):
+    """
+    (Re)constrói o painel local a partir do Banco Mundial; os pedidos seguintes
+    usam-no logo. Descarrega todos os indicadores: exige X-Admin-Token.
+    """
+    require_admin(x_admin_token)
+    if not PANEL_STORE_DIR:
+        raise HTTPException(status_code=400, detail="PANEL_STORE_DIR não definido.")
+    if _panel_build_lock.locked():
+        raise HTTPException(status_code=409, detail="Construção do painel já em curso.")
+    try:
+        await run_io(build_panel_store)
+    except Exception as e:
+        print(f"Panel Store Build Error: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+    return scm_panel_info()
+
+# --- ROTA 2: PESQUISA DE TICKERS ---
+# Chamada a cada tecla na página do DCF: cliente HTTP assíncrono partilhado
+# (keep-alive), cache LRU por prefixo e cancelamento de pesquisas ultrapassadas.
+YAHOO_SEARCH_URL = os.environ.get("YAHOO_SEARCH_URL", "https://query1.finance.yahoo.com/v1/finance/search")
+SEARCH_QUOTES_COUNT = 10
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 3600))
+
+_search_cache = TTLCache(maxsize=4096, ttl=SEARCH_CACHE_TTL, name="search")
+_search_fetches = {}   # query -> [task partilhada, nº de pedidos à espera]
+_search_latest = {}    # sid -> tarefa do último pedido dessa sessão
+
+def _get_search_client():
+    return _get_async_client(
+        "search", timeout=4, headers={'User-Agent': 'Mozilla/5.0'},
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20))
+
+def _search_matches(item, query):
+    """Filtro local para responder a 'AAP' com os resultados de 'AA'."""
+    symbol = (item.get("symbol") or "").upper()
+    words = (item.get("name") or "").upper().split()
+    return symbol.startswith(query) or any(w.startswith(query) for w in words)
+
+def _search_from_prefix(query):
+    """
+    Procura o maior prefixo em cache cuja resposta estava completa (menos
+    resultados do que o limite pedido ao Yahoo): nesse caso o resultado para a
+    query mais longa é um filtro local dessa lista.
+    """
+    for i in range(len(query) - 1, 0, -1):
+        entry, state = _search_cache.get(query[:i], record=False)
+        if state == "fresh" and entry["complete"]:
+            METRICS.inc("api_cache_requests_total", cache="search", result="prefix")
+            return [it for it in entry["items"] if _search_matches(it, query)]
+    return None
+
+async def _search_remote(query):
+    try:
+        with span("fetch"):
+            r = await _get_search_client().get(
+                YAHOO_SEARCH_URL, params={"q": query, "quotesCount": SEARCH_QUOTES_COUNT, "newsCount": 0})
+            quotes = r.json().get('quotes', [])
+    except Exception:
+        record_upstream("yahoo_search", False)
+        raise
+    record_upstream("yahoo_search", True)
+    items = [{"symbol": i.get('symbol'), "name": i.get('shortname'), "exchange": i.get('exchange')} for i in quotes if i.get('quoteType') == 'EQUITY']
+    _search_cache.set(query, {"items": items, "complete": len(quotes) < SEARCH_QUOTES_COUNT})
+    return items
+
+@app.get("/api/search")
+async def search(q: str, sid: str = None):
+    query = q.strip().upper()
+    if not query: return []
+
+    entry, state = _search_cache.get(query)
+    if state == "fresh": return entry["items"]
+    derived = _search_from_prefix(query)
+    if derived is not None:
+        _search_cache.set(query, {"items": derived, "complete": True})
+        return derived
+
+    # Sessão (sid): uma nova tecla marca a pesquisa anterior como ultrapassada
+    superseded = asyncio.get_running_loop().create_future()
+    if sid:
+        prev = _search_latest.get(sid)
+        if prev is not None and not prev.done(): prev.set_result(True)
+        _search_latest[sid] = superseded
+
+    # Pedidos simultâneos com a mesma query partilham um único pedido ao Yahoo
+    shared = _search_fetches.get(query)
+    if shared is None:
+        shared = _search_fetches[query] = [asyncio.ensure_future(_search_remote(query)), 0]
+    shared[1] += 1
+    try:
+        await asyncio.wait({shared[0], superseded}, return_when=asyncio.FIRST_COMPLETED)
+        if not shared[0].done(): return []
+        return shared[0].result()
+    except Exception:
+        return []
+    finally:
+        shared[1] -= 1
+        if shared[1] == 0:
+            # Ninguém mais espera por esta query: cancela o pedido se ainda estiver em curso
+            if not shared[0].done(): shared[0].cancel()
+            if _search_fetches.get(query) is shared: _search_fetches.pop(query, None)
+        if sid and _search_latest.get(sid) is superseded:
+            _search_latest.pop(sid, None)
+
+# --- ROTA 3: DCF ENGINE ---
+# Cache dos fundamentais do Yahoo: o preço muda ao minuto, as demonstrações
+# financeiras ao trimestre. Guardamos já as métricas extraídas (sem DataFrames).
+YF_PRICE_TTL = float(os.environ.get("YF_PRICE_TTL", 300))               # 5 minutos
+YF_STATEMENTS_TTL = float(os.environ.get("YF_STATEMENTS_TTL", 24 * 3600)) # 1 dia
+YF_CACHE_SIZE = int(os.environ.get("YF_CACHE_SIZE", 2048))
+
+_yf_price_cache = TTLCache(maxsize=YF_CACHE_SIZE, ttl=YF_PRICE_TTL, name="yf_price")
+_yf_statements_cache = TTLCache(maxsize=YF_CACHE_SIZE, ttl=YF_STATEMENTS_TTL, name="yf_statements")
+_yf_flight = SingleFlight()
+
+def _load_yahoo_price(ticker):
+    try:
+        with span("fetch"): hist = yf.Ticker(ticker).history(period="5d")
+    except:
+        record_upstream("yahoo", False)
+        raise HTTPException(status_code=500, detail="Yahoo Finance Connection Error")
+    record_upstream("yahoo", True)
+    
+    if hist.empty: raise HTTPException(status_code=404, detail="Ticker not found")
+    return float(hist["Close"].iloc[-1])
+
+def _statement_metrics(info, income, cashflow, balance):
+    """Demonstrações financeiras -> dicionário de métricas já extraídas."""
+    return {
+        "ebit": _get_metric(income, 'Ebit', ['Operating Income', 'EBIT']),
+        "revenue": _get_metric(income, 'Total Revenue'),
+        "operating_expense": _get_metric(income, 'Operating Expense'),
+        "tax_provision": _get_metric(income, 'Tax Provision'),
+        "pretax_income": _get_metric(income, 'Pretax Income'),
+        "d_and_a": _get_metric(cashflow, 'Depreciation And Amortization'),
+        "capex": _get_metric(cashflow, 'Capital Expenditure'),
+        "cash": _get_metric(balance, 'Cash And Cash Equivalents'),
+        "debt": _get_metric(balance, 'Total Debt'),
+        "shares": info.get('sharesOutstanding', 1),
+        "currency": info.get('currency', 'USD')
+    }
+
+def _load_yahoo_statements(ticker):
+    """
+    Métricas das demonstrações do Yahoo. Falha de rede (500) ou demonstrações
+    vazias (404) dão HTTPException, que não vai para a cache.
+    """
+    stock = yf.Ticker(ticker)
+    try:
+        with span("fetch"):
+            info = stock.info or {}
+            income = stock.income_stmt
+            cashflow = stock.cashflow
+            balance = stock.balance_sheet
+    except:
+        record_upstream("yahoo", False)
+        raise HTTPException(status_code=500, detail="Yahoo Finance Connection Error")
+    record_upstream("yahoo", True)
+
+    if all(df is None or df.empty for df in (income, cashflow, balance)):
+        raise HTTPException(status_code=404, detail="Demonstrações financeiras indisponíveis")
+    with span("parse"):
+        return _statement_metrics(info, income, cashflow, balance)
+
+def _cached_yahoo(cache, kind, ticker, loader):
+    value, state = cache.get(ticker)
+    if state == "fresh": return value
+    value = _yf_flight.do((kind, ticker), lambda: loader(ticker))
+    cache.set(ticker, value)
+    return value
+
+def _fetch_dcf_source(ticker):
+    """
+    Preço + métricas do Yahoo Finance, servidos da cache (com single-flight por
+    ticker). Sem demonstrações as métricas vêm a zero só para este pedido (o
+    próximo volta a tentar) e o erro segue em "statements_error": o /api/dcf
+    continua com os valores manuais, o lote devolve o erro nessa linha.
+    """
+    price = _cached_yahoo(_yf_price_cache, "price", ticker, _load_yahoo_price)
+    try:
+        metrics = _cached_yahoo(_yf_statements_cache, "statements", ticker, _load_yahoo_statements)
+        error = None
+    except HTTPException as e:
+        print(f"Yahoo Statements Error ({ticker}): {e.detail}")
+        metrics = _statement_metrics({}, pd.DataFrame(), pd.DataFrame(), pd.DataFrame())
+        error = {"error": e.detail, "status": e.status_code}
+    src = {"price": price, "currency": metrics["currency"], "metrics": metrics}
+    if error is not None: src["statements_error"] = error
+    return src
+
+def _extract_dcf_inputs(src, manual_ebit=None, manual_capex=None, manual_da=None, manual_nwc=None,
+                        manual_tax=None, manual_cash=None, manual_debt=None, manual_shares=None):
+    """Inputs do DCF a partir das métricas (os valores manuais têm prioridade)."""
+    m = src["metrics"]
+
+    ebit = manual_ebit if manual_ebit is not None else m["ebit"]
+    if ebit == 0 and manual_ebit is None:
+        rev = m["revenue"]; exp = m["operating_expense"]
+        if rev > 0: ebit = rev - exp
+
+    # --- TAXA EFETIVA AUTOMÁTICA ---
+    # Se o utilizador não inseriu nada, calculamos a taxa real paga pela empresa
+    if manual_tax is not None:
+        tax_rate = manual_tax
+    else:
+        tax_prov = m["tax_provision"]
+        pretax_inc = m["pretax_income"]
+        if pretax_inc > 0:
+            effective_rate = tax_prov / pretax_inc
+            # Validar se a taxa é realista (entre 0% e 50%), senão usa 21%
+            tax_rate = effective_rate if 0 <= effective_rate <= 0.50 else 0.21
+        else:
+            tax_rate = 0.21
+
+    da = manual_da if manual_da is not None else m["d_and_a"]
+    capex = abs(manual_capex if manual_capex is not None else m["capex"])
+    nwc = manual_nwc if manual_nwc is not None else 0.0
+    
+    cash = manual_cash if manual_cash is not None else m["cash"]
+    debt = manual_debt if manual_debt is not None else m["debt"]
+    shares = manual_shares if manual_shares is not None else m["shares"]
+    if not shares: shares = 1
+
+    return {"ebit": ebit, "tax_rate": tax_rate, "d_and_a": da, "capex": capex, "change_nwc": nwc,
+            "total_cash": cash, "total_debt": debt, "shares": shares}
+
+@app.get("/api/dcf", response_class=FastJSONResponse)
+async def dcf(ticker: str, g1: float=0.075, g2: float=0.025, wacc: float=0.09, 
+        manual_ebit: float=None, manual_capex: float=None, manual_da: float=None, 
+        manual_nwc: float=None, manual_tax: float=None,
+        manual_cash: float=None, manual_debt: float=None, manual_shares: float=None,
+        mc_paths: int=0, mc_seed: int=None, g1_sd: float=0.02, g2_sd: float=0.005,
+        wacc_sd: float=0.01, margin_sd: float=0.02, capex_sd: float=0.10):
+    try:
+        ticker = ticker.upper().strip()
+        if mc_paths < 0 or mc_paths > DCF_MC_MAX_PATHS:
+            raise HTTPException(status_code=400, detail=f"mc_paths deve estar entre 0 e {DCF_MC_MAX_PATHS}.")
+        sds = {"g1_sd": g1_sd, "g2_sd": g2_sd, "wacc_sd": wacc_sd, "margin_sd": margin_sd, "capex_sd": capex_sd}
+        negative = [name for name, sd in sds.items() if not sd >= 0]
+        if negative:
+            raise HTTPException(status_code=400, detail=f"Desvios-padrão devem ser >= 0: {', '.join(negative)}")
+        if mc_seed is not None and mc_seed < 0:
+            raise HTTPException(status_code=400, detail="mc_seed deve ser >= 0.")
+        # yfinance não tem cliente assíncrono: a busca corre no pool de I/O
+        async with route_limit("dcf"):
+            src = await run_io(_fetch_dcf_source, ticker)
+        price = src["price"]
+        inputs = _extract_dcf_inputs(src, manual_ebit, manual_capex, manual_da, manual_nwc,
+                                     manual_tax, manual_cash, manual_debt, manual_shares)
+        ebit, tax_rate, da, capex, nwc = (inputs["ebit"], inputs["tax_rate"], inputs["d_and_a"],
+                                          inputs["capex"], inputs["change_nwc"])
+        cash, debt, shares = inputs["total_cash"], inputs["total_debt"], inputs["shares"]
+
+        t_solve = time.perf_counter()
+        nopat = ebit * (1 - tax_rate)
+        fcf_base = nopat + da - capex - nwc
         
-        return sorted(results, key=lambda x: x['elasticity'])
+        pv_sum = 0.0; breakdown = []
+        fcf = fcf_base
+        for i in range(1, 6):
+            fcf = fcf * (1 + g1)
+            pv = fcf / ((1 + wacc) ** i)
+            pv_sum += pv
+            breakdown.append({"year": f"Y{i}", "fcf": fcf, "pv": pv})
+            
+        term_val = (fcf * (1 + g2)) / (wacc - g2)
+        pv_term = term_val / ((1 + wacc) ** 5)
+        enterprise_val = pv_sum + pv_term
+        
+        equity = enterprise_val + cash - debt
+        intrinsic = equity / shares
+        
+        result = {
+            "ticker": ticker, "price": price, "currency": src["currency"],
+            "intrinsic_value": intrinsic, "margin": (intrinsic - price) / price,
+            "inputs": inputs,
+            "valuation_flow": { "pv_projections": pv_sum, "pv_terminal": pv_term, "enterprise_value": enterprise_val, "total_cash": cash, "total_debt": debt, "equity_value": equity, "shares": shares },
+            "metrics": { "nopat": nopat, "fcf_base": fcf_base }, "breakdown": breakdown
+        }
+        record_span("solve", t_solve)
 
+        # --- MODO ESTOCÁSTICO (opcional) ---
+        if mc_paths > 0:
+            dists = {"g1": (g1, g1_sd), "g2": (g2, g2_sd), "wacc": (wacc, wacc_sd),
+                     "margin_sd": margin_sd, "capex_sd": capex_sd}
+            revenue = src["metrics"]["revenue"]
+            # Já dentro do process pool não se abre outro (workers=1)
+            workers = 1 if CPU_POOL_WORKERS > 0 else DCF_MC_WORKERS
+            result["monte_carlo"] = await run_cpu(dcf_monte_carlo, inputs, revenue, price, dists, mc_paths, mc_seed, workers)
+
+        return FastJSONResponse(result)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"DCF Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- ROTA 3B: DCF - GRELHA DE SENSIBILIDADE ---
+DCF_GRID_MAX_CELLS = 2_000_000
+
+def dcf_value_vectorized(inputs, g1, g2, wacc, tax_rate=None, capex=None, ebit=None, years=5):
+    """
+    Mesmo fluxo do /api/dcf (NOPAT -> FCF -> valor terminal -> equity/ação), mas
+    com broadcasting NumPy: g1, g2, wacc, tax_rate, capex e ebit podem ser
+    escalares ou arrays com formas compatíveis. Combinações com wacc <= g2 dão NaN.
+    """
+    tax_rate = inputs["tax_rate"] if tax_rate is None else tax_rate
+    capex = inputs["capex"] if capex is None else np.abs(capex)
+    ebit = inputs["ebit"] if ebit is None else ebit
+    g1, g2, wacc = np.asarray(g1, float), np.asarray(g2, float), np.asarray(wacc, float)
+
+    fcf_base = ebit * (1 - np.asarray(tax_rate, float)) + inputs["d_and_a"] - capex - inputs["change_nwc"]
+
+    # Fator de desconto acumulado dos anos 1..N (eixo extra no fim)
+    t = np.arange(1, years + 1)
+    ratio = (1 + g1)[..., None] / (1 + wacc)[..., None]
+    pv_factor = np.sum(ratio ** t, axis=-1)
+
+    growth_n = (1 + g1) ** years
+    with np.errstate(divide="ignore", invalid="ignore"):
+        term_factor = np.where(wacc > g2, growth_n * (1 + g2) / (wacc - g2) / (1 + wacc) ** years, np.nan)
+
+    enterprise_val = fcf_base * (pv_factor + term_factor)
+    equity = enterprise_val + inputs["total_cash"] - inputs["total_debt"]
+    return equity / inputs["shares"]
+
+def _parse_grid_axis(spec, default):
+    """'0.06:0.12:25' -> linspace; '0.08,0.09,0.1' -> lista; vazio -> [default]."""
+    if spec is None or str(spec).strip() == "":
+        return np.array([default], dtype=float)
+    spec = str(spec).strip()
+    try:
+        if ":" in spec:
+            start, stop, num = spec.split(":")
+            return np.linspace(float(start), float(stop), int(num))
+        return np.array([float(v) for v in spec.split(",") if v.strip()], dtype=float)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Eixo inválido: '{spec}'")
+
+def dcf_grid_surface(inputs, axes, price):
+    """Grelha inteira num broadcast (CPU; corre em run_cpu). Devolve eixos, forma, valores e resumo."""
+    shape = tuple(len(v) for v in axes.values())
+    # Cada eixo ocupa a sua dimensão (np.ix_ gera as formas para o broadcast)
+    mesh = dict(zip(axes, np.ix_(*axes.values())))
+    with span("solve"):
+        values = dcf_value_vectorized(inputs, mesh["g1"], mesh["g2"], mesh["wacc"],
+                                      tax_rate=mesh.get("tax"), capex=mesh.get("capex"))
+        values = np.broadcast_to(values, shape).ravel()
+
+        # Células inválidas (inf/NaN) ficam NaN e saem como null no FastJSONResponse
+        finite = np.isfinite(values)
+        flat = np.where(finite, np.round(values, 4), np.nan)
+
+    return {
+        "axes": {k: np.round(v, 6) for k, v in axes.items()},
+        "shape": list(shape),
+        "intrinsic_value": flat,
+        "summary": {
+            "min": float(np.nanmin(values)) if finite.any() else None,
+            "max": float(np.nanmax(values)) if finite.any() else None,
+            "share_undervalued": float(np.mean(values[finite] > price)) if finite.any() else None
+        }
+    }
+
+@app.get("/api/dcf/grid", response_class=FastJSONResponse)
+async def dcf_grid(ticker: str, wacc: str = "0.06:0.12:50", g1: str = "0.0:0.15:50", g2: str = "0.0:0.045:10",
+                   tax: str = None, capex: str = None,
+                   manual_ebit: float=None, manual_da: float=None, manual_nwc: float=None,
+                   manual_cash: float=None, manual_debt: float=None, manual_shares: float=None):
+    """
+    Superfície de valor intrínseco sobre a grelha wacc x g1 x g2 (x tax x capex).
+    Os fundamentais são lidos uma vez; a grelha inteira é avaliada num broadcast.
+    Resposta colunar: eixos + 'intrinsic_value' achatado em ordem C (null = inválido).
+    """
+    try:
+        ticker = ticker.upper().strip()
+        axes = {"wacc": _parse_grid_axis(wacc, 0.09), "g1": _parse_grid_axis(g1, 0.075),
+                "g2": _parse_grid_axis(g2, 0.025)}
+        if tax is not None: axes["tax"] = _parse_grid_axis(tax, 0.21)
+        if capex is not None: axes["capex"] = _parse_grid_axis(capex, 0.0)
+
+        if int(np.prod([len(v) for v in axes.values()])) > DCF_GRID_MAX_CELLS:
+            raise HTTPException(status_code=400, detail=f"Grelha demasiado grande (máx. {DCF_GRID_MAX_CELLS} células).")
+
+        async with route_limit("dcf_grid"):
+            src = await run_io(_fetch_dcf_source, ticker)
+            inputs = _extract_dcf_inputs(src, manual_ebit=manual_ebit, manual_da=manual_da, manual_nwc=manual_nwc,
+                                         manual_cash=manual_cash, manual_debt=manual_debt, manual_shares=manual_shares)
+            surface = await run_cpu(dcf_grid_surface, inputs, axes, src["price"])
+
+        return FastJSONResponse({"ticker": ticker, "price": src["price"], "currency": src["currency"],
+                                 "inputs": inputs, **surface})
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"DCF Grid Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- ROTA 3C: DCF EM LOTE (WATCHLISTS) ---
+DCF_BATCH_MAX_TICKERS = 500
+DCF_BATCH_MAX_CONCURRENCY = 32
+
+def _dcf_batch_fetch(ticker):
+    try:
+        src = _fetch_dcf_source(ticker)
+        if "statements_error" in src:
+            # Sem demonstrações não há avaliação a fazer: métricas a zero dariam um valor inventado
+            return ticker, None, {"ticker": ticker, **src["statements_error"]}
+        return ticker, src, None
+    except HTTPException as e:
+        return ticker, None, {"ticker": ticker, "error": e.detail, "status": e.status_code}
+    except Exception as e:
+        return ticker, None, {"ticker": ticker, "error": str(e), "status": 500}
+
+def _dcf_batch_value(done, g1, g2, wacc):
+    """Avalia de uma vez todos os tickers que já chegaram (inputs como arrays)."""
+    keys = ["ebit", "tax_rate", "d_and_a", "capex", "change_nwc", "total_cash", "total_debt", "shares"]
+    per_ticker = [_extract_dcf_inputs(src) for _, src in done]
+    stacked = {k: np.array([inp[k] for inp in per_ticker], dtype=float) for k in keys}
+    values = dcf_value_vectorized(stacked, g1, g2, wacc)
+
+    for (ticker, src), inputs, intrinsic in zip(done, per_ticker, values):
+        price = src["price"]
+        yield {"ticker": ticker, "price": price, "currency": src["currency"],
+               "intrinsic_value": float(intrinsic), "margin": (float(intrinsic) - price) / price,
+               "inputs": inputs}
+
+@app.get("/api/dcf/batch")
+async def dcf_batch(tickers: str, g1: float=0.075, g2: float=0.025, wacc: float=0.09, concurrency: int=8):
+    """
+    DCF para uma lista de tickers (separados por vírgulas) com pressupostos comuns.
+    Os fundamentais vêm com concorrência limitada (cache + single-flight por ticker,
+    no pool de I/O partilhado) e os resultados saem em NDJSON à medida que ficam
+    prontos; cada bloco de tickers que termina em conjunto é avaliado num só passe
+    vetorizado. Erros vêm por linha.
+    """
+    names = list(dict.fromkeys(t.upper().strip() for t in tickers.split(",") if t.strip()))
+    if not names:
+        raise HTTPException(status_code=400, detail="Lista de tickers vazia.")
+    if len(names) > DCF_BATCH_MAX_TICKERS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {DCF_BATCH_MAX_TICKERS} tickers por pedido.")
+    if wacc <= g2:
+        raise HTTPException(status_code=400, detail="O WACC tem de ser superior a g2.")
+    workers = max(1, min(concurrency, DCF_BATCH_MAX_CONCURRENCY, len(names)))
+    # Com a fila cheia recusa já (503); a vaga só é ocupada dentro do stream
+    route_limit_check("dcf_batch")
+
+    async def fetch(sem, ticker):
+        async with sem:
+            return await run_io(_dcf_batch_fetch, ticker)
+
+    async def stream():
+        errors = 0
+        pending = set()
+        try:
+            async with route_limit("dcf_batch"):
+                sem = asyncio.Semaphore(workers)
+                pending = {asyncio.ensure_future(fetch(sem, t)) for t in names}
+                while pending:
+                    finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    done = []
+                    for fut in finished:
+                        ticker, src, error = fut.result()
+                        if error is not None:
+                            errors += 1
+                            yield json.dumps(error) + "\n"
+                        else:
+                            done.append((ticker, src))
+                    if done:
+                        for row in _dcf_batch_value(done, g1, g2, wacc):
+                            yield json.dumps(row) + "\n"
+            yield json.dumps({"done": True, "count": len(names), "errors": errors}) + "\n"
+        except HTTPException as e:
+            # Ficou na fila até ao QUEUE_TIMEOUT: a resposta já começou, o erro vai na linha
+            yield json.dumps({"error": e.detail, "status": e.status_code}) + "\n"
+        finally:
+            # Se o cliente desligar a meio, não ficamos a buscar o resto da lista
+            for fut in pending: fut.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# --- ROTA 3D: DCF - MONTE CARLO ---
+DCF_MC_MAX_PATHS = 1_000_000
+DCF_MC_CHUNK = 100_000                                       # limita a memória por bloco
+DCF_MC_WORKERS = int(os.environ.get("DCF_MC_WORKERS", 1))    # >1 ativa o process pool
+DCF_MC_POOL_MIN = 400_000                                    # só compensa acima disto
+DCF_MC_PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+
+_dcf_mc_pool = None
+_dcf_mc_pool_lock = threading.Lock()
+
+def _get_dcf_mc_pool():
+    """Process pool do Monte Carlo (DCF_MC_WORKERS), criado uma vez e partilhado entre pedidos."""
+    global _dcf_mc_pool
+    with _dcf_mc_pool_lock:
+        if _dcf_mc_pool is None:
+            _dcf_mc_pool = ProcessPoolExecutor(max_workers=DCF_MC_WORKERS)
+        return _dcf_mc_pool
+
+def _reset_dcf_mc_pool():
+    global _dcf_mc_pool
+    with _dcf_mc_pool_lock:
+        pool, _dcf_mc_pool = _dcf_mc_pool, None
+    if pool is not None: pool.shutdown(wait=False, cancel_futures=True)
+
+def _new_seed():
+    """Seed aleatória de 63 bits: cabe num inteiro JSON (orjson) e reproduz a simulação."""
+    return int.from_bytes(os.urandom(8), "big") >> 1
+
+def _dcf_mc_chunk(inputs, revenue, dists, n, seed_seq):
+    """Gera n caminhos (normais independentes) e devolve o valor intrínseco de cada um."""
+    rng = np.random.default_rng(seed_seq)
+    g1 = rng.normal(dists["g1"][0], dists["g1"][1], n)
+    g2 = rng.normal(dists["g2"][0], dists["g2"][1], n)
+    wacc = rng.normal(dists["wacc"][0], dists["wacc"][1], n)
+    capex = inputs["capex"] * (1 + rng.normal(0.0, dists["capex_sd"], n))
+    margin_shock = rng.normal(0.0, dists["margin_sd"], n)
+    if revenue > 0:
+        # Margem EBIT simulada sobre a receita atual
+        ebit = revenue * (inputs["ebit"] / revenue + margin_shock)
+    else:
+        ebit = inputs["ebit"] * (1 + margin_shock)
+    return dcf_value_vectorized(inputs, g1, g2, wacc, capex=capex, ebit=ebit)
+
+def dcf_monte_carlo(inputs, revenue, price, dists, n_paths, seed=None, workers=DCF_MC_WORKERS, bins=50):
+    """
+    Valuation estocástica: simula n_paths caminhos em blocos de DCF_MC_CHUNK.
+    Cada bloco tem o seu gerador (SeedSequence.spawn), por isso o resultado para
+    uma dada seed é o mesmo com ou sem process pool. Com workers > 1 os blocos
+    vão para o pool partilhado (_get_dcf_mc_pool, DCF_MC_WORKERS processos).
+    """
+    seed_seq = np.random.SeedSequence(_new_seed() if seed is None else seed)
+    sizes = [DCF_MC_CHUNK] * (n_paths // DCF_MC_CHUNK)
+    if n_paths % DCF_MC_CHUNK: sizes.append(n_paths % DCF_MC_CHUNK)
+    children = seed_seq.spawn(len(sizes))
+    args = [(inputs, revenue, dists, n, ss) for n, ss in zip(sizes, children)]
+
+    with span("simulate"):
+        if workers > 1 and n_paths >= DCF_MC_POOL_MIN:
+            try:
+                chunks = list(_get_dcf_mc_pool().map(_dcf_mc_chunk, *zip(*args)))
+            except BrokenProcessPool:
+                _reset_dcf_mc_pool()
+                raise
+        else:
+            chunks = [_dcf_mc_chunk(*a) for a in args]
+
+    values = np.concatenate(chunks)
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return {"paths": n_paths, "valid_paths": 0, "seed": seed_seq.entropy}
+
+    pct = np.percentile(values, DCF_MC_PERCENTILES)
+    # Histograma entre p1 e p99 para as caudas não esmagarem o gráfico
+    lo, hi = np.percentile(values, [1, 99])
+    counts, edges = np.histogram(values, bins=bins, range=(lo, hi) if hi > lo else None)
+
+    return {
+        "paths": n_paths,
+        "valid_paths": int(values.size),
+        "seed": seed_seq.entropy,
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "percentiles": {f"p{q}": float(v) for q, v in zip(DCF_MC_PERCENTILES, pct)},
+        "prob_undervalued": float(np.mean(values > price)),
+        "histogram": {"edges": edges.tolist(), "counts": counts.tolist()}
+    }
+
+# --- ROTA 4: VC SIMULATOR ---
+VC_INPUTS = ("tam", "quota", "margem", "multiplo", "desconto", "diluicao",
+             "target_year", "acoes_atuais", "caixa_atual", "burn_anual")
+VC_OUTPUTS = ("receita_alvo", "nopat_alvo", "exit_value", "pv_equity", "target_price", "price_no_dilution", "runway")
+
+def vc_value_vectorized(tam, quota, margem, multiplo, desconto, diluicao, target_year,
+                        acoes_atuais, caixa_atual, burn_anual, ano_atual=None):
+    """
+    Mesmas contas do /api/vc com broadcasting NumPy: cada input pode ser escalar
+    ou array (formas compatíveis). Devolve um dict com um array por métrica.
+    """
+    ano_atual = datetime.datetime.now().year if ano_atual is None else ano_atual
+    anos = np.maximum(1, np.rint(target_year) - ano_atual)
+
+    receita = np.multiply(tam, np.divide(quota, 100)); nopat = receita * (np.divide(margem, 100))
+    exit_val = nopat * multiplo
+    acoes_fut = np.multiply(acoes_atuais, (1 + np.divide(diluicao, 100)) ** anos)
+
+    burn = np.asarray(burn_anual, float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pv = exit_val / ((1 + np.divide(desconto, 100)) ** anos)
+        target_price = pv / acoes_fut
+        price_no_dil = pv / acoes_atuais
+        runway = np.where(burn <= 0, 99.0, np.divide(caixa_atual, np.where(burn <= 0, 1.0, burn)))
+
+    return dict(zip(VC_OUTPUTS, (receita, nopat, exit_val, pv, target_price, price_no_dil, runway)))
+
+@app.get("/api/vc")
+def vc_calc(tam: float, quota: float, margem: float, multiplo: float, desconto: float, diluicao: float, target_year: int, acoes_atuais: float, caixa_atual: float, burn_anual: float):
+    try:
+        if acoes_atuais <= 0:
+            raise HTTPException(status_code=400, detail="acoes_atuais deve ser maior que zero.")
+        out = {k: float(v) for k, v in vc_value_vectorized(tam, quota, margem, multiplo, desconto, diluicao, target_year,
+                                                           acoes_atuais, caixa_atual, burn_anual).items()}
+        invalid = [k for k, v in out.items() if not math.isfinite(v)]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Inputs geram valores inválidos: {', '.join(invalid)}")
+        runway = out["runway"]
+        status = "safe" if runway > 2 else ("warning" if runway > 1 else "danger")
+
+        return {
+            "metrics": { "receita_alvo": out["receita_alvo"], "nopat_alvo": out["nopat_alvo"], "exit_value": out["exit_value"], "pv_equity": out["pv_equity"], "target_price": out["target_price"], "price_no_dilution": out["price_no_dilution"] },
+            "survival": { "runway": runway, "status": status }
+        }
+    except HTTPException: raise
+    except Exception as e: raise HTTPException(status_code=500, detail=str(e))
+
+# --- ROTA 4B: VC - SWEEP / MONTE CARLO ---
+VC_MC_MAX_DRAWS = 2_000_000
+VC_MC_CHUNK = 250_000
+VC_SWEEP_MAX_CELLS = 2_000_000
+VC_SWEEP_RETURN_CELLS = 50_000                     # acima disto só vêm as bandas
+VC_PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+
+def _parse_vc_dist(name, spec):
+    """
+    Distribuição de um input no modo Monte Carlo:
+    '12.5' fixo | '10:20' uniforme | 'normal:mu:sd' | 'lognormal:mediana:sigma'
+    | 'triangular:min:moda:max' | '1,2,3' escolha equiprovável.
+    """
+    spec = str(spec).strip().lower()
+    try:
+        parts = spec.split(":")
+        if parts[0] in ("normal", "lognormal", "triangular"):
+            kind, params = parts[0], tuple(float(v) for v in parts[1:])
+            if len(params) != (3 if kind == "triangular" else 2): raise ValueError
+            if kind == "triangular" and not params[0] <= params[1] <= params[2]: raise ValueError
+            if kind != "triangular" and params[1] < 0: raise ValueError
+            return kind, params
+        if len(parts) == 2:
+            return "uniform", (float(parts[0]), float(parts[1]))
+        if "," in spec:
+            return "choice", tuple(float(v) for v in spec.split(",") if v.strip())
+        return "fixed", (float(spec),)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Distribuição inválida para {name}: '{spec}'")
+
+def _draw_vc(dist, rng, n):
+    kind, params = dist
+    if kind == "fixed": return np.full(n, params[0])
+    if kind == "uniform": return rng.uniform(params[0], params[1], n)
+    if kind == "normal": return rng.normal(params[0], params[1], n)
+    if kind == "lognormal": return params[0] * np.exp(rng.normal(0.0, params[1], n))
+    if kind == "triangular":
+        return np.full(n, params[0]) if params[0] == params[2] else rng.triangular(*params, n)
+    return rng.choice(np.array(params), n)
+
+def _vc_mc_chunk(dists, n, seed_seq, ano_atual):
+    """n cenários: um array por input (mesma ordem de VC_INPUTS) -> métricas."""
+    rng = np.random.default_rng(seed_seq)
+    draws = [_draw_vc(dists[name], rng, n) for name in VC_INPUTS]
+    return vc_value_vectorized(*draws, ano_atual=ano_atual)
+
+def vc_bands(outputs):
+    """Média e percentis de cada métrica (ignora NaN/inf) + sobrevivência."""
+    bands = {}
+    for name, values in outputs.items():
+        finite = values[np.isfinite(values)]
+        if finite.size == 0:
+            bands[name] = None
+            continue
+        pct = np.percentile(finite, VC_PERCENTILES)
+        bands[name] = {"mean": float(finite.mean()), "std": float(finite.std()),
+                       **{f"p{q}": float(v) for q, v in zip(VC_PERCENTILES, pct)}}
+    runway = outputs["runway"]
+    survival = {
+        "prob_runway_lt_1y": float(np.mean(runway < 1)),
+        "status_share": {"safe": float(np.mean(runway > 2)),
+                         "warning": float(np.mean((runway > 1) & (runway <= 2))),
+                         "danger": float(np.mean(runway <= 1))},
+    }
+    return bands, survival
+
+def vc_simulation(specs, mode="mc", n=100_000, seed=None, ano_atual=None):
+    """
+    Corpo do /api/vc/simulate (CPU; corre em run_cpu). specs: input -> texto
+    do pedido. Devolve o dict da resposta (arrays numpy no modo sweep).
+    """
+    ano_atual = datetime.datetime.now().year if ano_atual is None else ano_atual
+
+    if mode == "sweep":
+        empty = [name for name, spec in specs.items() if not str(spec).strip()]
+        if empty:
+            raise HTTPException(status_code=400, detail=f"Eixos vazios: {', '.join(empty)}")
+        axes = {name: _parse_grid_axis(spec, None) for name, spec in specs.items()}
+        shape = tuple(len(v) for v in axes.values())
+        cells = int(np.prod(shape))
+        if cells == 0 or cells > VC_SWEEP_MAX_CELLS:
+            raise HTTPException(status_code=400, detail=f"Sweep deve ter entre 1 e {VC_SWEEP_MAX_CELLS} combinações.")
+        # Cada input na sua dimensão; as métricas saem já na forma da grelha
+        with span("solve"):
+            outputs = vc_value_vectorized(*np.ix_(*axes.values()), ano_atual=ano_atual)
+            outputs = {k: np.broadcast_to(v, shape).ravel() for k, v in outputs.items()}
+            bands, survival = vc_bands(outputs)
+        result = {"mode": "sweep", "scenarios": cells, "bands": bands, "survival": survival,
+                  "axes": {k: v for k, v in axes.items() if v.size > 1}}
+        if cells <= VC_SWEEP_RETURN_CELLS:
+            # Grelha achatada (ordem C sobre os eixos com mais de um valor); inf/NaN saem como null
+            result["shape"] = [s for s in shape if s > 1]
+            for name in ("target_price", "runway"):
+                values = outputs[name]
+                result[name] = np.where(np.isfinite(values), values, np.nan)
+        return result
+
+    if mode != "mc":
+        raise HTTPException(status_code=400, detail="mode deve ser 'mc' ou 'sweep'.")
+    if n < 1 or n > VC_MC_MAX_DRAWS:
+        raise HTTPException(status_code=400, detail=f"n deve estar entre 1 e {VC_MC_MAX_DRAWS}.")
+    if seed is not None and seed < 0:
+        raise HTTPException(status_code=400, detail="seed deve ser >= 0.")
+
+    dists = {name: _parse_vc_dist(name, spec) for name, spec in specs.items()}
+    # Blocos com geradores próprios (SeedSequence.spawn): memória limitada e reprodutível
+    seed_seq = np.random.SeedSequence(_new_seed() if seed is None else seed)
+    sizes = [VC_MC_CHUNK] * (n // VC_MC_CHUNK)
+    if n % VC_MC_CHUNK: sizes.append(n % VC_MC_CHUNK)
+    with span("simulate"):
+        chunks = [_vc_mc_chunk(dists, size, ss, ano_atual) for size, ss in zip(sizes, seed_seq.spawn(len(sizes)))]
+        outputs = {k: np.concatenate([c[k] for c in chunks]) for k in VC_OUTPUTS}
+        bands, survival = vc_bands(outputs)
+    return {"mode": "mc", "scenarios": n, "seed": seed_seq.entropy,
+            "inputs": {name: {"dist": d[0], "params": list(d[1])} for name, d in dists.items()},
+            "bands": bands, "survival": survival}
+
+@app.get("/api/vc/simulate", response_class=FastJSONResponse)
+async def vc_simulate(tam: str, quota: str, margem: str, multiplo: str, desconto: str, diluicao: str, target_year: str,
+                      acoes_atuais: str, caixa_atual: str, burn_anual: str,
+                      mode: str = "mc", n: int = 100_000, seed: int = None):
+    """
+    Stress-test de um deal numa só chamada.
+    mode=mc: cada input é uma distribuição (ver _parse_vc_dist) e são gerados n cenários.
+    mode=sweep: cada input é um eixo ('a:b:n' ou lista, como no /api/dcf/grid) e é
+    avaliado o produto cartesiano. Em ambos devolve bandas de percentis por métrica
+    e a probabilidade de runway < 1 ano.
+    """
+    try:
+        specs = dict(zip(VC_INPUTS, (tam, quota, margem, multiplo, desconto, diluicao, target_year,
+                                     acoes_atuais, caixa_atual, burn_anual)))
+        # Até 2M cenários: fora do event loop, sob o limite global de CPU
+        return FastJSONResponse(await run_cpu(vc_simulation, specs, mode, n, seed))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"VC Simulate Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ==========================================
+# === 5. ELASTIC ENGINE (FULL EQUATION UPDATE) ===
+# ==========================================
+
+def _betainc(a, b, x, iterations=200):
+    """
+    Função beta incompleta regularizada I_x(a, b), vetorizada (fração contínua
+    de Lentz, Numerical Recipes 6.4) - evita depender do scipy.
+    """
+    a, b, x = np.broadcast_arrays(np.asarray(a, float), np.asarray(b, float), np.asarray(x, float))
+    x = np.clip(x, 0.0, 1.0)
+    # Simetria I_x(a,b) = 1 - I_{1-x}(b,a) para a fração convergir depressa
+    swap = x > (a + 1.0) / (a + b + 2.0)
+    aa, bb, xx = np.where(swap, b, a), np.where(swap, a, b), np.where(swap, 1.0 - x, x)
+
+    lgamma = np.frompyfunc(math.lgamma, 1, 1)
+    with np.errstate(divide="ignore"):
+        log_front = (lgamma(aa + bb) - lgamma(aa) - lgamma(bb)).astype(float) \
+            + aa * np.log(xx) + bb * np.log1p(-xx)
+    front = np.exp(log_front) / aa
+
+    tiny = 1e-300
+    c = np.ones_like(xx)
+    d = 1.0 - (aa + bb) * xx / (aa + 1.0)
+    d = 1.0 / np.where(np.abs(d) < tiny, tiny, d)
+    h = d.copy()
+    for m in range(1, iterations + 1):
+        m2 = 2 * m
+        for num in (m * (bb - m) * xx / ((aa + m2 - 1.0) * (aa + m2)),
+                    -(aa + m) * (aa + bb + m) * xx / ((aa + m2) * (aa + m2 + 1.0))):
+            d = 1.0 + num * d
+            d = 1.0 / np.where(np.abs(d) < tiny, tiny, d)
+            c = 1.0 + num / c
+            c = np.where(np.abs(c) < tiny, tiny, c)
+            h = h * d * c
+        if np.all(np.abs(d * c - 1.0) < 1e-14): break
+
+    result = front * h
+    result = np.where(swap, 1.0 - result, result)
+    return np.where(xx <= 0.0, np.where(swap, 1.0, 0.0), result)
+
+def t_test_pvalues(t_stats, df):
+    """P-values bilaterais exatos da distribuição t de Student (vetorizado)."""
+    t_stats = np.asarray(t_stats, float)
+    df = np.broadcast_to(np.asarray(df, float), t_stats.shape)
+    ok = df > 0
+    safe_df = np.where(ok, df, 1.0)
+    p = _betainc(safe_df / 2.0, 0.5, safe_df / (safe_df + t_stats ** 2))
+    return np.where(ok, np.clip(p, 0.0, 1.0), 1.0)
+
+def ols_from_moments(XtX, Xty, yty, n):
+    """
+    OLS a partir das estatísticas suficientes de S regressões em lote.
+    XtX: (S, k, k), Xty: (S, k), yty: (S,), n: (S,) - a coluna 0 é a constante,
+    por isso Xty[:, 0] = soma(y). Resolve por Cholesky (sem inversão explícita).
+    Devolve betas (S, k), R2 (S,), p-values (S, k), std errors (S, k).
+    """
+    XtX = np.asarray(XtX, float)
+    Xty = np.asarray(Xty, float)
+    yty = np.asarray(yty, float)
+    n = np.asarray(n, float)
+    S, k, _ = XtX.shape
+
+    A = XtX + np.eye(k) * 1e-8
+    try:
+        L = np.linalg.cholesky(A)
+        L_inv = np.linalg.solve(L, np.broadcast_to(np.eye(k), A.shape))
+        beta = np.matmul(L_inv.transpose(0, 2, 1), np.matmul(L_inv, Xty[..., None]))[..., 0]
+        diag_inv = np.sum(L_inv ** 2, axis=1)              # diag((X'X)^-1)
+    except np.linalg.LinAlgError:
+        # Algum SKU com X'X singular: pseudo-inversa em lote (mais lenta, mas robusta)
+        A_inv = np.linalg.pinv(A)
+        beta = np.matmul(A_inv, Xty[..., None])[..., 0]
+        diag_inv = np.diagonal(A_inv, axis1=1, axis2=2)
+
+    # rss = y'y - b'X'y (no ótimo), tss = y'y - n * média^2
+    rss = np.maximum(yty - np.sum(beta * Xty, axis=1), 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tss = yty - np.where(n > 0, Xty[:, 0] ** 2 / np.where(n > 0, n, 1.0), 0.0)
+        r_squared = np.where(tss > 0, 1 - rss / tss, 0.0)
+
+    dof = n - k
+    sigma2 = np.where(dof > 0, rss / np.where(dof > 0, dof, 1.0), 0.0)
+    std_err = np.sqrt(np.maximum(sigma2[:, None] * diag_inv, 0.0))
+    t_stats = np.divide(beta, std_err, out=np.zeros_like(beta), where=std_err != 0)
+    p_values = np.where(std_err != 0, t_test_pvalues(t_stats, dof[:, None]), 1.0)
+    return beta, r_squared, p_values, std_err
+
+def run_ols_batch(Y, X, mask=None):
+    """
+    OLS multivariado para vários SKUs de uma vez, com arrays 3-D preenchidos.
+    Y: (S, N), X: (S, N, k-1) sem constante, mask: (S, N) com as linhas válidas
+    (ex: dias com quantidade > 0). As linhas fora da máscara pesam zero.
+    """
+    Y = np.asarray(Y, float)
+    X = np.asarray(X, float)
+    S, N = Y.shape
+    w = np.ones((S, N)) if mask is None else np.asarray(mask, float)
+
+    Xc = np.concatenate([np.ones((S, N, 1)), X], axis=2) * w[..., None]
+    Yw = np.where(w > 0, Y, 0.0)
+    XtX = np.einsum('snk,snl->skl', Xc, Xc)
+    Xty = np.einsum('snk,sn->sk', Xc, Yw)
+    yty = np.einsum('sn,sn->s', Yw, Yw)
+    return ols_from_moments(XtX, Xty, yty, w.sum(axis=1))
+
+def run_multivariate_ols(y, X):
+    """
+    Executa OLS Multivariado (y = Xb + e) usando Numpy puro.
+    Retorna: Betas (Coeficientes), R2, P-Values, Std Errors.
+    """
+    try:
+        X = np.asarray(X, float).reshape(len(y), -1)
+        beta, r2, p_values, std_err = run_ols_batch(np.asarray(y, float)[None], X[None])
+        return beta[0], float(r2[0]), p_values[0].tolist(), std_err[0]
+    except Exception as e:
+        return np.zeros(X.shape[1] + 1), 0, [1.0] * (X.shape[1] + 1), []
+
+def _elasticity_verdicts(elasticity, p_val_price):
+    """Classificação e recomendação a partir da elasticidade-preço (vetorizado por SKU)."""
+    inelastic = elasticity > -1
+    significant = p_val_price < 0.1
+    tag = np.where(inelastic, "Inelastic (Rigid)", "Elastic (Sensitive)")
+    action = np.where(inelastic,
+                      np.where(significant, "Increase Price", "Test Price Hike"),
+                      np.where((elasticity < -1.5) & significant, "Lower Price", "Maintain"))
+    return tag, action
+
+ELASTIC_CATEGORIES = ["Lacticínios", "Mercearia", "Bebidas", "Limpeza", "Frescos"]
+ELASTIC_SCENARIO_CACHE = 16
+ELASTIC_CURVE_POINTS = 20
+ELASTIC_SAMPLE_POINTS = 50
+
+def demand_curves(betas, means, p_min, p_max, n_points=ELASTIC_CURVE_POINTS):
+    """
+    Curvas de procura de todos os SKUs num só produto matricial. Para cada SKU s
+    e ponto g da grelha de preços: ln(Q) = Z[s, g] · beta[s], com Z = médias das
+    variáveis e a coluna 1 (ln(Price)) substituída por ln(p_g).
+    betas, means: (S, k); p_min, p_max: (S,). Devolve (preços, quantidades), ambos (S, n_points).
+    """
+    grid = p_min[:, None] + (p_max - p_min)[:, None] * np.linspace(0.0, 1.0, n_points)
+    # Parte fixa (médias) + correção da coluna de preço: evita materializar Z (S, G, k)
+    base = np.einsum('sk,sk->s', means, betas) - means[:, 1] * betas[:, 1]
+    ln_q = base[:, None] + betas[:, 1:2] * np.log(grid)
+    return grid, np.exp(ln_q)
+
+def sample_indices(valid, rng, n_points=ELASTIC_SAMPLE_POINTS):
+    """
+    Amostra sem reposição de até n_points observações válidas por linha, só com
+    arrays de índices (chaves aleatórias + argpartition). -1 marca posições vazias.
+    """
+    m = min(n_points, valid.shape[1])
+    if m == 0: return np.full((valid.shape[0], 0), -1)
+    keys = np.where(valid, rng.random(valid.shape), np.inf)
+    idx = np.argpartition(keys, m - 1, axis=1)[:, :m]
+    return np.where(np.take_along_axis(valid, idx, axis=1), idx, -1)
+
+def _take_samples(values, idx):
+    """values (S, N) nas posições idx (S, m); -1 -> NaN."""
+    out = np.take_along_axis(values, np.maximum(idx, 0), axis=1).astype(float)
+    out[idx < 0] = np.nan
+    return out
+
+def build_elastic_table(names, categories, var_names, betas, r2, p_values, std_err, means,
+                        curve, samples, avg_price, volume, equations, coefficients):
+    """
+    Resultados do /api/elastic em forma colunar (um array por campo, uma linha
+    por SKU), já ordenados por elasticidade. Filtros são cortes com máscaras e a
+    serialização (linhas ou colunas) é feita só no fim.
+    """
+    tag, action = _elasticity_verdicts(betas[:, 1], p_values[:, 1])
+    table = {
+        "product": np.asarray(names, dtype=object), "category": np.asarray(categories, dtype=object),
+        "elasticity": betas[:, 1], "r2": r2, "tag": tag, "action": action,
+        "equation": np.asarray(equations, dtype=object),
+        "coef": betas, "std_err": std_err, "p_value": p_values, "means": means,
+        "curve_p": curve[0], "curve_q": curve[1], "sample_p": samples[0], "sample_q": samples[1],
+        "avg_price": avg_price, "current_volume": volume,
+        "coefficients": {label: np.asarray(v) for label, v in coefficients.items()},
+    }
+    # Ordena pela elasticidade arredondada (a que é mostrada), estável nos empates
+    table = take_elastic_table(table, np.argsort(np.round(betas[:, 1], 3), kind="stable"))
+    table["variables"] = list(var_names)
+    return table
+
+def take_elastic_table(table, idx):
+    """Seleciona/reordena SKUs (índices ou máscara booleana) em todas as colunas."""
+    out = {k: (v[idx] if isinstance(v, np.ndarray) else v) for k, v in table.items() if k != "coefficients"}
+    out["coefficients"] = {label: v[idx] for label, v in table["coefficients"].items()}
+    return out
+
+def filter_elastic_table(table, category_filter="All"):
+    if category_filter == "All": return table
+    return take_elastic_table(table, table["category"] == category_filter)
+
+def _lift_labels(beta):
+    """Efeito percentual de uma dummy em ln(Q): (e^b - 1) em %, formatado."""
+    return [f"{x}%" for x in np.round((np.exp(beta) - 1) * 100, 1).tolist()]
+
+def elastic_rows(table):
+    """Formato clássico (uma lista de dicts por SKU), usado pelo frontend."""
+    coef, se = np.round(table["coef"], 4).tolist(), np.round(table["std_err"], 4).tolist()
+    pv = table["p_value"].tolist()
+    cp, cq = np.round(table["curve_p"], 2).tolist(), np.round(table["curve_q"], 1).tolist()
+    sp, sq = table["sample_p"].tolist(), table["sample_q"].tolist()
+    labels = list(table["coefficients"])
+    coef_cols = [table["coefficients"][label].tolist() for label in labels]
+    var_names = table["variables"]
+
+    rows = []
+    for i, (name, cat, el, r2, tag, action, eq, avg_p, vol) in enumerate(zip(
+            table["product"], table["category"], np.round(table["elasticity"], 3).tolist(),
+            np.round(table["r2"], 2).tolist(), table["tag"].tolist(), table["action"].tolist(),
+            table["equation"], np.round(table["avg_price"], 2).tolist(),
+            table["current_volume"].astype(np.int64).tolist())):
+        rows.append({
+            "product": name, "category": cat, "elasticity": el, "r2": r2,
+            "tag": tag, "action": action, "equation": eq,
+            "regression_table": [{"variable": v, "coef": c, "std_err": e, "p_value": p}
+                                 for v, c, e, p in zip(var_names, coef[i], se[i], pv[i])],
+            "plot_points": [{"p": p, "q": q} for p, q in zip(sp[i], sq[i]) if p == p],
+            "curve_data": [{"p": p, "q": q} for p, q in zip(cp[i], cq[i])],
+            "avg_price": avg_p, "current_volume": vol,
+            "coefficients": {label: col[i] for label, col in zip(labels, coef_cols)},
+        })
+    return rows
+
+def elastic_columns(table):
+    """
+    Layout colunar: um array por campo (matrizes SKU x variável / SKU x ponto),
+    sem repetir as chaves em cada linha. plot_points vêm com NaN -> null no padding.
+    """
+    return {
+        "layout": "columnar",
+        "variables": table["variables"],
+        "product": table["product"].tolist(), "category": table["category"].tolist(),
+        "elasticity": np.round(table["elasticity"], 3), "r2": np.round(table["r2"], 2),
+        "tag": table["tag"].tolist(), "action": table["action"].tolist(),
+        "equation": table["equation"].tolist(),
+        "coef": np.round(table["coef"], 4), "std_err": np.round(table["std_err"], 4),
+        "p_value": np.ascontiguousarray(table["p_value"]),
+        "curve_p": np.round(table["curve_p"], 2), "curve_q": np.round(table["curve_q"], 1),
+        "sample_p": np.ascontiguousarray(table["sample_p"]), "sample_q": np.ascontiguousarray(table["sample_q"]),
+        "avg_price": np.round(table["avg_price"], 2),
+        "current_volume": table["current_volume"].astype(np.int64),
+        "coefficients": {label: (v.tolist() if v.dtype.kind in "OU" else v)
+                         for label, v in table["coefficients"].items()},
+    }
+
+def simulate_elastic_panel(rng, n_days=730, n_products=50):
+    """
+    Gera o painel sintético completo (exógenas + 50 SKUs x 730 dias) com um
+    np.random.Generator. As vendas de todos os produtos saem de uma só matriz 2-D.
+    """
+    days = np.arange(n_days)
+    
+    # Variáveis Exógenas
+    temp = 15 + 10 * np.sin(2 * np.pi * days / 365) + rng.normal(0, 2, n_days)
+    gas_price = np.linspace(1.5, 1.9, n_days) + rng.normal(0, 0.05, n_days)
+    inflation = np.linspace(0.02, 0.05, n_days) + rng.normal(0, 0.005, n_days)
+    # Dia da semana (0 = segunda) a partir de 2022-01-01, sem pandas: 1970-01-01 foi quinta
+    weekday = (np.datetime64("2022-01-01", "D").astype(np.int64) + days + 3) % 7
+    is_weekend = (weekday >= 5).astype(int)
+
+    # Catálogo: parâmetros "verdadeiros" de cada produto
+    cats = rng.choice(ELASTIC_CATEGORIES, n_products)
+    base_p = np.round(rng.uniform(0.5, 20.0, n_products), 2)
+    true_elasticity = rng.uniform(-2.5, -0.2, n_products)
+    true_promo_lift = rng.uniform(0.2, 0.8, n_products)
+    true_temp_sens = rng.uniform(-0.02, 0.02, n_products) + np.where(cats == "Bebidas", 0.05, 0.0)
+
+    # Simulação de Vendas (produtos x dias)
+    price_shocks = rng.normal(0, 0.15, (n_products, n_days))
+    prices = np.maximum(base_p[:, None] * (1 + price_shocks), 0.1)
+    promos = (price_shocks < -0.10).astype(int)
+    
+    log_q = (4.0 + true_elasticity[:, None] * np.log(prices) + 0.5 * promos + 
+             0.01 * temp + true_promo_lift[:, None] * gas_price + 
+             true_temp_sens[:, None] * inflation * 10 + 0.3 * is_weekend)
+    
+    expected_q = np.clip(np.exp(log_q), 0, 10000)
+    quantities = rng.poisson(expected_q)
+
+    return {
+        "names": [f"SKU-{1001+i} {str(c)[:3].upper()}" for i, c in enumerate(cats)],
+        "categories": [str(c) for c in cats],
+        "temp": temp, "gas": gas_price, "inflation": inflation, "weekend": is_weekend,
+        "prices": prices, "promos": promos, "quantities": quantities
+    }
+
+def fit_elastic_panel(panel, rng):
+    """Estima todos os SKUs do painel e monta a tabela de resultados (todas as categorias)."""
+    temp, gas_price, inflation, is_weekend = panel["temp"], panel["gas"], panel["inflation"], panel["weekend"]
+    prices, promos, quantities = panel["prices"], panel["promos"], panel["quantities"]
+    n_products, n_days = prices.shape
+
+    # Ordem das variáveis X:
+    # 0: Constante (adicionada auto)
+    # 1: ln(Price)
+    # 2: Promo
+    # 3: Temp
+    # 4: Gas
+    # 5: Inf
+    # 6: Weekend
+    var_names = ["Intercept", "ln(Price)", "Promo", "Temp", "GasPrice", "Inflation", "Weekend"]
+    masks = quantities > 0
+    valid = np.flatnonzero(masks.sum(axis=1) > 50)
+    if valid.size == 0: return None
+
+    exog = np.column_stack([temp, gas_price, inflation, is_weekend])          # (dias, 4)
+    X = np.concatenate([np.log(prices[valid])[..., None], promos[valid][..., None],
+                        np.broadcast_to(exog, (valid.size, n_days, 4))], axis=2)
+    Y = np.log(np.maximum(quantities[valid], 1))
+    mask = masks[valid]
+
+    # ESTIMAÇÃO OLS - todos os SKUs num só solve (linhas com Q = 0 ficam fora pela máscara)
+    with span("solve"):
+        betas, r2, p_values, std_err = run_ols_batch(Y, X, mask)
+    t_assemble = time.perf_counter()
+
+    # Médias das variáveis nas observações usadas (curva com as restantes nas médias)
+    w = mask.astype(float)
+    n_obs = w.sum(axis=1)
+    means = np.column_stack([np.ones(valid.size), np.einsum('sd,sdk->sk', w, X) / n_obs[:, None]])
+    P, Q = prices[valid], quantities[valid]
+    p_min = np.where(mask, P, np.inf).min(axis=1)
+    p_max = np.where(mask, P, -np.inf).max(axis=1)
+    curve = demand_curves(betas, means, p_min, p_max)
+
+    # Pontos do gráfico: amostra aleatória por índices (sem DataFrame por SKU)
+    idx = sample_indices(mask, rng)
+    samples = (_take_samples(P, idx), _take_samples(Q, idx))
+
+    # --- CORREÇÃO: EQUAÇÃO COMPLETA ---
+    # Formatação com sinais automáticos (+/-)
+    equations = [(f"ln(Q) = {b[0]:.2f} "
+                  f"{b[1]:+.2f}*ln(P) "
+                  f"{b[2]:+.2f}*Promo "
+                  f"{b[3]:+.3f}*Temp "
+                  f"{b[4]:+.2f}*Gas "
+                  f"{b[5]:+.2f}*Inf "
+                  f"{b[6]:+.2f}*Wknd") for b in betas.tolist()]
+
+    table = build_elastic_table(
+        [panel["names"][i] for i in valid], [panel["categories"][i] for i in valid], var_names,
+        betas, r2, p_values, std_err, means, curve, samples,
+        avg_price=(w * P).sum(axis=1) / n_obs,
+        volume=Q.sum(axis=1),  # Para o simulador (dias com Q = 0 não somam)
+        equations=equations,
+        coefficients={
+            "Gas Sens.": np.round(betas[:, 4], 2),
+            "Inflation Sens.": np.round(betas[:, 5], 2),
+            "Promo Lift": _lift_labels(betas[:, 2]),
+        })
+    record_span("assemble", t_assemble)
+    return table
+
+_elastic_scenarios = TTLCache(maxsize=ELASTIC_SCENARIO_CACHE, ttl=float("inf"), name="elastic_scenarios")
+
+def simulate_and_fit(seed=None):
+    """Cenário completo para uma seed: tabela de resultados. Picklable (process pool)."""
+    rng = np.random.default_rng(seed)
+    with span("simulate"):
+        panel = simulate_elastic_panel(rng)
+    return fit_elastic_panel(panel, rng)
+
+async def elastic_scenario_async(seed=None):
+    """
+    Tabela de resultados para uma seed (LRU limitado), com a simulação + OLS em
+    lote no pool de CPU (a cache fica neste processo). Sem seed gera um cenário
+    novo, como antes, e não guarda nada.
+    """
+    if seed is None:
+        return await run_cpu(simulate_and_fit, None)
+    if seed < 0:
+        raise HTTPException(status_code=400, detail="seed deve ser >= 0.")
+    table, state = _elastic_scenarios.get(seed)
+    if state is None:
+        table = await run_cpu(simulate_and_fit, seed)
+        _elastic_scenarios.set(seed, table)
+    return table
+
+def _elastic_payload(table, category_filter, layout):
+    """O filtro de categoria é só um corte da tabela; depois serializa no layout pedido."""
+    if table is None:
+        return {"layout": "columnar", "variables": [], "product": []} if layout == "columnar" else []
+    with span("format"):
+        table = filter_elastic_table(table, category_filter)
+        return elastic_columns(table) if layout == "columnar" else elastic_rows(table)
+
+@app.get("/api/elastic", response_class=FastJSONResponse)
+async def elastic_engine(category_filter: str = "All", source: str = None, seed: int = None, layout: str = "rows"):
+    """
+    layout=rows (padrão): lista de produtos, formato usado pelo frontend.
+    layout=columnar: um array por campo, bem mais compacto para catálogos grandes.
+    """
+    try:
+        if layout not in ("rows", "columnar"):
+            raise HTTPException(status_code=400, detail="layout deve ser 'rows' ou 'columnar'.")
+
+        async with route_limit("elastic"):
+            # Dados reais (ficheiro CSV/Parquet) em vez da simulação: leitura e
+            # caches de ficheiro ficam neste processo (threads)
+            if source:
+                table = await run_cpu(elastic_from_sales_file, source, process=False)
+            else:
+                table = await elastic_scenario_async(seed)
+            content = await run_cpu(_elastic_payload, table, category_filter, layout, process=False)
+        return FastJSONResponse(content)
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Elastic Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ==========================================
+# === 6. INGESTÃO DE VENDAS REAIS ===
+# ==========================================
+
+# Ficheiros de vendas (CSV ou Parquet) com as colunas de public/mock_sales_data.csv.
+# São lidos em blocos e reduzidos logo a estatísticas suficientes por SKU
+# (X'X, X'y, y'y, n): a memória não cresce com o tamanho do ficheiro.
+SALES_DATA_DIR = os.environ.get("SALES_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "public"))
+SALES_CHUNK_ROWS = int(os.environ.get("SALES_CHUNK_ROWS", 500_000))
+SALES_COLUMNS = ["sku_name", "category", "quantity", "final_price", "is_promo", "weekday"]
+SALES_DTYPES = {"sku_name": "category", "category": "category", "quantity": "float64",
+                "final_price": "float64", "is_promo": "int8", "weekday": "int8"}
+SALES_VAR_NAMES = ["Intercept", "ln(Price)", "Promo", "Weekend"]
+SALES_SAMPLE_POINTS = 50
+
+def _resolve_sales_path(source):
+    """Só aceita ficheiros .csv/.parquet dentro de SALES_DATA_DIR."""
+    name = os.path.basename(source)
+    if not name.lower().endswith((".csv", ".parquet")):
+        raise HTTPException(status_code=400, detail="Formato suportado: .csv ou .parquet")
+    path = os.path.join(SALES_DATA_DIR, name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Ficheiro de vendas não encontrado: {name}")
+    return path
+
+def iter_sales_chunks(path, chunk_rows=SALES_CHUNK_ROWS):
+    """Lê o ficheiro em blocos tipados (SKU e categoria como categóricos)."""
+    if path.lower().endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise HTTPException(status_code=400, detail="Leitura de Parquet requer 'pyarrow'.")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=SALES_COLUMNS):
+            yield batch.to_pandas().astype(SALES_DTYPES)
+    else:
+        yield from pd.read_csv(path, usecols=SALES_COLUMNS, dtype=SALES_DTYPES, chunksize=chunk_rows)
+
+class SalesMoments:
+    """
+    Acumulador de estatísticas suficientes por SKU para ln(Q) ~ 1 + ln(P) + Promo + Weekend.
+    Guarda também somas/mínimos/máximos de preço e volume e as primeiras
+    SALES_SAMPLE_POINTS observações de cada SKU (para o gráfico de dispersão).
+    """
+    def __init__(self):
+        k = len(SALES_VAR_NAMES)
+        self.k = k
+        self.sku_index = {}
+        self.skus = []
+        self.categories = []
+        self.XtX = np.zeros((0, k, k))
+        self.Xty = np.zeros((0, k))
+        self.yty = np.zeros(0)
+        self.n = np.zeros(0)
+        self.price_sum = np.zeros(0)
+        self.qty_sum = np.zeros(0)
+        self.price_min = np.zeros(0)
+        self.price_max = np.zeros(0)
+        self.samples = []
+
+    def _ensure_skus(self, names, categories):
+        """Índices globais dos SKUs indicados (os novos são acrescentados)."""
+        idx = np.empty(len(names), dtype=np.int64)
+        for j, (name, cat) in enumerate(zip(names, categories)):
+            if name not in self.sku_index:
+                self.sku_index[name] = len(self.skus)
+                self.skus.append(name)
+                self.categories.append(cat)
+                self.samples.append([])
+            elif cat and not self.categories[self.sku_index[name]]:
+                self.categories[self.sku_index[name]] = cat   # SKU registado sem categoria
+            idx[j] = self.sku_index[name]
+
+        grow = len(self.skus) - self.n.size
+        if grow > 0:
+            k = self.k
+            self.XtX = np.concatenate([self.XtX, np.zeros((grow, k, k))])
+            self.Xty = np.concatenate([self.Xty, np.zeros((grow, k))])
+            self.yty, self.n, self.price_sum, self.qty_sum = (
+                np.concatenate([a, np.zeros(grow)]) for a in (self.yty, self.n, self.price_sum, self.qty_sum))
+            self.price_min = np.concatenate([self.price_min, np.full(grow, np.inf)])
+            self.price_max = np.concatenate([self.price_max, np.full(grow, -np.inf)])
+        return idx
+
+    def _register(self, chunk):
+        """
+        Mapeia os códigos categóricos do bloco para índices globais de SKU. Só
+        entram os SKUs com linhas no bloco (já filtrado): as categorias do
+        dtype incluem SKUs sem vendas válidas, que ficariam sem categoria.
+        """
+        firsts = chunk.drop_duplicates("sku_name")
+        codes = firsts["sku_name"].cat.codes.values
+        lut = np.full(len(chunk["sku_name"].cat.categories), -1, dtype=np.int64)
+        lut[codes] = self._ensure_skus(firsts["sku_name"].astype(str).tolist(), firsts["category"].astype(str).tolist())
+        return lut
+
+    def add_chunk(self, chunk):
+        chunk = chunk[(chunk["quantity"] > 0) & (chunk["final_price"] > 0)]
+        if chunk.empty: return
+        lut = self._register(chunk)
+        ids = lut[chunk["sku_name"].cat.codes.values]
+        S = len(self.skus)
+
+        price = chunk["final_price"].values
+        qty = chunk["quantity"].values
+        X = np.column_stack([np.ones(len(chunk)), np.log(price),
+                             chunk["is_promo"].values, (chunk["weekday"].values >= 5)])
+        y = np.log(qty)
+
+        # Somas por SKU com bincount (uma passagem por par de colunas, sem ciclos por linha)
+        for a in range(self.k):
+            self.Xty[:, a] += np.bincount(ids, weights=X[:, a] * y, minlength=S)
+            for b in range(a, self.k):
+                v = np.bincount(ids, weights=X[:, a] * X[:, b], minlength=S)
+                self.XtX[:, a, b] += v
+                if a != b: self.XtX[:, b, a] += v
+        self.yty += np.bincount(ids, weights=y * y, minlength=S)
+        self.n += np.bincount(ids, minlength=S)
+        self.price_sum += np.bincount(ids, weights=price, minlength=S)
+        self.qty_sum += np.bincount(ids, weights=qty, minlength=S)
+        np.minimum.at(self.price_min, ids, price)
+        np.maximum.at(self.price_max, ids, price)
+
+        need = [i for i in np.unique(ids) if len(self.samples[i]) < SALES_SAMPLE_POINTS]
+        if need:
+            pts = pd.DataFrame({"id": ids, "p": price, "q": qty})
+            pts = pts[pts["id"].isin(need)].groupby("id").head(SALES_SAMPLE_POINTS)
+            for i, grp in pts.groupby("id"):
+                room = SALES_SAMPLE_POINTS - len(self.samples[i])
+                self.samples[i].extend({"p": float(p), "q": float(q)} for p, q in zip(grp["p"].values[:room], grp["q"].values[:room]))
+
+_sales_moments_cache = TTLCache(maxsize=16, ttl=float("inf"))
+
+def load_sales_moments(path):
+    """Estatísticas suficientes de um ficheiro (em cache até o ficheiro mudar)."""
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    moments, state = _sales_moments_cache.get(key)
+    if state == "fresh": return moments
+    moments = SalesMoments()
+    for chunk in iter_sales_chunks(path):
+        moments.add_chunk(chunk)
+    _sales_moments_cache.set(key, moments)
+    return moments
+
+def elastic_results_from_moments(m, category_filter="All", min_obs=50, fit=None):
+    """
+    Mesma tabela do /api/elastic, mas estimada a partir das estatísticas
+    suficientes. fit = (betas, R2, p-values, std errors) já calculados para todos
+    os SKUs de m (ex: vindos do ElasticModelStore) evita voltar a estimar.
+    """
+    keep = np.flatnonzero((m.n > min_obs) & np.array(
+        [category_filter == "All" or c == category_filter for c in m.categories], dtype=bool))
+    if keep.size == 0: return None
+
+    if fit is None:
+        betas, r2, p_values, std_err = ols_from_moments(m.XtX[keep], m.Xty[keep], m.yty[keep], m.n[keep])
+    else:
+        betas, r2, p_values, std_err = (a[keep] for a in fit)
+
+    # Curva de procura com Promo/Weekend nas médias (X'X[0, j] / n = média da coluna j)
+    n = m.n[keep]
+    means = m.XtX[keep, 0] / n[:, None]
+    curve = demand_curves(betas, means, m.price_min[keep], m.price_max[keep])
+
+    # Amostras guardadas como listas de pontos -> matrizes (S, SALES_SAMPLE_POINTS) com NaN
+    sample_p = np.full((keep.size, SALES_SAMPLE_POINTS), np.nan)
+    sample_q = np.full((keep.size, SALES_SAMPLE_POINTS), np.nan)
+    for j, i in enumerate(keep):
+        pts = m.samples[i][:SALES_SAMPLE_POINTS]
+        sample_p[j, :len(pts)] = [pt["p"] for pt in pts]
+        sample_q[j, :len(pts)] = [pt["q"] for pt in pts]
+
+    equations = [(f"ln(Q) = {b[0]:.2f} "
+                  f"{b[1]:+.2f}*ln(P) "
+                  f"{b[2]:+.2f}*Promo "
+                  f"{b[3]:+.2f}*Wknd") for b in betas.tolist()]
+
+    return build_elastic_table(
+        [m.skus[i] for i in keep], [m.categories[i] for i in keep], SALES_VAR_NAMES,
+        betas, r2, p_values, std_err, means, curve, (sample_p, sample_q),
+        avg_price=m.price_sum[keep] / n,
+        volume=m.qty_sum[keep],
+        equations=equations,
+        coefficients={
+            "Weekend Lift": _lift_labels(betas[:, 3]),
+            "Promo Lift": _lift_labels(betas[:, 2]),
+        })
+
+def elastic_from_sales_file(source, category_filter="All"):
+    if source == "store":
+        return get_model_store().results(category_filter)
+    return elastic_results_from_moments(load_sales_moments(_resolve_sales_path(source)), category_filter)
+
+# ==========================================
+# === 7. MODELO INCREMENTAL (ONLINE) ===
+# ==========================================
+
+# Store persistente com as estatísticas acumuladas por SKU. Cada lote diário de
+# vendas entra como atualização de posto k (X'X += X_b'X_b, X'y += X_b'y_b), com
+# esquecimento exponencial opcional para acompanhar drift. Só os SKUs tocados
+# são re-estimados, e cada re-estimação depende de k, não do histórico.
+ELASTIC_STORE_PATH = os.environ.get("ELASTIC_STORE_PATH")  # ex: /tmp/elastic_store.npz
+
+class ElasticModelStore(SalesMoments):
+    """SalesMoments acumulado ao longo do tempo + coeficientes já estimados."""
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        self.updated_at = None
+        self.sources = {}      # ficheiro -> {"mtime_ns", "size", "merged_at"} dos lotes já incorporados
+        k = self.k
+        self.fit = (np.zeros((0, k)), np.zeros(0), np.ones((0, k)), np.zeros((0, k)))
+
+    def merged(self, source):
+        """True se este ficheiro, com esta versão (mtime + tamanho), já entrou no store."""
+        seen = self.sources.get(source["name"])
+        return seen is not None and (seen["mtime_ns"], seen["size"]) == (source["mtime_ns"], source["size"])
+
+    def _refit(self, idx):
+        """Re-estima apenas os SKUs idx a partir das estatísticas (O(k^3) por SKU, sem n)."""
+        S, k = len(self.skus), self.k
+        grow = S - self.fit[1].size
+        if grow > 0:
+            self.fit = (np.vstack([self.fit[0], np.zeros((grow, k))]), np.append(self.fit[1], np.zeros(grow)),
+                        np.vstack([self.fit[2], np.ones((grow, k))]), np.vstack([self.fit[3], np.zeros((grow, k))]))
+        if len(idx) == 0: return
+        betas, r2, p_values, std_err = ols_from_moments(self.XtX[idx], self.Xty[idx], self.yty[idx], self.n[idx])
+        self.fit[0][idx], self.fit[1][idx], self.fit[2][idx], self.fit[3][idx] = betas, r2, p_values, std_err
+
+    def merge(self, batch, forgetting=1.0, source=None):
+        """
+        Junta um lote (SalesMoments) ao store. Com forgetting < 1 as estatísticas
+        antigas de todos os SKUs são descontadas por esse fator antes de somar o lote.
+        source ({"name", "mtime_ns", "size"}) fica registado: o mesmo ficheiro na
+        mesma versão é recusado (409) em vez de contar as vendas duas vezes.
+        """
+        with self.lock:
+            if source is not None and self.merged(source):
+                raise HTTPException(status_code=409, detail=f"Lote já incorporado: {source['name']}")
+            if forgetting < 1.0:
+                for name in ("XtX", "Xty", "yty", "n", "price_sum", "qty_sum"):
+                    setattr(self, name, getattr(self, name) * forgetting)
+                touched_all = True
+            else:
+                touched_all = False
+
+            idx = self._ensure_skus(batch.skus, batch.categories)
+            self.XtX[idx] += batch.XtX
+            self.Xty[idx] += batch.Xty
+            self.yty[idx] += batch.yty
+            self.n[idx] += batch.n
+            self.price_sum[idx] += batch.price_sum
+            self.qty_sum[idx] += batch.qty_sum
+            self.price_min[idx] = np.minimum(self.price_min[idx], batch.price_min)
+            self.price_max[idx] = np.maximum(self.price_max[idx], batch.price_max)
+            for j, i in enumerate(idx):
+                # Pontos mais recentes primeiro (o gráfico acompanha o drift)
+                self.samples[i] = (batch.samples[j] + self.samples[i])[:SALES_SAMPLE_POINTS]
+
+            # Nos SKUs sem vendas no lote o esquecimento não mexe nos betas, mas
+            # reduz o n efetivo (e logo os erros-padrão): re-estimamos todos.
+            self._refit(np.arange(len(self.skus)) if touched_all else idx)
+            self.updated_at = time.time()
+            if source is not None:
+                self.sources[source["name"]] = {"mtime_ns": source["mtime_ns"], "size": source["size"],
+                                                "merged_at": self.updated_at}
+            if self.path: self.save()
+            return {"skus_updated": int(len(idx)), "skus_total": len(self.skus),
+                    "rows": int(batch.n.sum()), "forgetting": forgetting}
+
+    def results(self, category_filter="All"):
+        with self.lock:
+            return elastic_results_from_moments(self, category_filter, fit=self.fit)
+
+    def save(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, XtX=self.XtX, Xty=self.Xty, yty=self.yty, n=self.n,
+                     price_sum=self.price_sum, qty_sum=self.qty_sum,
+                     price_min=self.price_min, price_max=self.price_max,
+                     skus=np.array(self.skus, dtype=str), categories=np.array(self.categories, dtype=str),
+                     samples=np.array(json.dumps(self.samples)), updated_at=np.float64(self.updated_at or 0),
+                     sources=np.array(json.dumps(self.sources)))
+        os.replace(tmp, self.path)
+
+    @classmethod
+    def load(cls, path):
+        store = cls(path)
+        if not path or not os.path.exists(path): return store
+        with np.load(path, allow_pickle=False) as z:
+            names = [str(x) for x in z["skus"]]
+            store._ensure_skus(names, [str(x) for x in z["categories"]])
+            for name in ("XtX", "Xty", "yty", "n", "price_sum", "qty_sum", "price_min", "price_max"):
+                setattr(store, name, z[name].astype(float))
+            store.samples = json.loads(str(z["samples"]))
+            store.updated_at = float(z["updated_at"]) or None
+            if "sources" in z.files: store.sources = json.loads(str(z["sources"]))
+        store._refit(np.arange(len(store.skus)))
+        return store
+
+_model_store = None
+_model_store_lock = threading.Lock()
+
+def get_model_store():
+    global _model_store
+    with _model_store_lock:
+        if _model_store is None:
+            _model_store = ElasticModelStore.load(ELASTIC_STORE_PATH)
+        return _model_store
+
+@app.post("/api/elastic/update")
+def elastic_update(source: str, forgetting: float = 1.0, x_admin_token: Optional[str] = Header(None)):
+    """
+    Junta um lote de vendas (ficheiro em SALES_DATA_DIR, lido em blocos) ao
+    modelo incremental. Os coeficientes ficam disponíveis em /api/elastic?source=store.
+    Exige X-Admin-Token; um ficheiro já incorporado (mesmo mtime e tamanho) dá 409.
+    """
+    try:
+        require_admin(x_admin_token)
+        if not 0 < forgetting <= 1:
+            raise HTTPException(status_code=400, detail="forgetting deve estar em ]0, 1].")
+        path = _resolve_sales_path(source)
+        st = os.stat(path)
+        stamp = {"name": os.path.basename(path), "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+        store = get_model_store()
+        if store.merged(stamp):
+            raise HTTPException(status_code=409, detail=f"Lote já incorporado: {stamp['name']}")
+        batch = SalesMoments()
+        for chunk in iter_sales_chunks(path):
+            batch.add_chunk(chunk)
+        return {**store.merge(batch, forgetting, stamp), "source": stamp["name"]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Elastic Update Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ==========================================
+# === 8. OTIMIZAÇÃO DE PREÇOS ===
+# ==========================================
+# Procura de cada SKU (modelo log-log estimado): Q(P) = A * P^e * L^promo,
+# com A = exp(beta · médias) sem as colunas de preço e promo, e = beta[ln(Price)]
+# e L = exp(beta[Promo]). Objetivo por SKU: (P - c) * Q(P), com c = custo
+# (margem) ou c = 0 (receita). Um SKU em promoção vende ao preço de tabela
+# menos promo_discount (e beneficia de L). O orçamento de categoria limita o
+# investimento em descontos, sum(max(P0 - P_venda, 0) * Q), onde entra também o
+# desconto das promoções, e acopla os SKUs; é tratado com um multiplicador de
+# Lagrange por categoria (bisseção), sendo o problema de cada SKU resolvido em
+# forma fechada para cada multiplicador.
+
+OPT_BISECTION_STEPS = 60
+
+class CategoryConstraint(BaseModel):
+    budget: Optional[float] = None       # investimento máx. em descontos no horizonte
+    max_change: Optional[float] = None   # variação máx. de preço (fração de P0)
+    promo_slots: int = 0                 # nº máx. de SKUs em promoção
+    promo_discount: Optional[float] = None   # desconto da promoção (fração do preço de tabela)
+
+class PriceOptimizationRequest(BaseModel):
+    objective: str = "margin"            # "margin" ou "revenue"
+    source: Optional[str] = None         # como no /api/elastic (ficheiro ou "store")
+    seed: Optional[int] = None           # cenário simulado (obrigatório sem source)
+    category_filter: str = "All"
+    cost_ratio: float = 0.6              # custo = cost_ratio * P0 quando não vem em costs
+    costs: Dict[str, float] = {}
+    max_change: float = 0.2
+    promo_discount: float = 0.2
+    horizon_days: float = 30
+    constraints: Dict[str, CategoryConstraint] = {}
+
+def _top_k_per_group(group, score, k):
+    """Máscara dos k[g] SKUs de maior score (> 0) em cada grupo g, sem ciclos."""
+    order = np.lexsort((-score, group))
+    g_sorted = group[order]
+    rank = np.arange(order.size) - np.searchsorted(g_sorted, g_sorted, side="left")
+    selected = np.zeros(group.size, dtype=bool)
+    selected[order] = (rank < k[g_sorted]) & (score[order] > 0)
+    return selected
+
+def _stationary_price(cost, e):
+    """argmax de (P - c) * P^e: c * e / (1 + e) para e < -1; sem máximo interior caso contrário."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(e < -1, cost * e / np.minimum(1 + e, -1e-12), np.inf)
+
+def optimize_prices(ln_a, elasticity, promo_lift, p0, cost, lo, hi, group, budget, slots, promo_discount,
+                    steps=OPT_BISECTION_STEPS):
+    """
+    Preços ótimos para todo o catálogo (arrays (S,)), com orçamento (G,), slots
+    de promoção (G,) e desconto de promoção (S,). Para um multiplicador lam, o
+    valor líquido de um SKU vendido a P < P0 é (1 + lam) * A * P^e * (P - c'),
+    c' = (c + lam * P0) / (1 + lam), pelo que o ótimo de cada região é o ponto
+    estacionário projetado na caixa. Com promoção a caixa do preço de venda
+    encolhe por (1 - desconto) e Q sobe por L; entram em promoção os SKUs em
+    que isso mais aumenta o valor líquido (já com o custo do desconto).
+    Devolve (preço de venda, promo, multiplicador por grupo).
+    """
+    group = np.asarray(group)
+    a = np.exp(ln_a)
+    lift = np.exp(promo_lift)
+    promo_scale = 1 - promo_discount
+
+    def best(lam_sku, scale, mult):
+        # Candidatos: ótimo interior e extremos de cada região (acima / abaixo de P0)
+        lo_s, hi_s = lo * scale, hi * scale
+        mid = np.clip(p0, lo_s, hi_s)
+        c_down = (cost + lam_sku * p0) / (1 + lam_sku)
+        cand = np.column_stack([
+            np.clip(_stationary_price(cost, elasticity), mid, hi_s), mid, hi_s,
+            np.clip(_stationary_price(c_down, elasticity), lo_s, mid), lo_s])
+        q = (a * mult)[:, None] * cand ** elasticity[:, None]
+        spend = np.maximum(p0[:, None] - cand, 0) * q
+        net = (cand - cost[:, None]) * q - lam_sku[:, None] * spend
+        k = np.argmax(net, axis=1)
+        rows = np.arange(p0.size)
+        return cand[rows, k], net[rows, k], spend[rows, k]
+
+    def solve(lam_sku):
+        price, value, spend = best(lam_sku, 1.0, 1.0)
+        price_p, value_p, spend_p = best(lam_sku, promo_scale, lift)
+        promo = _top_k_per_group(group, value_p - value, slots)
+        spend = np.where(promo, spend_p, spend)
+        return np.where(promo, price_p, price), promo, np.bincount(group, weights=spend, minlength=budget.size)
+
+    n_groups = budget.size
+    lam = np.zeros(n_groups)
+    price, promo, spend = solve(lam[group])
+    over = spend > budget * (1 + 1e-9)
+    if over.any():
+        # Limite superior viável: com lam -> inf nenhum SKU vende abaixo de P0 (gasto 0)
+        lam_lo, lam_hi = np.zeros(n_groups), np.where(over, 1.0, 0.0)
+        for _ in range(steps):
+            _, _, spend = solve(lam_hi[group])
+            still = spend > budget * (1 + 1e-9)
+            if not still.any(): break
+            lam_hi = np.where(still, lam_hi * 4, lam_hi)
+        for _ in range(steps):
+            mid = np.where(over, 0.5 * (lam_lo + lam_hi), 0.0)
+            _, _, spend = solve(mid[group])
+            feasible = spend <= budget * (1 + 1e-9)
+            lam_hi = np.where(over & feasible, mid, lam_hi)
+            lam_lo = np.where(over & ~feasible, mid, lam_lo)
+        lam = lam_hi
+        price, promo, spend = solve(lam[group])
+    return price, promo, lam
+
+def price_optimization(table, req):
+    """Corpo do /api/elastic/optimize sobre a tabela já estimada (CPU; corre em run_cpu)."""
+    table = filter_elastic_table(table, req.category_filter)
+    if table["product"].size == 0:
+        raise HTTPException(status_code=404, detail="Sem SKUs estimados para otimizar.")
+
+    var_names = table["variables"]
+    i_price, i_promo = var_names.index("ln(Price)"), var_names.index("Promo")
+    betas, means = table["coef"], table["means"]
+    elasticity, promo_lift = betas[:, i_price], betas[:, i_promo]
+    # Procura base por dia (restantes variáveis nas médias, sem promo) * horizonte
+    ln_a = (np.einsum('sk,sk->s', means, betas) - means[:, i_price] * elasticity
+            - means[:, i_promo] * promo_lift + np.log(req.horizon_days))
+
+    p0 = table["avg_price"]
+    categories, group = np.unique(table["category"].astype(str), return_inverse=True)
+    cons = [req.constraints.get(c, CategoryConstraint()) for c in categories]
+    max_change = np.array([req.max_change if c.max_change is None else c.max_change for c in cons])
+    if (max_change < 0).any() or (max_change >= 1).any():
+        raise HTTPException(status_code=400, detail="max_change deve estar em [0, 1[.")
+    budget = np.array([np.inf if c.budget is None else c.budget for c in cons])
+    if (budget < 0).any():
+        raise HTTPException(status_code=400, detail="budget deve ser >= 0.")
+    slots = np.array([max(c.promo_slots, 0) for c in cons])
+    promo_discount = np.array([req.promo_discount if c.promo_discount is None else c.promo_discount for c in cons])
+    if (promo_discount < 0).any() or (promo_discount >= 1).any():
+        raise HTTPException(status_code=400, detail="promo_discount deve estar em [0, 1[.")
+
+    if req.objective == "margin":
+        cost = np.array([req.costs.get(name, req.cost_ratio * p) for name, p in zip(table["product"], p0.tolist())])
+    else:
+        cost = np.zeros(p0.size)
+    lo, hi = p0 * (1 - max_change[group]), p0 * (1 + max_change[group])
+
+    price, promo, lam = optimize_prices(ln_a, elasticity, promo_lift, p0, cost, lo, hi, group, budget, slots,
+                                        promo_discount[group])
+    list_price = np.where(promo, price / (1 - promo_discount[group]), price)
+
+    q0 = np.exp(ln_a + elasticity * np.log(p0))
+    q1 = np.exp(ln_a + elasticity * np.log(price) + promo_lift * promo)
+    obj0, obj1 = (p0 - cost) * q0, (price - cost) * q1
+    spend = np.maximum(p0 - price, 0) * q1
+    spend_cat = np.bincount(group, weights=spend, minlength=categories.size)
+    obj0_cat = np.bincount(group, weights=obj0, minlength=categories.size)
+    obj1_cat = np.bincount(group, weights=obj1, minlength=categories.size)
+    promo_cat = np.bincount(group, weights=promo, minlength=categories.size)
+
+    return {
+        "objective": req.objective,
+        "horizon_days": req.horizon_days,
+        "totals": {
+            "current": round(float(obj0.sum()), 2),
+            "optimized": round(float(obj1.sum()), 2),
+            "uplift_pct": round(float((obj1.sum() / obj0.sum() - 1) * 100), 2) if obj0.sum() else None,
+        },
+        "categories": {
+            str(c): {"current": round(float(obj0_cat[g]), 2), "optimized": round(float(obj1_cat[g]), 2),
+                     "discount_spend": round(float(spend_cat[g]), 2),
+                     "budget": None if np.isinf(budget[g]) else float(budget[g]),
+                     "shadow_price": round(float(lam[g]), 6),
+                     "promo_used": int(promo_cat[g]), "promo_slots": int(slots[g]),
+                     "promo_discount": float(promo_discount[g])}
+            for g, c in enumerate(categories)
+        },
+        "product": table["product"].tolist(),
+        "category": table["category"].tolist(),
+        "elasticity": np.round(elasticity, 3),
+        "cost": np.round(cost, 2),
+        "price_current": np.round(p0, 2),
+        "price_opt": np.round(list_price, 2),
+        "change_pct": np.round((list_price / p0 - 1) * 100, 1),
+        "promo": promo,
+        "price_promo": np.round(np.where(promo, price, np.nan), 2),   # null sem promoção
+        "volume_current": np.round(q0, 1),
+        "volume_opt": np.round(q1, 1),
+        "objective_current": np.round(obj0, 2),
+        "objective_opt": np.round(obj1, 2),
+    }
+
+@app.post("/api/elastic/optimize", response_class=FastJSONResponse)
+async def elastic_optimize(req: PriceOptimizationRequest):
+    """
+    Preços ótimos (margem ou receita) para os SKUs estimados pelo /api/elastic,
+    com variação máxima de preço, orçamento de descontos e slots de promoção por
+    categoria. Resposta em layout colunar (um array por campo).
+    """
+    try:
+        if req.objective not in ("margin", "revenue"):
+            raise HTTPException(status_code=400, detail="objective deve ser 'margin' ou 'revenue'.")
+        if req.horizon_days <= 0:
+            raise HTTPException(status_code=400, detail="horizon_days deve ser positivo.")
+        # Sem seed o cenário simulado seria um catálogo novo (e irrepetível) em cada chamada
+        if req.source is None and req.seed is None:
+            raise HTTPException(status_code=400, detail="Indique source (ficheiro ou 'store') ou seed (cenário simulado).")
+
+        async with route_limit("elastic"):
+            if req.source:
+                table = await run_cpu(elastic_from_sales_file, req.source, process=False)
+            else:
+                table = await elastic_scenario_async(req.seed)
+            if table is None:
+                raise HTTPException(status_code=404, detail="Sem SKUs estimados para otimizar.")
+            return FastJSONResponse(await run_cpu(price_optimization, table, req))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Optimize Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ==========================================
+# === 9. ARRANQUE (COLD START) ===
+# ==========================================
+COLD_START_BUDGET_MS = float(os.environ.get("COLD_START_BUDGET_MS", 1000))
+
+STARTUP_REPORT = {
+    "module_ms": _since(_BOOT_T0),        # import completo de api/index.py
+    "eager_imports_ms": _EAGER_IMPORTS,
+    "lazy_imports_ms": _LAZY_IMPORTS,     # preenchido à medida que as rotas carregam módulos
+    "budget_ms": COLD_START_BUDGET_MS,
+}
+if os.environ.get("STARTUP_REPORT") == "1":
+    print(f"Startup: {STARTUP_REPORT['module_ms']} ms (imports: {_EAGER_IMPORTS}, orçamento {COLD_START_BUDGET_MS} ms)")
+
+@app.get("/api/startup")
+def startup_report():
+    """
+    Quanto custou o cold start desta instância: import do módulo (com o peso
+    das dependências eager) e cada dependência lazy já carregada por alguma rota.
+    """
+    module_ms = STARTUP_REPORT["module_ms"]
+    return {
+        **STARTUP_REPORT,
+        "lazy_loaded": sorted(_LAZY_IMPORTS),
+        "lazy_pending": sorted(m for m in ("yfinance", "pandas", "requests", "httpx") if m not in _LAZY_IMPORTS),
+        "within_budget": module_ms <= COLD_START_BUDGET_MS,
+    }
+
+# ==========================================
+# === 10. MÉTRICAS (PROMETHEUS) ===
+# ==========================================
+def _collect_gauges():
+    """Valores instantâneos lidos no momento do scrape."""
+    for limiter in list(_route_limiters.values()) + [_cpu_limiter]:
+        yield "api_limiter_in_flight", {"limiter": limiter.name}, limiter.active
+        yield "api_limiter_waiting", {"limiter": limiter.name}, limiter.waiting
+    for cache in TTLCache.registry:
+        yield "api_cache_entries", {"cache": cache.name}, len(cache)
+    yield "api_startup_seconds", {"module": "api.index"}, round(STARTUP_REPORT["module_ms"] / 1000, 4)
+    if _panel_store is not None:
+        yield "api_panel_store_age_seconds", {}, round(time.time() - _panel_store.built_at, 1)
+    for module, ms in list(_EAGER_IMPORTS.items()) + list(_LAZY_IMPORTS.items()):
+        yield "api_startup_seconds", {"module": module}, round(ms / 1000, 4)
+
+METRICS.gauges.append(_collect_gauges)
+
+@app.get("/api/metrics")
+def metrics():
+    """Métricas deste processo no formato de texto do Prometheus (0.0.4)."""
+    return Response(METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,5 +1,5 @@
 'use client';
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { ArrowLeft, Search, TrendingUp, RefreshCcw, Activity, BarChart3, AlertCircle, BookOpen, Minus, Divide, Equal, Plus, X, Wallet, Landmark, Users, ArrowRight, AlertTriangle, Terminal, Scale, Github, Linkedin, Mail, PieChart, Target, Clock, Layers } from 'lucide-react';
 
@@ -8,6 +8,8 @@ export default function DCFPage() {
   const [ticker, setTicker] = useState('');
   
   // Smart Search States
+  // sid: lets the API drop this page's superseded in-flight searches
+  const searchSession = useRef(Math.random().toString(36).slice(2));
   const [searchResults, setSearchResults] = useState<any[]>([]);
   const [showSuggestions, setShowSuggestions] = useState(false);
   const [isSearching, setIsSearching] = useState(false);
@@ -35,7 +37,7 @@ export default function DCFPage() {
       if (ticker.length > 1 && showSuggestions) {
         setIsSearching(true);
         try {
-            const res = await fetch(`/api/search?q=${ticker}`);
+            const res = await fetch(`/api/search?q=${encodeURIComponent(ticker)}&sid=${searchSession.current}`);
             const list = await res.json();
             setSearchResults(list);
         } catch (e) {
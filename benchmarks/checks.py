@@ -0,0 +1,345 @@
+"""
+Verificações de correção dos solvers do api/index.py (offline, sem rede).
+Cada solver rápido é comparado com uma referência lenta mas óbvia:
+
+    python benchmarks/checks.py                 # todas
+    python benchmarks/checks.py --only scm,ols  # subconjunto
+
+- ols:       run_ols_batch (com e sem máscara) e a ingestão de vendas em blocos
+             (SalesMoments -> ols_from_moments) contra np.linalg.lstsq por SKU;
+- scm:       pesos de optimize_weights_manual / optimize_weights_batch (conjunto
+             ativo e FISTA) contra a solução exata do QP no simplex, por
+             enumeração dos suportes; placebos com J > 64 dadores pelo
+             certificado KKT e contra um FISTA longo;
+- optimizer: optimize_prices contra força bruta numa grelha de preços, com
+             slots de promoção e orçamento;
+- worldbank: painéis pedidos ao stub com per_page limitado (várias páginas)
+             contra a fixture, e o SCM com donors=all igual com e sem paginação.
+
+Sai com código 1 se alguma verificação falhar.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import run  # noqa: E402
+
+GROUPS = ("ols", "scm", "optimizer", "worldbank")
+
+api = None
+failures = []
+
+def check(name, ok, detail=""):
+    print(f"  {'ok  ' if ok else 'FAIL'} {name:<52} {detail}")
+    if not ok: failures.append(name)
+
+# ==========================================
+# === OLS ===
+# ==========================================
+
+def lstsq_per_sku(Y, X, mask=None):
+    """Referência: um lstsq por SKU com constante, só nas linhas válidas."""
+    betas = []
+    for s in range(Y.shape[0]):
+        rows = slice(None) if mask is None else mask[s]
+        A = np.column_stack([np.ones(Y.shape[1]), X[s]])[rows]
+        betas.append(np.linalg.lstsq(A, Y[s][rows], rcond=None)[0])
+    return np.array(betas)
+
+def check_ols():
+    Y, X = run.ols_problem(50, 730)
+    beta = api.run_ols_batch(Y, X)[0]
+    err = np.max(np.abs(beta - lstsq_per_sku(Y, X)))
+    check("run_ols_batch vs lstsq", err < 1e-6, f"max|db| = {err:.2e}")
+
+    mask = np.random.default_rng(1).uniform(size=Y.shape) > 0.3
+    beta = api.run_ols_batch(Y, X, mask)[0]
+    err = np.max(np.abs(beta - lstsq_per_sku(Y, X, mask)))
+    check("run_ols_batch (mask) vs lstsq", err < 1e-6, f"max|db| = {err:.2e}")
+
+    frame = run.sales_frame(50_000, 40, seed=3)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sales.csv")
+        frame.to_csv(path, index=False)
+        moments = run.sales_moments(path, chunk_rows=7_000)   # vários blocos, SKUs a aparecer a meio
+    beta = api.ols_from_moments(moments.XtX, moments.Xty, moments.yty, moments.n)[0]
+    frame = frame[(frame["quantity"] > 0) & (frame["final_price"] > 0)]
+    err = 0.0
+    for i, sku in enumerate(moments.skus):
+        rows = frame[frame["sku_name"] == sku]
+        A = np.column_stack([np.ones(len(rows)), np.log(rows["final_price"]), rows["is_promo"],
+                             (rows["weekday"] >= 5).astype(float)])
+        ref = np.linalg.lstsq(A, np.log(rows["quantity"]), rcond=None)[0]
+        err = max(err, float(np.max(np.abs(beta[i] - ref))))
+    check("ingestão em blocos vs lstsq por SKU", err < 1e-6, f"{len(moments.skus)} SKUs, max|db| = {err:.2e}")
+
+# ==========================================
+# === SCM ===
+# ==========================================
+
+def normalized_qp(X0, X1):
+    """A mesma forma quadrática que os solvers usam: 0.5 w'Gw - b'w + c, dados a dividir pelo máximo."""
+    scale = np.max(np.abs(X0))
+    A, y = X0 / scale, X1 / scale
+    return A.T @ A, A.T @ y, 0.5 * float(y @ y)
+
+def exact_simplex(G, b):
+    """
+    Solução exata por enumeração dos suportes: em cada suporte resolve o sistema
+    KKT com a restrição soma = 1 e fica com o melhor ponto de pesos não negativos.
+    """
+    J = b.size
+    best_w, best_f = None, np.inf
+    for k in range(1, J + 1):
+        for idx in itertools.combinations(range(J), k):
+            idx = list(idx)
+            K = np.zeros((k + 1, k + 1))
+            K[:k, :k] = G[np.ix_(idx, idx)]
+            K[:k, k] = 1.0; K[k, :k] = 1.0
+            z = np.linalg.lstsq(K, np.append(b[idx], 1.0), rcond=None)[0][:k]
+            if z.min() < -1e-12 or abs(z.sum() - 1) > 1e-9: continue
+            w = np.zeros(J); w[idx] = np.maximum(z, 0)
+            f = 0.5 * w @ G @ w - b @ w
+            if f < best_f: best_w, best_f = w, f
+    return best_w
+
+def kkt_violation(G, b, w):
+    """
+    Certificado de otimalidade para J grande (a enumeração não escala): no ótimo
+    há nu com (Gw - b)_j + nu = 0 no suporte e >= 0 fora dele. Devolve a maior
+    violação, relativa à escala do gradiente.
+    """
+    g = G @ w - b
+    support = w > 1e-12
+    nu = -float(np.mean(g[support]))
+    stationarity = float(np.max(np.abs(g[support] + nu)))
+    dual = float(max(0.0, -np.min(g[~support] + nu))) if (~support).any() else 0.0
+    primal = abs(w.sum() - 1) + float(max(0.0, -w.min()))
+    return max(stationarity, dual, primal) / max(1.0, float(np.max(np.abs(b))), float(np.max(np.abs(G))))
+
+def objective(G, b, c, w):
+    return 0.5 * float(w @ G @ w) - float(b @ w) + c
+
+def compare_weights(name, G, b, c, w, ref, w_tol=1e-6, f_tol=1e-9):
+    f, f_ref = objective(G, b, c, w), objective(G, b, c, ref)
+    dw = float(np.max(np.abs(w - ref)))
+    rel = (f - f_ref) / max(f_ref, 1e-12)
+    check(name, dw < w_tol and rel < f_tol, f"max|dw| = {dw:.1e}, f/f* - 1 = {rel:.1e}")
+
+class patched_active_set:
+    """Troca api._active_set_simplex: fail="all" desliga-o, fail="first" só falha a 1.ª tentativa (sem start)."""
+    def __init__(self, fail):
+        self.fail = fail
+
+    def __enter__(self):
+        self.original = original = api._active_set_simplex
+        fail = self.fail
+        api._active_set_simplex = lambda G, b, **kw: (original(G, b, **kw) if fail == "first" and "start" in kw
+                                                      else (None, 0))
+
+    def __exit__(self, *exc):
+        api._active_set_simplex = self.original
+
+def check_scm():
+    for n_donors, n_years in ((5, 12), (8, 8), (12, 12), (12, 30)):
+        X0, X1 = run.scm_problem(n_donors, n_years)
+        G, b, c = normalized_qp(X0, X1)
+        ref = exact_simplex(G, b)
+        W, info = api.optimize_weights_manual(X0, X1, return_info=True)
+        compare_weights(f"manual ({info['method']}) J={n_donors} T={n_years}", G, b, c, W, ref)
+
+        # FISTA sozinho, com iterações de sobra: só pára com o gap de dualidade certificado
+        with patched_active_set("all"):
+            W, info = api.optimize_weights_manual(X0, X1, iterations=100_000, return_info=True)
+        compare_weights(f"fista ({info['iterations']} it.) J={n_donors} T={n_years}", G, b, c, W, ref,
+                        w_tol=1e-3, f_tol=1e-6)
+        check("  fista reporta convergência", info["converged"])
+
+        # FISTA no limite de iterações: o conjunto ativo recomeça do seu suporte
+        with patched_active_set("first"):
+            W, info = api.optimize_weights_manual(X0, X1, iterations=50, return_info=True)
+        compare_weights(f"{info['method']} (50 it.) J={n_donors} T={n_years}", G, b, c, W, ref)
+
+    # Placebo: cada dador é sintetizado pelos restantes, em lote
+    X0, _ = run.scm_problem(11, 12)
+    X0b = np.stack([np.delete(X0, j, axis=1) for j in range(11)])
+    X1b = X0.T
+    refs = [exact_simplex(*normalized_qp(X0b[j], X1b[j])[:2]) for j in range(11)]
+    for label, fail, iterations, w_tol, f_tol in (("conjunto ativo", None, 3000, 1e-6, 1e-9),
+                                                  ("fista", "all", 100_000, 1e-3, 1e-6),
+                                                  ("fista + conjunto ativo", "first", 50, 1e-6, 1e-9)):
+        if fail is None:
+            W, _ = api.optimize_weights_batch(X0b, X1b, iterations=iterations)
+        else:
+            with patched_active_set(fail):
+                W, _ = api.optimize_weights_batch(X0b, X1b, iterations=iterations)
+        worst_dw, worst_rel = 0.0, 0.0
+        for j, ref in enumerate(refs):
+            G, b, c = normalized_qp(X0b[j], X1b[j])
+            worst_dw = max(worst_dw, float(np.max(np.abs(W[j] - ref))))
+            worst_rel = max(worst_rel, (objective(G, b, c, W[j]) - objective(G, b, c, ref)) / objective(G, b, c, ref))
+        check(f"batch ({label}) J=10 x 11 placebos", worst_dw < w_tol and worst_rel < f_tol,
+              f"max|dw| = {worst_dw:.1e}, f/f* - 1 = {worst_rel:.1e}")
+
+    # Placebos com mais de 64 dadores (painéis personalizados até SCM_MAX_DONORS):
+    # certificado KKT (à tolerância do conjunto ativo) e nada pior do que um FISTA longo
+    for n_donors in (100, 200):
+        X0, _ = run.scm_problem(n_donors + 1, 12, seed=2)
+        X0b = np.stack([np.delete(X0, j, axis=1) for j in range(n_donors + 1)])
+        X1b = X0.T
+        t0 = time.perf_counter()
+        W, info = api.optimize_weights_batch(X0b, X1b)
+        elapsed = time.perf_counter() - t0
+        worst_kkt = max(kkt_violation(*normalized_qp(X0b[j], X1b[j])[:2], W[j]) for j in range(n_donors + 1))
+        check(f"batch (placebo) J={n_donors} x {n_donors + 1}: KKT", worst_kkt < 1e-8,
+              f"max violação {worst_kkt:.1e}, {elapsed * 1e3:.0f} ms, máx. {int(info['iterations'].max())} pivôs")
+        sample = [0, n_donors // 2, n_donors]
+        with patched_active_set("all"):
+            W_ref, _ = api.optimize_weights_batch(X0b[sample], X1b[sample], iterations=200_000)
+        worst_rel = 0.0
+        for j, ref in zip(sample, W_ref):
+            G, b, c = normalized_qp(X0b[j], X1b[j])
+            worst_rel = max(worst_rel, (objective(G, b, c, W[j]) - objective(G, b, c, ref)) / objective(G, b, c, ref))
+        check(f"batch (placebo) J={n_donors}: f <= f(fista longo)", worst_rel < 1e-9,
+              f"f/f_ref - 1 = {worst_rel:.1e} em {len(sample)} placebos")
+
+# ==========================================
+# === OTIMIZAÇÃO DE PREÇOS ===
+# ==========================================
+
+def brute_force_prices(a, e, lift, p0, cost, lo, hi, budget, slots, discount, grid=121):
+    """
+    Melhor valor numa grelha: cada SKU escolhe um preço (grid pontos na caixa)
+    com ou sem promoção; combinações com mais promoções do que slots ou gasto
+    acima do orçamento ficam de fora.
+    """
+    promo, value, spend = np.zeros(1), np.zeros(1), np.zeros(1)
+    for s in range(p0.size):
+        sku_promo = np.repeat([0.0, 1.0], grid)
+        p = np.tile(np.linspace(lo[s], hi[s], grid), 2) * np.where(sku_promo > 0, 1 - discount, 1.0)
+        q = a[s] * np.where(sku_promo > 0, lift[s], 1.0) * p ** e[s]
+        promo = (promo[:, None] + sku_promo[None]).ravel()
+        value = (value[:, None] + ((p - cost[s]) * q)[None]).ravel()
+        spend = (spend[:, None] + (np.maximum(p0[s] - p, 0) * q)[None]).ravel()
+        ok = (promo <= slots) & (spend <= budget)
+        promo, value, spend = promo[ok], value[ok], spend[ok]
+    return float(value.max())
+
+def check_optimizer():
+    rng = np.random.default_rng(5)
+    S = 3
+    e = rng.uniform(-3.0, -1.2, S)
+    lift = np.exp(rng.uniform(0.2, 0.6, S))
+    p0 = rng.uniform(2, 10, S)
+    a = 1000 * p0 ** -e
+    cost = 0.6 * p0
+    lo, hi = 0.8 * p0, 1.2 * p0
+    discount = 0.2
+
+    def optimize(budget, slots):
+        price, promo, _ = api.optimize_prices(np.log(a), e, np.log(lift), p0, cost, lo, hi, np.zeros(S, dtype=int),
+                                              np.array([budget]), np.array([slots]), np.full(S, discount))
+        q = a * np.where(promo, lift, 1.0) * price ** e
+        return float(np.sum((price - cost) * q)), float(np.sum(np.maximum(p0 - price, 0) * q)), int(promo.sum())
+
+    free_spend = optimize(np.inf, 2)[1]
+    for label, budget, slots in (("sem restrições", np.inf, 0), ("1 slot de promoção", np.inf, 1),
+                                 ("2 slots", np.inf, 2), ("2 slots, orçamento a 50%", 0.5 * free_spend, 2),
+                                 ("2 slots, orçamento 0", 0.0, 2)):
+        value, spend, used = optimize(budget, slots)
+        ref = brute_force_prices(a, e, lift, p0, cost, lo, hi, budget, slots, discount)
+        feasible = used <= slots and spend <= budget * (1 + 1e-9)
+        # A grelha não é exata: o ótimo contínuo pode ficar ligeiramente acima dela
+        gap = (ref - value) / ref
+        check(f"optimize_prices vs força bruta ({label})", feasible and gap < 1e-3,
+              f"valor {value:.2f} vs {ref:.2f} (gap {gap:+.1e}), gasto {spend:.2f}, promo {used}")
+
+# ==========================================
+# === BANCO MUNDIAL (PAGINAÇÃO) ===
+# ==========================================
+
+def fixture_panel(code, countries, years):
+    """Painel ano x país esperado, lido diretamente da fixture (países com buracos saem)."""
+    import pandas as pd
+    series = run.stub.load_fixture(run.stub.WB_FIXTURE)["indicators"][code]
+    frame = pd.DataFrame({c: [series.get(c, {}).get(str(y)) for y in range(years[0], years[1] + 1)] for c in countries},
+                         index=range(years[0], years[1] + 1), dtype=float)
+    return frame.dropna(axis=1)
+
+async def _scm_all_donors(client):
+    r = await client.get("/api/scm?indicator=GDP_PC&target=BR&donors=all&treatment_year=2016&start_year=2000")
+    return r.json()
+
+def check_worldbank():
+    handler = run.stub.StubHandler
+    fixture = run.stub.load_fixture(run.stub.WB_FIXTURE)
+    countries = sorted(fixture["countries"].values())
+    code, years = api.INDICATORS["GDP_PC"], (2000, 2024)
+    expected = fixture_panel(code, countries, years)
+    rows = len(countries) * (years[1] - years[0] + 1)
+
+    handler.max_per_page = 50
+    try:
+        for label, fetch in (("sync", lambda: api._fetch_wb_remote(code, countries, years)),
+                             ("async", lambda: asyncio.run(api._fetch_wb_remote_async(code, countries, years)))):
+            hits = handler.hits
+            frame = fetch()
+            pages = handler.hits - hits
+            same = (frame is not None and list(frame.columns) == list(expected.columns)
+                    and np.allclose(frame.values, expected.values))
+            check(f"painel paginado ({label}) == fixture", same and pages == -(-rows // 50),
+                  f"{pages} páginas, {0 if frame is None else frame.shape[1]}/{expected.shape[1]} países")
+
+        # Rota completa: donors=all com e sem paginação dá o mesmo controlo sintético
+        import httpx
+
+        async def both():
+            async with api.app.router.lifespan_context(api.app):
+                transport = httpx.ASGITransport(app=api.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://checks", timeout=60) as client:
+                    run.reset_caches()
+                    handler.max_per_page = 50
+                    paged = await _scm_all_donors(client)
+                    run.reset_caches()
+                    handler.max_per_page = None
+                    return paged, await _scm_all_donors(client)
+
+        paged, single = asyncio.run(both())
+        same = (paged.get("donors") == single.get("donors") and paged.get("contributors") == single.get("contributors"))
+        check("/api/scm donors=all: paginado == uma página", same and bool(paged.get("donors")),
+              f"{len(paged.get('donors', []))} dadores, {len(paged.get('donors_dropped', []))} sem série completa")
+    finally:
+        handler.max_per_page = None
+
+CHECKS = {"ols": check_ols, "scm": check_scm, "optimizer": check_optimizer, "worldbank": check_worldbank}
+
+def main(argv=None):
+    global api
+    parser = argparse.ArgumentParser(description="Verificações de correção dos solvers do api/index.py.")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"grupos separados por vírgula ({', '.join(GROUPS)})")
+    args = parser.parse_args(argv)
+    groups = [g.strip() for g in args.only.split(",") if g.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown: parser.error(f"grupos desconhecidos: {', '.join(sorted(unknown))}")
+
+    server = run.setup_api()
+    api = run.api
+    try:
+        for group in groups:
+            print(f"[{group}]")
+            CHECKS[group]()
+    finally:
+        server.shutdown()
+    print(f"{len(failures)} falhas" if failures else "tudo ok")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
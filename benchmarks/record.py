@@ -0,0 +1,198 @@
+"""
+Grava as fixtures usadas pelo stub dos benchmarks (benchmarks/fixtures/).
+
+    python benchmarks/record.py                # grava da rede (Banco Mundial + Yahoo)
+    python benchmarks/record.py --synthetic    # gera dados determinísticos, sem rede
+
+As fixtures guardam só o que o api/index.py consome: séries país x ano de cada
+indicador, preço recente + info + linhas das demonstrações usadas no DCF, e as
+respostas da pesquisa. O campo "source" indica a origem ("live" ou "synthetic").
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import zlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+from index import COUNTRY_ISO3 as ISO3, DONOR_POOL, INDICATORS, TARGET_COUNTRY, WB_API_URL, YAHOO_SEARCH_URL  # noqa: E402
+
+from stub import FIXTURES_DIR, WB_FIXTURE, YAHOO_FIXTURE  # noqa: E402
+
+FIXTURE_YEARS = (1990, 2024)
+COUNTRIES = [TARGET_COUNTRY] + DONOR_POOL
+
+TICKERS = {
+    "AAPL": ("Apple Inc.", "NMS"), "MSFT": ("Microsoft Corporation", "NMS"),
+    "GOOGL": ("Alphabet Inc.", "NMS"), "AMZN": ("Amazon.com, Inc.", "NMS"),
+    "NVDA": ("NVIDIA Corporation", "NMS"), "META": ("Meta Platforms, Inc.", "NMS"),
+    "TSLA": ("Tesla, Inc.", "NMS"), "AMD": ("Advanced Micro Devices, Inc.", "NMS"),
+    "INTC": ("Intel Corporation", "NMS"), "ORCL": ("Oracle Corporation", "NYQ"),
+    "IBM": ("International Business Machines Corporation", "NYQ"), "KO": ("The Coca-Cola Company", "NYQ"),
+    "PEP": ("PepsiCo, Inc.", "NMS"), "JNJ": ("Johnson & Johnson", "NYQ"),
+    "PFE": ("Pfizer Inc.", "NYQ"), "XOM": ("Exxon Mobil Corporation", "NYQ"),
+    "CVX": ("Chevron Corporation", "NYQ"), "WMT": ("Walmart Inc.", "NYQ"),
+    "COST": ("Costco Wholesale Corporation", "NMS"), "NKE": ("NIKE, Inc.", "NYQ"),
+    "DIS": ("The Walt Disney Company", "NYQ"), "NFLX": ("Netflix, Inc.", "NMS"),
+    "ADBE": ("Adobe Inc.", "NMS"), "CRM": ("Salesforce, Inc.", "NYQ"),
+    "APP": ("AppLovin Corporation", "NMS"), "APPN": ("Appian Corporation", "NGM"),
+    "AAL": ("American Airlines Group Inc.", "NMS"), "GALP.LS": ("Galp Energia, SGPS, S.A.", "LIS"),
+    "EDP.LS": ("EDP - Energias de Portugal, S.A.", "LIS"), "JMT.LS": ("Jerónimo Martins, SGPS, S.A.", "LIS"),
+}
+SEARCH_QUERIES = ["A", "AP", "APP", "AA", "M", "MS", "GALP", "EDP", "N", "NV", "T", "TS"]
+
+# Linhas das demonstrações lidas por _load_yahoo_statements (chave + alternativas)
+STATEMENT_ROWS = {
+    "income_stmt": ["Ebit", "Operating Income", "EBIT", "Total Revenue", "Operating Expense",
+                    "Tax Provision", "Pretax Income"],
+    "cashflow": ["Depreciation And Amortization", "Capital Expenditure"],
+    "balance_sheet": ["Cash And Cash Equivalents", "Total Debt"],
+}
+
+def _rng(*keys):
+    return np.random.default_rng(zlib.crc32("|".join(keys).encode()))
+
+def _round(value, digits=6):
+    return float(f"{value:.{digits}g}")
+
+def _write(path, payload):
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+        f.write("\n")
+    print(f"{path}: {os.path.getsize(path) / 1024:.0f} KB")
+
+# ==========================================
+# === DADOS SINTÉTICOS ===
+# ==========================================
+
+def _synthetic_series(code, country, years):
+    """Série anual plausível: níveis com crescimento composto, taxas em torno de uma média."""
+    rng = _rng(code, country)
+    n = years[1] - years[0] + 1
+    shock = np.where(np.arange(years[0], years[1] + 1) >= 2022, 1.0, 0.0) if country == "RUS" else np.zeros(n)
+    if code.endswith((".ZG", ".ZS")):
+        mean = {"FP.CPI.TOTL.ZG": 6.0, "SL.UEM.TOTL.ZS": 7.0, "NY.GDP.MKTP.KD.ZG": 3.0,
+                "NE.TRD.GNFS.ZS": 55.0, "BX.KLT.DINV.WD.GD.ZS": 2.5}.get(code, 5.0)
+        level = mean * rng.uniform(0.5, 1.5)
+        noise = np.zeros(n)
+        for t in range(1, n):   # AR(1) à volta do nível do país
+            noise[t] = 0.6 * noise[t - 1] + rng.normal(0, 0.25 * mean)
+        values = level + noise - 2.0 * shock * (code == "NY.GDP.MKTP.KD.ZG")
+    else:
+        scale = {"PA.NUS.FCRF": 10.0, "NY.GDP.PCAP.KD": 1e4}.get(code, 1e11)
+        growth = rng.normal(rng.uniform(0.01, 0.05), 0.03, n)
+        values = scale * rng.lognormal(0, 0.8) * np.exp(np.cumsum(growth) - 0.06 * shock)
+    values = [_round(v) for v in values]
+    # Buracos como na API real (o SCM descarta países com anos em falta)
+    if country != "RUS" and rng.uniform() < 0.1:
+        values[-1] = None
+    return {str(y): v for y, v in zip(range(years[0], years[1] + 1), values)}
+
+def synthetic_worldbank(years=FIXTURE_YEARS):
+    return {
+        "source": "synthetic", "recorded_at": datetime.date.today().isoformat(), "years": list(years),
+        "countries": {c: ISO3[c] for c in COUNTRIES},
+        "indicators": {code: {ISO3[c]: _synthetic_series(code, ISO3[c], years) for c in COUNTRIES}
+                       for code in INDICATORS.values()},
+    }
+
+def synthetic_yahoo():
+    tickers = {}
+    for symbol in TICKERS:
+        rng = _rng("yahoo", symbol)
+        revenue = rng.lognormal(np.log(5e10), 1.0)
+        margin = rng.uniform(0.05, 0.35)
+        ebit = revenue * margin
+        pretax = ebit * rng.uniform(0.85, 1.0)
+        shares = rng.lognormal(np.log(2e9), 0.8)
+        fcf = ebit * 0.8
+        price = fcf * rng.uniform(12, 30) / shares
+        tickers[symbol] = {
+            "history": [_round(price * (1 + r)) for r in np.cumsum(rng.normal(0, 0.01, 5))],
+            "info": {"sharesOutstanding": int(shares), "currency": "EUR" if symbol.endswith(".LS") else "USD",
+                     "shortName": TICKERS[symbol][0]},
+            "income_stmt": {"Ebit": _round(ebit), "Total Revenue": _round(revenue),
+                            "Operating Expense": _round(revenue - ebit),
+                            "Tax Provision": _round(pretax * rng.uniform(0.12, 0.28)), "Pretax Income": _round(pretax)},
+            "cashflow": {"Depreciation And Amortization": _round(revenue * rng.uniform(0.02, 0.08)),
+                         "Capital Expenditure": _round(-revenue * rng.uniform(0.03, 0.10))},
+            "balance_sheet": {"Cash And Cash Equivalents": _round(revenue * rng.uniform(0.05, 0.4)),
+                              "Total Debt": _round(revenue * rng.uniform(0.0, 0.6))},
+        }
+    universe = [{"symbol": s, "shortname": name, "exchange": exch, "quoteType": "EQUITY"}
+                for s, (name, exch) in TICKERS.items()]
+    # Ruído que a rota filtra (quoteType != EQUITY)
+    universe += [{"symbol": "AAPL240621C00190000", "shortname": "AAPL Jun 2024 190 Call", "exchange": "OPR",
+                  "quoteType": "OPTION"},
+                 {"symbol": "MSFUX", "shortname": "Morgan Stanley Fund", "exchange": "NAS", "quoteType": "MUTUALFUND"}]
+    return {"source": "synthetic", "recorded_at": datetime.date.today().isoformat(),
+            "tickers": tickers, "universe": universe, "search": {}}
+
+# ==========================================
+# === GRAVAÇÃO DA REDE ===
+# ==========================================
+
+def record_worldbank(years=FIXTURE_YEARS):
+    import requests
+    countries, indicators = {}, {}
+    for code in INDICATORS.values():
+        url = (f"{WB_API_URL}/country/{';'.join(COUNTRIES)}/indicator/{code}"
+               f"?format=json&per_page=20000&date={years[0]}:{years[1]}")
+        data = requests.get(url, timeout=30).json()
+        series = indicators.setdefault(code, {})
+        for e in (data[1] if len(data) > 1 and data[1] else []):
+            iso3 = e["countryiso3code"]
+            countries[e["country"]["id"]] = iso3
+            series.setdefault(iso3, {})[e["date"]] = e["value"]
+        print(f"  {code}: {sum(len(v) for v in series.values())} valores")
+    return {"source": "live", "recorded_at": datetime.date.today().isoformat(), "years": list(years),
+            "countries": countries, "indicators": indicators}
+
+def _statement_rows(df, rows):
+    out = {}
+    if df is None or df.empty: return out
+    for row in rows:
+        if row in df.index:
+            value = df.loc[row].iloc[0]
+            if value == value: out[row] = float(value)   # ignora NaN
+    return out
+
+def record_yahoo():
+    import requests
+    import yfinance as yf
+    tickers = {}
+    for symbol in TICKERS:
+        stock = yf.Ticker(symbol)
+        hist = stock.history(period="5d")
+        info = stock.info or {}
+        tickers[symbol] = {
+            "history": [float(v) for v in hist["Close"].tolist()] if not hist.empty else [],
+            "info": {k: info[k] for k in ("sharesOutstanding", "currency", "shortName") if k in info},
+            **{name: _statement_rows(getattr(stock, name), rows) for name, rows in STATEMENT_ROWS.items()},
+        }
+        print(f"  {symbol}: {len(tickers[symbol]['history'])} preços")
+    search, universe = {}, {}
+    for query in SEARCH_QUERIES:
+        r = requests.get(YAHOO_SEARCH_URL, params={"q": query, "quotesCount": 10, "newsCount": 0},
+                         headers={"User-Agent": "Mozilla/5.0"}, timeout=10)
+        quotes = [{k: q.get(k) for k in ("symbol", "shortname", "exchange", "quoteType")}
+                  for q in r.json().get("quotes", [])]
+        search[query] = quotes
+        for q in quotes: universe[q["symbol"]] = q
+    return {"source": "live", "recorded_at": datetime.date.today().isoformat(),
+            "tickers": tickers, "universe": list(universe.values()), "search": search}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grava as fixtures do stub dos benchmarks.")
+    parser.add_argument("--synthetic", action="store_true", help="gera dados determinísticos (sem rede)")
+    parser.add_argument("--only", choices=["worldbank", "yahoo"], help="grava só uma das fixtures")
+    args = parser.parse_args()
+
+    if args.only in (None, "worldbank"):
+        _write(WB_FIXTURE, synthetic_worldbank() if args.synthetic else record_worldbank())
+    if args.only in (None, "yahoo"):
+        _write(YAHOO_FIXTURE, synthetic_yahoo() if args.synthetic else record_yahoo())
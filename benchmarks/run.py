@@ -0,0 +1,541 @@
+"""
+Benchmarks offline dos motores do api/index.py (sem rede, reprodutíveis).
+
+    python benchmarks/run.py                                  # suite completa
+    python benchmarks/run.py --quick --only scm,ols           # subconjunto rápido
+    python benchmarks/run.py --out novo.json --compare base.json --threshold 0.25
+
+Grupos:
+- scm:    optimize_weights_manual (nº de dadores x anos) e optimize_weights_batch (placebo);
+- ols:    run_multivariate_ols (linhas), ciclo por SKU vs run_ols_batch (SKUs x linhas)
+          e fit_elastic_panel (SKUs);
+- elastic: ingestão de vendas em blocos (linhas), merge no ElasticModelStore
+          (SKUs) e otimização de preços do catálogo (SKUs, com orçamento e promo);
+- dcf:    dcf_value_vectorized escalar e em grelha, dcf_monte_carlo (caminhos);
+- vc:     vc_value_vectorized escalar e em grelha, Monte Carlo por blocos;
+- routes: latência a frio (caches limpas) e a quente + débito com N clientes
+          concorrentes, pela app ASGI (httpx.ASGITransport, com lifespan), e o
+          lote do SCM a frio contra os mesmos indicadores pedidos um a um.
+          Com --panel-store o SCM é servido pelo painel local (construído a
+          partir do stub antes das medições) em vez de pedidos ao Banco Mundial.
+
+O Banco Mundial e a pesquisa do Yahoo vêm do stub HTTP local (stub.py) com as
+fixtures de benchmarks/fixtures/; o yfinance é substituído por FixtureTicker.
+Os dados de cada caso saem de seeds fixas. O resultado é um JSON com o ambiente
+(commit, versões, CPU) e estatísticas por caso (segundos por chamada); com
+--compare, casos cuja mediana piore mais do que --threshold contam como
+regressão e o processo sai com código 1.
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+SCHEMA_VERSION = 1
+GROUPS = ("scm", "ols", "elastic", "dcf", "vc", "routes")
+
+sys.path.insert(0, BENCH_DIR)
+import stub  # noqa: E402
+
+api = None   # api/index.py, importado em setup_api() depois do stub estar no ar
+
+def setup_api(stub_latency=0.0, yahoo_latency=0.0):
+    """Arranca o stub, aponta o api/index.py para ele e importa o módulo."""
+    global api
+    server, base_url = stub.start_stub(latency=stub_latency)
+    os.environ.update(stub.stub_env(base_url))
+    # Nada de estado persistente nem pré-aquecimento: cada execução parte do zero
+    for var in ("WB_CACHE_DIR", "ELASTIC_STORE_PATH", "WB_PREFETCH", "STARTUP_REPORT"):
+        os.environ.pop(var, None)
+    sys.path.insert(0, os.path.join(REPO_DIR, "api"))
+    import index
+    stub.FixtureTicker.latency = yahoo_latency
+    index.yf = stub.FixtureYF
+    api = index
+    return server
+
+def reset_caches():
+    """Limpa todas as caches em memória da API (pedido "a frio")."""
+    for cache in api.TTLCache.registry: cache.clear()
+    api._search_fetches.clear()
+    api._search_latest.clear()
+
+# ==========================================
+# === MEDIÇÃO ===
+# ==========================================
+
+def summarize(samples, number=1):
+    """Estatísticas (segundos por chamada) de uma lista de amostras."""
+    s = sorted(samples)
+    median = statistics.median(s)
+    return {
+        "n": len(s), "number": number,
+        "min": s[0], "median": median, "mean": statistics.fmean(s),
+        "p95": s[min(len(s) - 1, int(round(0.95 * (len(s) - 1))))],
+        "stdev": statistics.stdev(s) if len(s) > 1 else 0.0,
+        "ops_per_sec": 1.0 / median if median > 0 else None,
+    }
+
+def measure(fn, repeat=7, target=0.05, max_number=10_000):
+    """
+    Corre fn uma vez (aquecimento), calibra o nº de chamadas por amostra para
+    cada amostra durar pelo menos target segundos e devolve as estatísticas.
+    """
+    fn()
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number): fn()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= target or number >= max_number: break
+        number = min(max_number, number * max(2, int(target / max(elapsed, 1e-9))))
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(number): fn()
+        samples.append((time.perf_counter() - t0) / number)
+    return summarize(samples, number)
+
+class Suite:
+    def __init__(self, quick=False):
+        self.quick = quick
+        self.repeat = 5 if quick else 7
+        self.target = 0.02 if quick else 0.05
+        self.results = []
+
+    def pick(self, full, quick):
+        return quick if self.quick else full
+
+    def add(self, group, name, params, stats, **extra):
+        self.results.append({"group": group, "name": name, "params": params, "unit": "s",
+                             "stats": stats, "extra": extra})
+        label = " ".join(f"{k}={v}" for k, v in params.items())
+        rps = f"  {extra['requests_per_sec']:8.1f} req/s" if "requests_per_sec" in extra else ""
+        print(f"  {name:<32} {label:<36} median {stats['median'] * 1e3:10.3f} ms"
+              f"  p95 {stats['p95'] * 1e3:10.3f} ms{rps}")
+
+    def bench(self, group, name, params, fn, **extra):
+        self.add(group, name, params, measure(fn, self.repeat, self.target), **extra)
+
+# ==========================================
+# === SCM ===
+# ==========================================
+
+def scm_problem(n_donors, n_years, seed=0):
+    """Painel de dadores com fatores comuns; o tratado é uma combinação esparsa deles."""
+    rng = np.random.default_rng(seed)
+    factors = np.cumsum(rng.normal(0.02, 0.05, (n_years, 3)), axis=0)
+    loadings = rng.uniform(0.5, 1.5, (3, n_donors))
+    X0 = 100 * np.exp(factors @ loadings / 3) + rng.normal(0, 1, (n_years, n_donors))
+    w = np.zeros(n_donors)
+    support = rng.choice(n_donors, min(n_donors, 4), replace=False)
+    w[support] = rng.dirichlet(np.ones(support.size))
+    X1 = X0 @ w + rng.normal(0, 0.5, n_years)
+    return X0, X1
+
+def bench_scm(suite):
+    store = api.get_panel_store()
+    if store is not None:
+        countries = [c["iso3"] for c in store.countries]
+        suite.bench("scm", "panel_store_frame", {"countries": len(countries), "years": 15},
+                    lambda: store.frame("NY.GDP.MKTP.KD", countries, api.WB_YEARS))
+
+    for n_years in suite.pick((8, 12, 30), (12,)):
+        for n_donors in suite.pick((5, 14, 32, 64, 128, 256), (5, 14, 64, 256)):
+            X0, X1 = scm_problem(n_donors, n_years)
+            _, info = api.optimize_weights_manual(X0, X1, return_info=True)
+            suite.bench("scm", "optimize_weights_manual", {"donors": n_donors, "years": n_years},
+                        lambda: api.optimize_weights_manual(X0, X1),
+                        method=info["method"], iterations=int(info["iterations"]),
+                        converged=bool(info["converged"]))
+
+    # Placebo: um problema por dador, todos num lote
+    for n_donors in suite.pick((14, 64, 256), (14, 256)):
+        X0, X1 = scm_problem(n_donors + 1, 12)
+        X0b = np.stack([np.delete(X0, j, axis=1) for j in range(n_donors)])
+        X1b = X0[:, :n_donors].T
+        suite.bench("scm", "optimize_weights_batch", {"problems": n_donors, "donors": n_donors, "years": 12},
+                    lambda: api.optimize_weights_batch(X0b, X1b))
+
+# ==========================================
+# === OLS / ELASTICIDADE ===
+# ==========================================
+
+def ols_problem(n_skus, n_rows, k=5, seed=0):
+    """Regressões log-log com k regressores por SKU: (Y (S, N), X (S, N, k))."""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 1, (n_skus, n_rows, k))
+    X[..., 0] = np.log(rng.uniform(1, 20, (n_skus, n_rows)))      # ln(preço)
+    X[..., 1] = rng.uniform(size=(n_skus, n_rows)) < 0.1            # promo
+    beta = rng.normal(0, 0.5, (n_skus, k))
+    Y = 3 + np.einsum("snk,sk->sn", X, beta) + rng.normal(0, 0.3, (n_skus, n_rows))
+    return Y, X
+
+def bench_ols(suite):
+    for n_rows in suite.pick((100, 730, 10_000, 100_000), (730, 10_000)):
+        Y, X = ols_problem(1, n_rows)
+        suite.bench("ols", "run_multivariate_ols", {"rows": n_rows, "regressors": 5},
+                    lambda: api.run_multivariate_ols(Y[0], X[0]))
+
+    for n_rows in suite.pick((365, 730), (730,)):
+        for n_skus in suite.pick((10, 50, 200, 1000), (10, 200)):
+            Y, X = ols_problem(n_skus, n_rows)
+            suite.bench("ols", "run_multivariate_ols_loop", {"skus": n_skus, "rows": n_rows},
+                        lambda: [api.run_multivariate_ols(Y[s], X[s]) for s in range(n_skus)])
+            suite.bench("ols", "run_ols_batch", {"skus": n_skus, "rows": n_rows},
+                        lambda: api.run_ols_batch(Y, X))
+
+    for n_products in suite.pick((50, 200, 1000), (50, 200)):
+        panel = api.simulate_elastic_panel(np.random.default_rng(7), n_products=n_products)
+        suite.bench("ols", "fit_elastic_panel", {"skus": n_products, "days": 730},
+                    lambda: api.fit_elastic_panel(panel, np.random.default_rng(7)))
+
+# ==========================================
+# === VENDAS / MODELO INCREMENTAL / OTIMIZAÇÃO ===
+# ==========================================
+
+SALES_CATEGORIES = ["Lacticínios", "Mercearia", "Bebidas", "Limpeza", "Frescos"]
+
+def sales_frame(n_rows, n_skus, seed=0):
+    """Vendas diárias com as colunas de public/mock_sales_data.csv e procura log-log por SKU."""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    sku = rng.integers(0, n_skus, n_rows)
+    elasticity = rng.uniform(-3.0, -0.5, n_skus)
+    base = rng.uniform(0.5, 20, n_skus)
+    promo = (rng.uniform(size=n_rows) < 0.15).astype(np.int8)
+    weekday = rng.integers(0, 7, n_rows).astype(np.int8)
+    price = base[sku] * rng.uniform(0.8, 1.2, n_rows) * np.where(promo, 0.8, 1.0)
+    ln_q = 4 + elasticity[sku] * np.log(price / base[sku]) + 0.3 * promo + 0.1 * (weekday >= 5)
+    quantity = np.maximum(np.round(np.exp(ln_q + rng.normal(0, 0.3, n_rows))), 0)
+    return pd.DataFrame({
+        "date": "2024-01-01", "sku_name": np.char.add("SKU-", sku.astype(str)),
+        "category": np.array(SALES_CATEGORIES)[sku % len(SALES_CATEGORIES)], "quantity": quantity,
+        "final_price": np.round(price, 2), "is_promo": promo, "weekday": weekday})
+
+def sales_moments(path, chunk_rows=None):
+    """Lê o ficheiro em blocos para um SalesMoments (o que o /api/elastic?source=... faz)."""
+    moments = api.SalesMoments()
+    for chunk in api.iter_sales_chunks(path, chunk_rows or api.SALES_CHUNK_ROWS):
+        moments.add_chunk(chunk)
+    return moments
+
+def optimization_request(table, budget_share=0.5, slots=5):
+    """
+    Pedido com slots de promoção em todas as categorias e orçamento igual a
+    budget_share do gasto sem orçamento (a bisseção do multiplicador fica ativa).
+    """
+    free = api.PriceOptimizationRequest(
+        seed=0, constraints={c: api.CategoryConstraint(promo_slots=slots) for c in np.unique(table["category"].astype(str))})
+    spend = api.price_optimization(table, free)["categories"]
+    return api.PriceOptimizationRequest(seed=0, constraints={
+        c: api.CategoryConstraint(budget=budget_share * v["discount_spend"], promo_slots=slots) for c, v in spend.items()})
+
+def bench_elastic(suite):
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in suite.pick((100_000, 1_000_000), (100_000,)):
+            path = os.path.join(tmp, f"sales_{n_rows}.csv")
+            sales_frame(n_rows, 500).to_csv(path, index=False)
+            suite.bench("elastic", "sales_ingest", {"rows": n_rows, "skus": 500, "chunk_rows": 100_000},
+                        lambda: sales_moments(path, 100_000), bytes=os.path.getsize(path))
+
+        for n_skus in suite.pick((500, 5000), (500,)):
+            path = os.path.join(tmp, f"batch_{n_skus}.csv")
+            sales_frame(20 * n_skus, n_skus, seed=1).to_csv(path, index=False)
+            batch = sales_moments(path)
+            store = api.ElasticModelStore()
+            store.merge(batch)
+            # Sem source o store aceita o mesmo lote outra vez (conta como um dia novo de vendas)
+            suite.bench("elastic", "store_merge", {"skus": n_skus, "forgetting": 0.99},
+                        lambda: store.merge(batch, 0.99))
+
+    for n_products in suite.pick((50, 200, 1000), (50, 200)):
+        panel = api.simulate_elastic_panel(np.random.default_rng(7), n_products=n_products)
+        table = api.fit_elastic_panel(panel, np.random.default_rng(7))
+        req = optimization_request(table)
+        suite.bench("elastic", "price_optimization", {"skus": int(table["product"].size)},
+                    lambda: api.price_optimization(table, req))
+
+# ==========================================
+# === DCF / VC ===
+# ==========================================
+
+DCF_TICKER = "AAPL"
+VC_INPUTS = {"tam": 5e9, "quota": 2.0, "margem": 20.0, "multiplo": 15.0, "desconto": 40.0, "diluicao": 10.0,
+             "target_year": 2031, "acoes_atuais": 1e7, "caixa_atual": 2e6, "burn_anual": 1.5e6}
+
+def grid_shape(cells, dims):
+    side = round(cells ** (1 / dims))
+    return (side,) * dims
+
+def bench_dcf(suite):
+    src = api._fetch_dcf_source(DCF_TICKER)
+    inputs = api._extract_dcf_inputs(src)
+    revenue = src["metrics"]["revenue"]
+
+    suite.bench("dcf", "dcf_value_vectorized", {"cells": 1},
+                lambda: api.dcf_value_vectorized(inputs, 0.075, 0.025, 0.09))
+    for cells in suite.pick((100, 10_000, 1_000_000), (100, 10_000)):
+        n = grid_shape(cells, 3)[0]
+        wacc = np.linspace(0.06, 0.12, n)[:, None, None]
+        g1 = np.linspace(0.0, 0.15, n)[None, :, None]
+        g2 = np.linspace(0.0, 0.045, n)[None, None, :]
+        suite.bench("dcf", "dcf_value_vectorized", {"cells": n ** 3},
+                    lambda: api.dcf_value_vectorized(inputs, g1, g2, wacc))
+
+    dists = {"g1": (0.075, 0.02), "g2": (0.025, 0.005), "wacc": (0.09, 0.01), "margin_sd": 0.02, "capex_sd": 0.10}
+    for paths in suite.pick((10_000, 100_000, 1_000_000), (10_000, 100_000)):
+        suite.bench("dcf", "dcf_monte_carlo", {"paths": paths},
+                    lambda: api.dcf_monte_carlo(inputs, revenue, src["price"], dists, paths, seed=1, workers=1))
+
+def bench_vc(suite):
+    ano = datetime.datetime.now().year
+    suite.bench("vc", "vc_value_vectorized", {"cells": 1},
+                lambda: api.vc_value_vectorized(**VC_INPUTS, ano_atual=ano))
+    for cells in suite.pick((100, 10_000, 1_000_000), (100, 10_000)):
+        n = grid_shape(cells, 4)[0]
+        axes = dict(VC_INPUTS)
+        axes.update(tam=np.linspace(1e9, 1e10, n), quota=np.linspace(0.5, 5, n),
+                    multiplo=np.linspace(5, 25, n), desconto=np.linspace(20, 60, n))
+        grid = dict(zip(axes, np.ix_(*[np.atleast_1d(v) for v in axes.values()])))
+        suite.bench("vc", "vc_value_vectorized", {"cells": n ** 4},
+                    lambda: api.vc_value_vectorized(**grid, ano_atual=ano))
+
+    dists = {name: api._parse_vc_dist(name, str(v)) for name, v in VC_INPUTS.items()}
+    dists.update(tam=("lognormal", (5e9, 0.5)), quota=("uniform", (0.5, 5.0)),
+                 margem=("normal", (20.0, 5.0)), burn_anual=("triangular", (1e6, 1.5e6, 3e6)))
+    for draws in suite.pick((10_000, 250_000), (10_000,)):
+        suite.bench("vc", "vc_monte_carlo_chunk", {"draws": draws},
+                    lambda: api.vc_bands(api._vc_mc_chunk(dists, draws, np.random.SeedSequence(1), ano)))
+
+# ==========================================
+# === ROTAS (ASGI) ===
+# ==========================================
+
+def _qs(params):
+    return "&".join(f"{k}={v}" for k, v in params.items())
+
+ROUTE_CASES = [
+    ("scm", "/api/scm?indicator=GDP_CONST"),
+    ("scm_placebo", "/api/scm?indicator=GDP_CONST&placebo=true"),
+    ("scm_batch", "/api/scm/batch"),
+    ("scm_custom", "/api/scm?indicator=GDP_PC&target=BR&donors=all&treatment_year=2016&start_year=2000"),
+    ("dcf", f"/api/dcf?ticker={DCF_TICKER}"),
+    ("dcf_mc", f"/api/dcf?ticker={DCF_TICKER}&mc_paths=100000&mc_seed=1"),
+    ("dcf_grid", f"/api/dcf/grid?ticker={DCF_TICKER}"),
+    ("vc", "/api/vc?" + _qs(VC_INPUTS)),
+    ("vc_simulate_mc", "/api/vc/simulate?" + _qs({**VC_INPUTS, "tam": "lognormal:5e9:0.5", "quota": "0.5:5"})
+     + "&mode=mc&n=100000&seed=1"),
+    ("vc_simulate_sweep", "/api/vc/simulate?" + _qs({**VC_INPUTS, "tam": "1e9:1e10:50", "quota": "0.5:5:50",
+                                                     "multiplo": "5:25:20"}) + "&mode=sweep"),
+    ("elastic", "/api/elastic?seed=7"),
+    ("elastic_columnar", "/api/elastic?seed=7&layout=columnar"),
+    ("search", "/api/search?q=APP"),
+]
+
+async def _timed_get(client, path):
+    t0 = time.perf_counter()
+    r = await client.get(path)
+    await r.aread()
+    return time.perf_counter() - t0, r
+
+async def _throughput(client, path, concurrency, total):
+    """total pedidos repartidos por concurrency clientes; devolve (stats, req/s, estados)."""
+    latencies, statuses = [], {}
+    queue = iter(range(total))
+
+    async def worker():
+        for _ in queue:
+            dt, r = await _timed_get(client, path)
+            latencies.append(dt)
+            statuses[str(r.status_code)] = statuses.get(str(r.status_code), 0) + 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    return summarize(latencies), total / wall, statuses
+
+async def _bench_routes(suite, only_routes=None):
+    import httpx
+    cold_n = suite.pick(5, 3)
+    warm_n = suite.pick(30, 10)
+    levels = suite.pick((1, 8, 32), (1, 8))
+    total = suite.pick(128, 32)
+
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            for name, path in ROUTE_CASES:
+                if only_routes and name not in only_routes: continue
+                reset_caches()
+                _, r = await _timed_get(client, path)
+                if r.status_code != 200:
+                    print(f"  {name}: HTTP {r.status_code} {r.text[:200]}")
+                    continue
+                size = len(r.content)
+
+                cold = []
+                for _ in range(cold_n):
+                    reset_caches()
+                    cold.append((await _timed_get(client, path))[0])
+                suite.add("routes", "route_cold", {"route": name}, summarize(cold), path=path, bytes=size)
+
+                warm = [(await _timed_get(client, path))[0] for _ in range(warm_n)]
+                suite.add("routes", "route_warm", {"route": name}, summarize(warm), path=path, bytes=size)
+
+                for concurrency in levels:
+                    stats, rps, statuses = await _throughput(client, path, concurrency, total)
+                    suite.add("routes", "route_throughput", {"route": name, "concurrency": concurrency},
+                              stats, path=path, requests=total, requests_per_sec=rps, statuses=statuses)
+
+            if not only_routes or "scm_batch" in only_routes:
+                await _bench_batch_vs_serial(suite, client)
+
+async def _bench_batch_vs_serial(suite, client):
+    """SCM a frio: /api/scm/batch contra os mesmos indicadores em /api/scm, um a um."""
+    names = list(api.INDICATORS)
+    batch, serial = [], []
+    for _ in range(suite.pick(5, 3)):
+        reset_caches()
+        batch.append((await _timed_get(client, "/api/scm/batch"))[0])
+        reset_caches()
+        t0 = time.perf_counter()
+        for name in names:
+            await _timed_get(client, f"/api/scm?indicator={name}")
+        serial.append(time.perf_counter() - t0)
+    suite.add("routes", "scm_cold_batch_vs_serial", {"mode": "batch", "indicators": len(names)}, summarize(batch))
+    suite.add("routes", "scm_cold_batch_vs_serial", {"mode": "serial", "indicators": len(names)}, summarize(serial))
+
+def bench_routes(suite, only_routes=None):
+    asyncio.run(_bench_routes(suite, only_routes))
+
+BENCHES = {"scm": bench_scm, "ols": bench_ols, "elastic": bench_elastic, "dcf": bench_dcf, "vc": bench_vc}
+
+# ==========================================
+# === RESULTADOS / COMPARAÇÃO ===
+# ==========================================
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def environment(args):
+    import fastapi
+    fixtures = {}
+    for path in (stub.WB_FIXTURE, stub.YAHOO_FIXTURE):
+        data = stub.load_fixture(path)
+        fixtures[os.path.basename(path)] = {"source": data.get("source"), "recorded_at": data.get("recorded_at"),
+                                            "sha256": _sha256(path)}
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": _git("rev-parse", "HEAD"),
+        "git_dirty": bool(_git("status", "--porcelain", "--", "api")),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "machine": platform.machine(), "cpu_count": os.cpu_count(),
+        "numpy": np.__version__, "fastapi": fastapi.__version__, "orjson": api.orjson is not None,
+        "quick": args.quick, "groups": args.only, "panel_store": args.panel_store,
+        "stub_latency_ms": args.stub_latency_ms,
+        "yahoo_latency_ms": args.yahoo_latency_ms,
+        "config": {k: os.environ[k] for k in ("CPU_POOL_WORKERS", "DCF_MC_WORKERS", "ROUTE_LIMITS",
+                                              "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS") if k in os.environ},
+        "fixtures": fixtures,
+    }
+
+def result_key(result):
+    return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+def compare(current, baseline, threshold):
+    """Compara medianas caso a caso. Devolve (linhas, nº de regressões)."""
+    base = {result_key(r): r for r in baseline["results"]}
+    rows, regressions = [], 0
+    for r in current["results"]:
+        b = base.get(result_key(r))
+        if b is None or not b["stats"]["median"]: continue
+        ratio = r["stats"]["median"] / b["stats"]["median"]
+        status = "regressão" if ratio > 1 + threshold else ("melhoria" if ratio < 1 / (1 + threshold) else "igual")
+        regressions += status == "regressão"
+        rows.append({"name": r["name"], "params": r["params"], "baseline": b["stats"]["median"],
+                     "current": r["stats"]["median"], "ratio": ratio, "status": status})
+    return rows, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks offline do api/index.py.")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"grupos separados por vírgula ({', '.join(GROUPS)})")
+    parser.add_argument("--routes", help="só estas rotas (nomes de ROUTE_CASES, separados por vírgula)")
+    parser.add_argument("--quick", action="store_true", help="grelhas e repetições reduzidas")
+    parser.add_argument("--out", help="ficheiro JSON de saída (padrão: benchmarks/results/<commit>-<data>.json)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.2, help="piora relativa da mediana tolerada")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="atraso por pedido no stub HTTP")
+    parser.add_argument("--yahoo-latency-ms", type=float, default=0.0, help="atraso por chamada ao FixtureTicker")
+    parser.add_argument("--panel-store", action="store_true", help="SCM servido pelo painel local (PANEL_STORE_DIR)")
+    args = parser.parse_args(argv)
+    args.only = [g.strip() for g in args.only.split(",") if g.strip()]
+    unknown = set(args.only) - set(GROUPS)
+    if unknown: parser.error(f"grupos desconhecidos: {', '.join(sorted(unknown))}")
+
+    server = setup_api(args.stub_latency_ms / 1000, args.yahoo_latency_ms / 1000)
+    suite = Suite(quick=args.quick)
+    panel_dir = tempfile.TemporaryDirectory() if args.panel_store else None
+    if panel_dir is not None:
+        api.PANEL_STORE_DIR = panel_dir.name
+        api.build_panel_store()
+    try:
+        for group in args.only:
+            print(f"[{group}]")
+            if group == "routes":
+                bench_routes(suite, args.routes.split(",") if args.routes else None)
+            else:
+                BENCHES[group](suite)
+    finally:
+        server.shutdown()
+        if panel_dir is not None: panel_dir.cleanup()
+
+    report = {"schema": SCHEMA_VERSION, "environment": environment(args), "results": suite.results}
+    regressions = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows, regressions = compare(report, baseline, args.threshold)
+        report["comparison"] = {"baseline": args.compare, "baseline_commit": baseline["environment"].get("git_commit"),
+                                "threshold": args.threshold, "regressions": regressions, "cases": rows}
+        print(f"[compare] vs {args.compare}")
+        for row in rows:
+            if row["status"] != "igual":
+                label = " ".join(f"{k}={v}" for k, v in row["params"].items())
+                print(f"  {row['status']:<10} {row['name']:<32} {label:<36} x{row['ratio']:.2f}")
+        print(f"  {len(rows)} casos comparados, {regressions} regressões (limiar {args.threshold:.0%})")
+
+    out = args.out
+    if out is None:
+        commit = (report["environment"]["git_commit"] or "nogit")[:8]
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{commit}-{stamp}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+    print(f"resultados: {out}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
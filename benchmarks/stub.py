@@ -0,0 +1,220 @@
+"""
+Stub local (sem rede) das APIs externas usadas pelo api/index.py, servido a
+partir das fixtures gravadas em benchmarks/fixtures/ (ver record.py):
+
+- Banco Mundial v2: /v2/country/<ISO2|ISO3;...|all>/indicator/<código>?format=json&date=a:b
+  (paginado como a API real) e a lista de países /v2/country?format=json
+- Pesquisa do Yahoo: /v1/finance/search?q=...&quotesCount=...
+- yfinance: FixtureTicker substitui yf.Ticker (history, info e demonstrações).
+
+    python benchmarks/stub.py --port 8765     # stub isolado (ex: uvicorn à parte)
+    WB_API_URL=http://127.0.0.1:8765/v2 YAHOO_SEARCH_URL=http://127.0.0.1:8765/v1/finance/search ...
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pandas as pd
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+WB_FIXTURE = os.path.join(FIXTURES_DIR, "worldbank.json")
+YAHOO_FIXTURE = os.path.join(FIXTURES_DIR, "yahoo.json")
+
+_fixtures = {}
+
+def load_fixture(path):
+    """JSON da fixture (lido uma vez por processo)."""
+    if path not in _fixtures:
+        with open(path, encoding="utf-8") as f:
+            _fixtures[path] = json.load(f)
+    return _fixtures[path]
+
+# ==========================================
+# === BANCO MUNDIAL ===
+# ==========================================
+
+def _resolve_countries(fixture, codes):
+    """Códigos ISO2/ISO3 (ou "all") -> [(ISO2, ISO3)] conhecidos da fixture."""
+    iso2_of = {iso3: iso2 for iso2, iso3 in fixture["countries"].items()}
+    if [c.lower() for c in codes] == ["all"]:
+        return sorted(fixture["countries"].items())
+    out = []
+    for code in codes:
+        code = code.upper()
+        if code in fixture["countries"]: out.append((code, fixture["countries"][code]))
+        elif code in iso2_of: out.append((iso2_of[code], code))
+    return out
+
+def wb_countries_response(fixture):
+    """Lista de países (/v2/country) com os campos que a API real devolve."""
+    rows = [{"id": iso3, "iso2Code": iso2, "name": fixture.get("names", {}).get(iso3, iso3),
+             "region": {"id": "", "iso2code": "", "value": "Aggregates" if iso3 in fixture.get("aggregates", []) else ""}}
+            for iso2, iso3 in sorted(fixture["countries"].items())]
+    return [{"page": 1, "pages": 1, "per_page": len(rows), "total": len(rows)}, rows]
+
+def wb_response(fixture, countries, indicator, years, per_page=50, page=1):
+    """Payload no formato da API v2 ([metadados, linhas]) para o pedido dado."""
+    series = fixture["indicators"].get(indicator)
+    if series is None:
+        return [{"message": [{"id": "120", "key": "Invalid value",
+                              "value": "The provided parameter value is not valid"}]}]
+    rows = []
+    for iso2, iso3 in _resolve_countries(fixture, countries):
+        values = series.get(iso3, {})
+        # A API devolve os anos do mais recente para o mais antigo
+        for year in range(years[1], years[0] - 1, -1):
+            rows.append({
+                "indicator": {"id": indicator, "value": ""},
+                "country": {"id": iso2, "value": iso3},
+                "countryiso3code": iso3,
+                "date": str(year),
+                "value": values.get(str(year)),
+                "unit": "", "obs_status": "", "decimal": 0,
+            })
+    pages = max(1, -(-len(rows) // per_page))
+    meta = {"page": page, "pages": pages, "per_page": per_page, "total": len(rows),
+            "sourceid": "2", "lastupdated": fixture.get("recorded_at", "")}
+    return [meta, rows[(page - 1) * per_page:page * per_page]]
+
+# ==========================================
+# === YAHOO ===
+# ==========================================
+
+def _search_matches(quote, query):
+    symbol = (quote.get("symbol") or "").upper()
+    words = (quote.get("shortname") or "").upper().split()
+    return symbol.startswith(query) or any(w.startswith(query) for w in words)
+
+def search_response(fixture, query, count=10):
+    """Resposta gravada para a query; sem gravação, filtra o universo de cotações."""
+    query = query.strip().upper()
+    quotes = fixture["search"].get(query)
+    if quotes is None:
+        quotes = [q for q in fixture["universe"] if _search_matches(q, query)]
+    return {"count": len(quotes[:count]), "quotes": quotes[:count], "news": []}
+
+def _statement_frame(rows):
+    if not rows: return pd.DataFrame()
+    return pd.DataFrame({"latest": list(rows.values())}, index=list(rows.keys()))
+
+class FixtureTicker:
+    """
+    Substituto do yf.Ticker com os dados gravados. Tickers fora da fixture
+    comportam-se como no yfinance: histórico vazio e demonstrações vazias.
+    latency (s) simula a ida à rede em cada chamada.
+    """
+    latency = 0.0
+
+    def __init__(self, ticker):
+        self.ticker = ticker.upper()
+        self._data = load_fixture(YAHOO_FIXTURE)["tickers"].get(self.ticker, {})
+
+    def _wait(self):
+        if FixtureTicker.latency > 0: time.sleep(FixtureTicker.latency)
+
+    def history(self, period="5d"):
+        self._wait()
+        closes = self._data.get("history", [])
+        return pd.DataFrame({"Close": closes}) if closes else pd.DataFrame()
+
+    @property
+    def info(self):
+        self._wait()
+        return dict(self._data.get("info", {}))
+
+    @property
+    def income_stmt(self):
+        return _statement_frame(self._data.get("income_stmt"))
+
+    @property
+    def cashflow(self):
+        return _statement_frame(self._data.get("cashflow"))
+
+    @property
+    def balance_sheet(self):
+        return _statement_frame(self._data.get("balance_sheet"))
+
+class FixtureYF:
+    """Módulo yfinance mínimo: só o que o api/index.py usa."""
+    Ticker = FixtureTicker
+
+# ==========================================
+# === SERVIDOR HTTP ===
+# ==========================================
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0         # s por pedido (simula a rede)
+    max_per_page = None   # teto do per_page: força várias páginas, como a API real em pedidos grandes
+    hits = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        StubHandler.hits += 1
+        if StubHandler.latency > 0: time.sleep(StubHandler.latency)
+        url = urlparse(self.path)
+        qs = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.strip("/").split("/")]
+
+        # /v2/country/<países>/indicator/<código>
+        if len(parts) == 5 and parts[0] == "v2" and parts[1] == "country" and parts[3] == "indicator":
+            fixture = load_fixture(WB_FIXTURE)
+            try:
+                y0, y1 = (int(v) for v in qs.get("date", "").split(":"))
+            except ValueError:
+                y0, y1 = fixture["years"]
+            per_page, page = int(qs.get("per_page", 50)), int(qs.get("page", 1))
+            if StubHandler.max_per_page: per_page = min(per_page, StubHandler.max_per_page)
+            return self._send(200, wb_response(fixture, parts[2].split(";"), parts[4], (y0, y1), per_page, page))
+
+        if url.path.rstrip("/") == "/v2/country":
+            return self._send(200, wb_countries_response(load_fixture(WB_FIXTURE)))
+
+        if url.path.rstrip("/") == "/v1/finance/search":
+            count = int(qs.get("quotesCount", 10))
+            return self._send(200, search_response(load_fixture(YAHOO_FIXTURE), qs.get("q", ""), count))
+
+        self._send(404, {"error": "not found", "path": url.path})
+
+class StubServer(ThreadingHTTPServer):
+    # O backlog padrão (5) deixa cair ligações de um lote concorrente e o SYN
+    # só é repetido ao fim de 1 s: a medição passaria a ser do stub, não da API
+    request_queue_size = 128
+    daemon_threads = True
+
+def start_stub(host="127.0.0.1", port=0, latency=0.0):
+    """Arranca o stub numa thread daemon. Devolve (servidor, URL base)."""
+    StubHandler.latency = latency
+    server = StubServer((host, port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def stub_env(base_url):
+    """Variáveis de ambiente que apontam o api/index.py para o stub."""
+    return {"WB_API_URL": f"{base_url}/v2", "YAHOO_SEARCH_URL": f"{base_url}/v1/finance/search"}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub offline do Banco Mundial e da pesquisa do Yahoo.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="atraso artificial por pedido")
+    args = parser.parse_args()
+    server, base = start_stub(args.host, args.port, args.latency_ms / 1000)
+    for k, v in stub_env(base).items(): print(f"{k}={v}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()